@@ -1,53 +1,540 @@
+import openai
 from openai import OpenAI
 import google.generativeai as genai
+import abc
 import concurrent.futures
-from config import OPENAI_API_KEY, OPENAI_BASE_URL, GEMINI_API_KEY, DEFAULT_MODEL
+import hashlib
+import math
+import random
+import threading
+import time
+from config import (OPENAI_API_KEY, OPENAI_BASE_URL, GEMINI_API_KEY, DEFAULT_MODEL,
+                    GEMINI_MODELS, GEMINI_TIMEOUT, GEMINI_HEDGE_DELAY,
+                    GEMINI_FAILURE_THRESHOLD, GEMINI_COOLDOWN, MODEL_EXECUTOR_WORKERS,
+                    OPENAI_TIMEOUT, LLM_DEADLINE, LLM_RETRY_ATTEMPTS, LLM_RETRY_BASE_DELAY,
+                    LLM_RETRY_MAX_DELAY, LLM_BREAKER_FAILURE_THRESHOLD, LLM_BREAKER_RESET_TIMEOUT,
+                    LLM_PROVIDER, LOCAL_LLM_LATENCY, LOCAL_LLM_TOKENS_PER_SECOND,
+                    LOCAL_LLM_CHARS_PER_TOKEN, LOCAL_LLM_MOVE_PROBABILITY,
+                    LOCAL_LLM_MOVE_TARGETS, LOCAL_LLM_SEED)
 
-# 创建 OpenAI 客户端
+# 创建 OpenAI 客户端（重试由下面的 ResiliencePolicy 统一处理，关闭SDK自带的重试）
 client = OpenAI(
     base_url=OPENAI_BASE_URL,
-    api_key=OPENAI_API_KEY
+    api_key=OPENAI_API_KEY,
+    timeout=OPENAI_TIMEOUT,
+    max_retries=0
 )
 
-def call_ai_api(model_choice, messages):
-    """调用AI API的统一方法"""
-    if model_choice == "gemini":
-        # Gemini API 调用
-        try:
-            genai.configure(api_key=GEMINI_API_KEY)
-            
+
+class LLMError(Exception):
+    """大模型调用失败：错误信息不是模型生成的内容，不能保存为AI回复"""
+
+    def __init__(self, message, retryable=False, status=None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.status = status
+
+
+class LLMTimeoutError(LLMError):
+    """超过单次请求超时或整次调用的截止时间"""
+
+    def __init__(self, message):
+        super().__init__(message, retryable=True)
+
+
+class LLMUnavailableError(LLMError):
+    """熔断中或没有可用的模型，快速失败"""
+
+
+def classify_error(error):
+    """把 OpenAI SDK 的异常转换为 LLMError，并标记是否值得重试"""
+    if isinstance(error, LLMError):
+        return error
+    if isinstance(error, openai.APITimeoutError):
+        return LLMTimeoutError(f"API超时: {error}")
+    if isinstance(error, openai.APIConnectionError):
+        return LLMError(f"API连接失败: {error}", retryable=True)
+    if isinstance(error, openai.APIStatusError):
+        status = error.status_code
+        return LLMError(f"API错误({status}): {error.message}",
+                        retryable=status in (408, 409, 429) or status >= 500, status=status)
+    return LLMError(f"API错误: {error}")
+
+
+class CircuitBreaker:
+    """熔断器：连续失败达到阈值后在 reset_timeout 秒内直接失败，之后放行一个探测请求，成功则恢复"""
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name, failure_threshold=LLM_BREAKER_FAILURE_THRESHOLD,
+                 reset_timeout=LLM_BREAKER_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self.opens = 0
+        self.rejected = 0
+
+    def before_call(self):
+        """调用前检查，熔断中抛出 LLMUnavailableError"""
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() >= self.opened_at + self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._probing = False
+            if self.state == self.OPEN or (self.state == self.HALF_OPEN and self._probing):
+                self.rejected += 1
+                raise LLMUnavailableError(f"{self.name} 暂时不可用，请稍后再试")
+            if self.state == self.HALF_OPEN:
+                self._probing = True
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.opens += 1
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self._probing = False
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'state': self.state,
+                'consecutive_failures': self.consecutive_failures,
+                'opens': self.opens,
+                'rejected': self.rejected
+            }
+
+
+class ResiliencePolicy:
+    """一次调用的截止时间 + 可重试错误的指数退避（随机抖动）重试 + 熔断"""
+
+    def __init__(self, breaker, attempts=LLM_RETRY_ATTEMPTS, base_delay=LLM_RETRY_BASE_DELAY,
+                 max_delay=LLM_RETRY_MAX_DELAY, deadline=LLM_DEADLINE, attempt_timeout=OPENAI_TIMEOUT):
+        self.breaker = breaker
+        self.attempts = max(1, int(attempts))
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.attempt_timeout = attempt_timeout
+        self._lock = threading.Lock()
+        self._stats = {'calls': 0, 'attempts': 0, 'retries': 0, 'failures': 0, 'timeouts': 0}
+
+    def backoff(self, attempt):
+        """第 attempt 次失败后的等待时间（full jitter）"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def run(self, attempt_fn):
+        """执行 attempt_fn(本次超时秒数)，失败时按策略重试，最终失败抛出 LLMError"""
+        deadline = time.monotonic() + self.deadline
+        with self._lock:
+            self._stats['calls'] += 1
+        attempt = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self._record_failure(timeout=True)
+                raise LLMTimeoutError("AI服务响应超时")
+            try:
+                self.breaker.before_call()
+            except LLMUnavailableError:
+                self._record_failure()
+                raise
+            with self._lock:
+                self._stats['attempts'] += 1
+            try:
+                result = attempt_fn(min(self.attempt_timeout, remaining))
+            except Exception as e:
+                error = classify_error(e)
+                if error.retryable:
+                    self.breaker.record_failure()
+                else:
+                    # 上游可达（例如请求参数错误），不计入熔断
+                    self.breaker.record_success()
+                delay = self.backoff(attempt)
+                attempt += 1
+                if not error.retryable or attempt >= self.attempts or time.monotonic() + delay >= deadline:
+                    self._record_failure(timeout=isinstance(error, LLMTimeoutError))
+                    raise error from e
+                with self._lock:
+                    self._stats['retries'] += 1
+                time.sleep(delay)
+                continue
+            self.breaker.record_success()
+            return result
+
+    def _record_failure(self, timeout=False):
+        with self._lock:
+            self._stats['failures'] += 1
+            if timeout:
+                self._stats['timeouts'] += 1
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['breaker'] = self.breaker.to_dict()
+        return stats
+
+# 模型调用共享的线程池（进程生命周期内复用，不再每次调用新建）
+model_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=MODEL_EXECUTOR_WORKERS, thread_name_prefix='model-call'
+)
+
+
+class ModelHealth:
+    """记录单个模型的成功/失败情况，连续失败过多时暂时跳过"""
+
+    def __init__(self, failure_threshold=GEMINI_FAILURE_THRESHOLD, cooldown=GEMINI_COOLDOWN):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.successes = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.consecutive_failures = 0
+        self.skip_until = 0.0
+        self.avg_latency = None
+
+    def is_available(self, now):
+        return now >= self.skip_until
+
+    def record_success(self, latency):
+        self.successes += 1
+        self.consecutive_failures = 0
+        self.skip_until = 0.0
+        # 指数滑动平均
+        self.avg_latency = latency if self.avg_latency is None else self.avg_latency * 0.8 + latency * 0.2
+
+    def record_failure(self, timeout=False):
+        self.failures += 1
+        if timeout:
+            self.timeouts += 1
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= self.failure_threshold:
+            self.skip_until = time.monotonic() + self.cooldown
+
+    def to_dict(self):
+        return {
+            'successes': self.successes,
+            'failures': self.failures,
+            'timeouts': self.timeouts,
+            'consecutive_failures': self.consecutive_failures,
+            'available': self.is_available(time.monotonic()),
+            'avg_latency': self.avg_latency
+        }
+
+
+class GeminiClient:
+    """Gemini 客户端：只配置一次、复用模型对象，并对多个备选模型做对冲请求"""
+
+    def __init__(self, api_key=GEMINI_API_KEY, model_names=GEMINI_MODELS, timeout=GEMINI_TIMEOUT,
+                 hedge_delay=GEMINI_HEDGE_DELAY, executor=model_executor):
+        self.api_key = api_key
+        self.model_names = list(model_names)
+        self.timeout = timeout
+        self.hedge_delay = hedge_delay
+        self.executor = executor
+        self._lock = threading.Lock()
+        self._configured = False
+        self._models = {}
+        self.health = {name: ModelHealth() for name in self.model_names}
+
+    def _get_model(self, model_name):
+        """获取（必要时创建）模型对象"""
+        with self._lock:
+            if not self._configured:
+                genai.configure(api_key=self.api_key)
+                self._configured = True
+            model = self._models.get(model_name)
+            if model is None:
+                model = self._models[model_name] = genai.GenerativeModel(model_name)
+            return model
+
+    def _candidates(self):
+        """按配置顺序返回当前可用的模型；全部被跳过时仍全部尝试"""
+        now = time.monotonic()
+        with self._lock:
+            available = [name for name in self.model_names if self.health[name].is_available(now)]
+        return available or list(self.model_names)
+
+    def _launch(self, model_name, prompt):
+        """在共享线程池中调用一个模型，完成时记录健康状况"""
+        started = time.monotonic()
+
+        def run():
+            return self._get_model(model_name).generate_content(prompt).text.strip()
+
+        future = self.executor.submit(run)
+
+        def record(done):
+            with self._lock:
+                if done.exception() is None and done.result():
+                    self.health[model_name].record_success(time.monotonic() - started)
+                elif not getattr(done, 'timed_out', False):
+                    self.health[model_name].record_failure()
+
+        future.add_done_callback(record)
+        return future
+
+    def generate(self, prompt):
+        """对冲请求：先调用首选模型，超过 hedge_delay 未返回或失败时并行启动下一个，先成功者胜出
+
+        全部失败或超时返回None
+        """
+        candidates = self._candidates()
+        deadline = time.monotonic() + self.timeout
+        futures = {}
+        next_index = 0
+        next_launch = time.monotonic()
+
+        while True:
+            now = time.monotonic()
+            pending = [future for future in futures if not future.done()]
+            if next_index < len(candidates) and (not pending or now >= next_launch):
+                model_name = candidates[next_index]
+                futures[self._launch(model_name, prompt)] = model_name
+                next_index += 1
+                next_launch = now + self.hedge_delay
+                continue
+
+            if not pending:
+                return None
+
+            wait_until = deadline if next_index >= len(candidates) else min(deadline, next_launch)
+            done, _ = concurrent.futures.wait(
+                pending, timeout=max(0.0, wait_until - now),
+                return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                if future.exception() is None and future.result():
+                    return future.result()
+
+            if time.monotonic() >= deadline:
+                # 超时的模型记为失败；它们稍后完成时不再重复计入
+                with self._lock:
+                    for future in futures:
+                        if not future.done():
+                            future.timed_out = True
+                            self.health[futures[future]].record_failure(timeout=True)
+                return None
+
+    def get_stats(self):
+        """获取各模型的健康状况"""
+        with self._lock:
+            return {name: health.to_dict() for name, health in self.health.items()}
+
+
+gemini_client = GeminiClient()
+
+
+class LLMProvider(abc.ABC):
+    """大模型后端接口"""
+    name = 'base'
+
+    @abc.abstractmethod
+    def complete(self, model_choice, messages):
+        """返回完整回复"""
+
+    def stream(self, model_choice, messages):
+        """逐段产出回复文本（默认整段返回）"""
+        yield self.complete(model_choice, messages)
+
+    def get_stats(self):
+        """后端指标"""
+        return {}
+
+
+def _chunk_text(chunk):
+    """流式响应中一段的文本，没有内容时返回空字符串"""
+    if not chunk.choices:
+        return ''
+    return chunk.choices[0].delta.content or ''
+
+
+class RemoteProvider(LLMProvider):
+    """远程API：OpenAI兼容接口（xiaoai.plus）或 Gemini
+
+    失败时抛出 LLMError，而不是返回错误文本
+    """
+    name = 'remote'
+
+    def __init__(self):
+        self.policy = ResiliencePolicy(CircuitBreaker('AI服务'))
+
+    def complete(self, model_choice, messages):
+        if model_choice == "gemini":
+            # Gemini API 调用（对冲请求自带超时和模型健康检查）
             # 构建提示词
             prompt = "\n".join([f"{m['role']}: {m['content']}" for m in messages])
-            
-            # 尝试不同的模型名称
-            model_names = ['gemini-1.5-pro', 'gemini-pro', 'gemini-1.5-flash']
-            
-            for model_name in model_names:
-                try:
-                    model = genai.GenerativeModel(model_name)
-                    
-                    with concurrent.futures.ThreadPoolExecutor() as executor:
-                        future = executor.submit(model.generate_content, prompt)
-                        try:
-                            response = future.result(timeout=15)
-                            return response.text.strip()
-                        except concurrent.futures.TimeoutError:
-                            continue
-                except Exception:
-                    continue
-            
-            return "所有Gemini模型都无法访问，请检查API Key或网络连接"
-                    
-        except Exception as e:
-            return f"Gemini API配置失败: {e}"
-    else:
+            try:
+                reply = gemini_client.generate(prompt)
+            except Exception as e:
+                raise LLMError(f"Gemini API配置失败: {e}") from e
+            if not reply:
+                raise LLMUnavailableError("所有Gemini模型都无法访问，请检查API Key或网络连接")
+            return reply
+
         # 使用默认模型通过 xiaoai.plus
-        try:
+        def attempt(timeout):
             response = client.chat.completions.create(
                 model=DEFAULT_MODEL,
-                messages=messages
+                messages=messages,
+                timeout=timeout
             )
-            reply = response.choices[0].message.content
-            return reply
+            return response.choices[0].message.content
+
+        return self.policy.run(attempt)
+
+    def stream(self, model_choice, messages):
+        if model_choice == "gemini":
+            # Gemini 分支暂不支持流式，整段返回
+            yield self.complete(model_choice, messages)
+            return
+
+        # 连接失败和首段超时可以重试；已经开始输出后出错直接抛出
+        def attempt(timeout):
+            stream = client.chat.completions.create(
+                model=DEFAULT_MODEL,
+                messages=messages,
+                stream=True,
+                timeout=timeout
+            )
+            for chunk in stream:
+                text = _chunk_text(chunk)
+                if text:
+                    return text, stream
+            return '', stream
+
+        first, stream = self.policy.run(attempt)
+        if first:
+            yield first
+        try:
+            for chunk in stream:
+                text = _chunk_text(chunk)
+                if text:
+                    yield text
         except Exception as e:
-            return f"API错误: {str(e)}"
+            error = classify_error(e)
+            if error.retryable:
+                self.policy.breaker.record_failure()
+            raise error from e
+        finally:
+            close = getattr(stream, 'close', None)
+            if close:
+                close()
+
+    def get_stats(self):
+        return self.policy.get_stats()
+
+
+# 本地替身后端使用的跑团风格回复
+LOCAL_CANNED_REPLIES = [
+    "🎲 你推开吱呀作响的木门，昏黄的烛光下，一位披着斗篷的旅人抬头看了你一眼，又低头喝起了麦酒。",
+    "🎲 林间传来一阵窸窣声，你握紧武器。一只野兔窜出草丛，消失在远处的灌木中。你松了口气，继续前行。",
+    "🎲 铁匠擦了擦额头的汗水：“想要一把好剑？先让我看看你的金币。”炉火映红了他粗糙的脸。",
+    "🎲 你掷出骰子——17！你敏捷地避开了陷阱，脚下的石板咔哒一声陷了下去，一支箭矢擦着你的肩膀飞过。",
+    "🎲 图书馆里弥漫着旧羊皮纸的气味。管理员压低声音说：“禁书区不对外开放，除非你能证明自己的身份。”",
+    "🎲 市场上人声鼎沸，商贩们高声叫卖。一个小男孩撞了你一下，你下意识摸了摸钱袋——还在。",
+    "🎲 夜幕降临，营火噼啪作响。远处传来狼嚎，同伴们不安地对视了一眼。你决定安排守夜。",
+    "🎲 哥布林发出刺耳的尖叫，挥舞着生锈的短刀向你扑来！请决定你的行动：攻击、防御还是逃跑？",
+]
+
+
+class LocalStandInProvider(LLMProvider):
+    """本地替身后端：不访问网络，按配置模拟首字延迟和生成速度，用于压测和离线运行
+
+    同样的对话内容总是得到同样的回复和延迟（以最后一条消息和种子决定随机数），便于对比测试结果
+    """
+    name = 'local'
+
+    def __init__(self, latency=LOCAL_LLM_LATENCY, tokens_per_second=LOCAL_LLM_TOKENS_PER_SECOND,
+                 chars_per_token=LOCAL_LLM_CHARS_PER_TOKEN, move_probability=LOCAL_LLM_MOVE_PROBABILITY,
+                 move_targets=LOCAL_LLM_MOVE_TARGETS, seed=LOCAL_LLM_SEED, replies=LOCAL_CANNED_REPLIES):
+        self.latency = dict(latency)
+        self.tokens_per_second = tokens_per_second
+        self.chars_per_token = max(1, int(chars_per_token))
+        self.move_probability = move_probability
+        self.move_targets = list(move_targets)
+        self.seed = seed
+        self.replies = list(replies)
+
+    def _rng(self, messages):
+        """由对话内容决定的随机数生成器"""
+        last = messages[-1]['content'] if messages else ''
+        digest = hashlib.sha256(f"{self.seed}:{len(messages)}:{last}".encode('utf-8')).digest()
+        return random.Random(int.from_bytes(digest[:8], 'big'))
+
+    def _first_token_latency(self, rng):
+        """按配置的分布抽取首字延迟（秒）"""
+        distribution = self.latency.get('distribution', 'fixed')
+        if distribution == 'lognormal':
+            value = rng.lognormvariate(math.log(self.latency.get('median', 0.5)), self.latency.get('sigma', 0.5))
+        elif distribution == 'uniform':
+            value = rng.uniform(self.latency.get('min', 0.0), self.latency.get('max', 1.0))
+        else:
+            value = self.latency.get('median', 0.5)
+        return min(value, self.latency.get('cap', 30.0))
+
+    def _generate(self, messages):
+        """返回 (首字延迟, 回复分段)"""
+        rng = self._rng(messages)
+        reply = rng.choice(self.replies)
+        if self.move_targets and rng.random() < self.move_probability:
+            reply += f"\n\n**MOVE_TO:{rng.choice(self.move_targets)}**"
+        size = self.chars_per_token
+        tokens = [reply[i:i + size] for i in range(0, len(reply), size)]
+        return self._first_token_latency(rng), tokens
+
+    def complete(self, model_choice, messages):
+        latency, tokens = self._generate(messages)
+        if self.tokens_per_second:
+            latency += len(tokens) / self.tokens_per_second
+        time.sleep(latency)
+        return ''.join(tokens)
+
+    def stream(self, model_choice, messages):
+        latency, tokens = self._generate(messages)
+        time.sleep(latency)
+        interval = 1.0 / self.tokens_per_second if self.tokens_per_second else 0.0
+        for index, token in enumerate(tokens):
+            if index and interval:
+                time.sleep(interval)
+            yield token
+
+
+LLM_PROVIDERS = {
+    RemoteProvider.name: RemoteProvider,
+    LocalStandInProvider.name: LocalStandInProvider,
+}
+
+
+def create_provider(name):
+    """按名称创建大模型后端"""
+    if name not in LLM_PROVIDERS:
+        raise ValueError(f"未知的LLM后端: {name}（可选: {', '.join(LLM_PROVIDERS)}）")
+    return LLM_PROVIDERS[name]()
+
+
+# 当前使用的大模型后端（config.LLM_PROVIDER，可用环境变量 AIGAME_LLM_PROVIDER 覆盖）
+llm_provider = create_provider(LLM_PROVIDER)
+if llm_provider.name != RemoteProvider.name:
+    print(f"⚠️ 使用本地LLM替身后端: {llm_provider.name}")
+
+def call_ai_api(model_choice, messages):
+    """调用AI API的统一方法，失败时抛出 LLMError"""
+    return llm_provider.complete(model_choice, messages)
+
+def stream_ai_api(model_choice, messages):
+    """流式调用AI API，逐段产出回复文本，失败时抛出 LLMError"""
+    return llm_provider.stream(model_choice, messages)
@@ -1,22 +1,29 @@
 # -*- coding: utf-8 -*-
-from flask import Flask, request, jsonify, session, send_from_directory
+from flask import Flask, Response, request, jsonify, session, send_from_directory, stream_with_context
 import sys
+import time
 import uuid
 import os
 from datetime import datetime
 from functools import wraps
-from api_client import call_ai_api
-from user_manager import UserManager
+from api_client import call_ai_api, stream_ai_api, gemini_client, llm_provider, LLMError
+from chat_stream import MOVE_TO_PATTERN, MoveDirectiveFilter, sse_event, sse_event_bytes
+from llm_gateway import llm_gateway, LLMGatewayError
+from prompt_context import ContextBuilder
+from response_cache import response_cache
+from user_manager import UserManager, PlayerWriteError
 from history_manager import HistoryManager
 # from item_manager import ItemManager  # 已替换为配置管理器
 from models.config_manager import config_manager
 from database import DatabaseManager
 from database_separation import db_separation_manager
 from room_manager import RoomManager
+from room_store import RoomStore
+from room_bus import create_room_bus
 from models.event import event_manager
 from models.skill import skill_manager
 from models.creature import creature_manager
-from config import DEFAULT_MODEL, game_prompts
+from config import DEFAULT_MODEL, CONFIG_WATCH_INTERVAL, ROOM_HEARTBEAT_INTERVAL, game_prompts
 
 sys.stdout.reconfigure(encoding='utf-8')
 
@@ -24,12 +31,27 @@ sys.stdout.reconfigure(encoding='utf-8')
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-here-please-change-in-production'
 
+# 启动时先创建游戏数据库的表并执行迁移，之后的模块级初始化和后台线程都依赖最新的表结构
+db_separation_manager.ensure_game_schema()
+
 # 创建管理器实例
 user_manager = UserManager()
 history_manager = HistoryManager()
+context_builder = ContextBuilder(history_manager, call_ai_api)
 # item_manager = ItemManager()  # 已替换为配置管理器
 db_manager = db_separation_manager  # 使用数据库分离管理器
-room_manager = RoomManager()
+room_manager = RoomManager(store=RoomStore(db_manager), bus=create_room_bus())
+
+# 后台定期执行WAL检查点，防止WAL文件无限增长
+db_manager.start_checkpoint_thread()
+# 后台同步登出记录、分批清理过期会话
+user_manager.sessions.start_background()
+# 后台批量写入房间消息、定期清理过期消息
+room_manager.store.start_background()
+# 订阅其他工作进程/节点广播的房间事件
+room_manager.bus.start()
+# 后台按到期时间清理不活跃的用户和房间
+room_manager.start_janitor()
 
 # 位置映射配置（全局）
 location_mappings = {
@@ -71,60 +93,65 @@ location_mappings = {
 
 # 加载配置文件
 def load_config_files():
-    """加载配置文件到应用"""
+    """从配置管理器的当前快照加载配置到应用（不再单独解析JSON）"""
     try:
-        import json
-        
         # 加载位置配置
-        location_config_path = os.path.join('control_data', 'location_control.json')
-        if os.path.exists(location_config_path):
-            with open(location_config_path, 'r', encoding='utf-8') as f:
-                app.location_data = json.load(f)
-                print(f"✅ 已加载位置配置: {len(app.location_data['locations'])} 个位置")
+        location_data = config_manager.get_raw_config('locations')
+        if location_data:
+            app.location_data = location_data
+            print(f"✅ 已加载位置配置: {len(app.location_data['locations'])} 个位置")
         
         # 加载事件配置
-        event_config_path = os.path.join('control_data', 'event_control.json')
-        if os.path.exists(event_config_path):
-            with open(event_config_path, 'r', encoding='utf-8') as f:
-                app.event_data = json.load(f)
-                print(f"✅ 已加载事件配置: {len(app.event_data['events'])} 个事件")
+        event_data = config_manager.get_raw_config('events')
+        if event_data:
+            app.event_data = event_data
+            print(f"✅ 已加载事件配置: {len(app.event_data['events'])} 个事件")
                 
         # 加载生物配置
-        creature_config_path = os.path.join('control_data', 'creature_control.json')
-        if os.path.exists(creature_config_path):
-            with open(creature_config_path, 'r', encoding='utf-8') as f:
-                app.creature_data = json.load(f)
-                print(f"✅ 已加载生物配置: {len(app.creature_data['creatures'])} 个生物")
+        creature_data = config_manager.get_raw_config('creatures')
+        if creature_data:
+            app.creature_data = creature_data
+            print(f"✅ 已加载生物配置: {len(app.creature_data['creatures'])} 个生物")
                 
     except Exception as e:
         print(f"⚠️ 加载配置文件失败: {e}")
 
-# 在应用启动时加载配置
+def on_config_reloaded(changed, snapshot):
+    """control_data 热重载后：刷新应用内配置，重建对应的世界数据库表"""
+    load_config_files()
+    db_manager.rebuild_world_tables(changed)
+    if 'items' in changed:
+        # 物品属性可能变化：重算所有玩家的装备加成（同时清空玩家缓存）
+        count = user_manager.recompute_equipment_stats()
+        print(f"🔄 已重新计算 {count} 名玩家的装备属性加成")
+
+# 在应用启动时加载配置，并监视配置文件变化
 load_config_files()
+user_manager.recompute_equipment_stats(only_missing=True)
+config_manager.add_reload_listener(on_config_reloaded)
+config_manager.start_watcher(CONFIG_WATCH_INTERVAL)
 
 def get_creature_data(creature_id):
     """从世界数据库中获取生物数据，转换为战斗用格式"""
     try:
-        import sqlite3
         import json
         
         # 连接世界数据库
-        world_db_path = os.path.join(os.path.dirname(__file__), 'world_data.db')
+        world_db_path = db_manager.world_db_path
         if not os.path.exists(world_db_path):
             print(f"⚠️ 世界数据库不存在: {world_db_path}")
             return None
             
-        conn = sqlite3.connect(world_db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT creature_name, avatar, base_stats, experience_reward, gold_reward
-            FROM creatures 
-            WHERE creature_id = ?
-        ''', (creature_id,))
-        
-        result = cursor.fetchone()
-        conn.close()
+        with db_manager.world_pool.connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                SELECT creature_name, avatar, base_stats, experience_reward, gold_reward
+                FROM creatures 
+                WHERE creature_id = ?
+            ''', (creature_id,))
+            
+            result = cursor.fetchone()
         
         if result:
             creature_name, avatar, base_stats_json, experience_reward, gold_reward_json = result
@@ -180,9 +207,28 @@ def require_auth(f):
         
         # 将用户名添加到请求上下文
         request.username = username
-        return f(*args, **kwargs)
+        
+        # 请求内同一玩家只加载一次，请求结束时在一个事务中写回修改
+        try:
+            with user_manager.unit_of_work():
+                return f(*args, **kwargs)
+        except PlayerWriteError as e:
+            # 只处理写回本身的失败，接口自身的异常按原样处理
+            print(f"❌ 写回用户数据失败: {e}")
+            return jsonify({'success': False, 'error': f'保存用户数据失败: {str(e)}'}), 500
     return decorated_function
 
+def llm_busy_response(error):
+    """LLM网关过载/超时时的统一响应"""
+    return jsonify({'success': False, 'error': str(error), 'busy': True}), 503, {'Retry-After': '5'}
+
+def llm_error_response(error):
+    """大模型调用失败时的统一响应（错误信息不会作为AI回复保存）"""
+    if error.retryable or error.status is None:
+        # 超时、上游暂时不可用或熔断中：稍后重试
+        return jsonify({'success': False, 'error': str(error), 'busy': True}), 503, {'Retry-After': '5'}
+    return jsonify({'success': False, 'error': str(error)}), 502
+
 # 应用物品效果
 def apply_item_effect(username, effect_str, quantity=1):
     """解析并应用物品效果"""
@@ -285,10 +331,7 @@ def logout():
     try:
         session_token = request.headers.get('X-Session-Token')
         # 删除会话令牌
-        db_manager.execute_query(
-            "DELETE FROM user_sessions WHERE session_token = ?",
-            (session_token,)
-        )
+        user_manager.logout(session_token)
         return jsonify({'success': True, 'message': '登出成功'})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
@@ -310,10 +353,105 @@ def validate_session():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
+def build_chat_messages(username, character, message, is_regenerate):
+    """根据对话历史构建发送给AI的消息列表（按模型的token预算截取，较早的对话以摘要代替）"""
+    system_prompt = game_prompts.get(character, game_prompts.get('龙与地下城', ''))
+    
+    # 添加玩家位置信息到系统提示
+    location_info = db_manager.get_user_location(username)
+    if location_info:
+        location_context = (f'\n\n【当前状态】玩家{username}现在位于：{location_info["area_display_name"]} - {location_info["location_display_name"]}'
+                          f'（{location_info["description"]}）')
+        system_prompt += location_context
+    
+    return context_builder.build(username, character, system_prompt, message, is_regenerate, DEFAULT_MODEL)
+
+def apply_move_directive(username, target_location):
+    """执行AI回复中的移动指令，返回 (是否移动成功, 需要追加到回复末尾的文本)"""
+    # 检查是否是有效地点
+    if target_location not in location_mappings:
+        print(f"❌ 无效的移动目标: {target_location}")
+        return False, ''
+    
+    actual_location = location_mappings[target_location]
+    success, message = db_manager.update_user_location(username, actual_location)
+    if not success:
+        print(f"❌ 玩家移动失败: {message}")
+        return False, ''
+    
+    print(f"✅ 玩家 {username} 移动到了 {actual_location}")
+    
+    # 检查是否触发特定位置事件
+    if actual_location == 'forest':
+        # 触发村外森林的哥布林战斗事件
+        user_data = user_manager.get_user_data(username)
+        if user_data:
+            battle_event = {
+                'type': 'battle',
+                'location': 'forest',
+                'enemy': 'goblin',
+                'message': '你在村外森林遭遇了一只普通哥布林！'
+            }
+            return True, f"\n\n【战斗触发】{battle_event['message']}"
+    
+    return True, ''
+
+def save_chat_reply(username, character, message, reply, is_regenerate):
+    """保存本轮对话"""
+    if is_regenerate:
+        # 重新生成：只保存AI回复
+        history_manager.save_message(username, character, 'assistant', reply)
+    else:
+        # 正常聊天：保存用户消息和AI回复
+        history_manager.save_message(username, character, 'user', message)
+        history_manager.save_message(username, character, 'assistant', reply)
+
+def stream_chat_reply(username, character, message, is_regenerate, stream):
+    """以SSE逐段推送AI回复，移动指令在流中被去掉，结束后保存完整回复"""
+    directive_filter = MoveDirectiveFilter()
+    parts = []
+    saved = False
+    failed = False
+    try:
+        for chunk in stream:
+            text = directive_filter.feed(chunk)
+            if text:
+                parts.append(text)
+                yield sse_event({'type': 'delta', 'text': text})
+        
+        text = directive_filter.finish()
+        if text:
+            parts.append(text)
+            yield sse_event({'type': 'delta', 'text': text})
+        
+        if directive_filter.target:
+            moved, extra = apply_move_directive(username, directive_filter.target)
+            if extra:
+                parts.append(extra)
+                yield sse_event({'type': 'delta', 'text': extra})
+        
+        reply = ''.join(parts).strip()
+        save_chat_reply(username, character, message, reply, is_regenerate)
+        saved = True
+        yield sse_event({'type': 'done', 'reply': reply, 'response': reply})
+    except LLMError as e:
+        # 调用失败：只通知前端，不保存为AI回复
+        failed = True
+        yield sse_event({'type': 'error', 'error': str(e), 'retryable': e.retryable})
+    except Exception as e:
+        failed = True
+        yield sse_event({'type': 'error', 'error': str(e)})
+    finally:
+        # 释放LLM网关名额（客户端中途断开时也会执行）
+        stream.close()
+        # 客户端中途断开时，保存已经推送给玩家的部分
+        if not saved and not failed and parts:
+            save_chat_reply(username, character, message, ''.join(parts).strip(), is_regenerate)
+
 @app.route('/chat', methods=['POST'])
 @require_auth
 def chat():
-    """处理聊天请求"""
+    """处理聊天请求（请求体带 stream: true 时以SSE流式返回）"""
     try:
         data = request.json
         message = data.get('message', '')
@@ -323,89 +461,42 @@ def chat():
         is_regenerate = data.get('regenerate', False)
         username = request.username  # 从认证装饰器获取用户名
         
-        # 从数据库加载当前角色的对话历史
-        current_messages = history_manager.get_character_history(username, character)
+        temp_messages = build_chat_messages(username, character, message, is_regenerate)
         
-        if is_regenerate:
-            # 重新生成：不添加新的用户消息，只重新生成最后的AI回复
-            if len(current_messages) >= 2 and current_messages[-1]['role'] == 'assistant':
-                # 移除最后的AI回复，重新生成
-                current_messages.pop()
-                temp_messages = current_messages.copy()
-            else:
-                # 如果没有找到要重新生成的消息，按正常流程处理
-                temp_messages = current_messages.copy()
-                temp_messages.append({'role': 'user', 'content': message})
-        else:
-            # 正常聊天：构建消息历史
-            temp_messages = current_messages.copy()
-            temp_messages.append({'role': 'user', 'content': message})
+        # 经LLM网关调用，按用户公平排队
+        gateway_key = f"user:{username}"
         
-        # 如果没有历史消息，添加系统提示词
-        if not temp_messages or temp_messages[0].get('role') != 'system':
-            system_prompt = game_prompts.get(character, game_prompts.get('龙与地下城', ''))
-            
-            # 添加玩家位置信息到系统提示
-            location_info = db_manager.get_user_location(username)
-            if location_info:
-                location_context = (f'\n\n【当前状态】玩家{username}现在位于：{location_info["area_display_name"]} - {location_info["location_display_name"]}'
-                                  f'（{location_info["description"]}）')
-                system_prompt += location_context
-            
-            if system_prompt:
-                temp_messages.insert(0, {'role': 'system', 'content': system_prompt})
+        if data.get('stream'):
+            stream = llm_gateway.open_stream(gateway_key, stream_ai_api, DEFAULT_MODEL, temp_messages)
+            return Response(
+                stream_with_context(stream_chat_reply(username, character, message, is_regenerate, stream)),
+                mimetype='text/event-stream',
+                headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+            )
         
         # 调用AI API
-        reply = call_ai_api(DEFAULT_MODEL, temp_messages)
+        reply = llm_gateway.call(gateway_key, call_ai_api, DEFAULT_MODEL, temp_messages)
         
         # 检查AI回复中是否包含移动指令（支持带**的格式）
         if reply and 'MOVE_TO:' in reply:
-            # 提取移动目标（处理带**的格式）
-            import re
-            move_pattern = r'\*?\*?MOVE_TO:([^\*\s]+)\*?\*?'
-            match = re.search(move_pattern, reply)
+            match = MOVE_TO_PATTERN.search(reply)
             if match:
-                target_location = match.group(1).strip()
-                
-                # 检查是否是有效地点
-                if target_location in location_mappings:
-                    actual_location = location_mappings[target_location]
-                    success, message = db_manager.update_user_location(username, actual_location)
-                    if success:
-                        print(f"✅ 玩家 {username} 移动到了 {actual_location}")
-                        
-                        # 检查是否触发特定位置事件
-                        if actual_location == 'forest':
-                            # 触发村外森林的哥布林战斗事件
-                            user_data = user_manager.get_user_data(username)
-                            if user_data:
-                                battle_event = {
-                                    'type': 'battle',
-                                    'location': 'forest',
-                                    'enemy': 'goblin',
-                                    'message': '你在村外森林遭遇了一只普通哥布林！'
-                                }
-                                reply += f"\n\n【战斗触发】{battle_event['message']}"
-                        
-                        # 从回复中移除移动指令（支持带**的格式）
-                        reply = re.sub(r'\*?\*?MOVE_TO:[^\*\s]+\*?\*?', '', reply).strip()
-                    else:
-                        print(f"❌ 玩家移动失败: {message}")
-                else:
-                    print(f"❌ 无效的移动目标: {target_location}")
+                moved, extra = apply_move_directive(username, match.group(1).strip())
+                if moved:
+                    reply += extra
+                    # 从回复中移除移动指令（支持带**的格式）
+                    reply = MOVE_TO_PATTERN.sub('', reply).strip()
             else:
                 print("❌ 无法解析移动指令")
         
-        if is_regenerate:
-            # 重新生成：只保存AI回复
-            history_manager.save_message(username, character, 'assistant', reply)
-        else:
-            # 正常聊天：保存用户消息和AI回复
-            history_manager.save_message(username, character, 'user', message)
-            history_manager.save_message(username, character, 'assistant', reply)
+        save_chat_reply(username, character, message, reply, is_regenerate)
         
         return jsonify({'success': True, 'response': reply, 'reply': reply})
         
+    except LLMGatewayError as e:
+        return llm_busy_response(e)
+    except LLMError as e:
+        return llm_error_response(e)
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
@@ -720,9 +811,6 @@ def leave_room():
 def get_room_list():
     """获取房间列表"""
     try:
-        # 清理不活跃的房间
-        room_manager.cleanup_inactive_rooms()
-        
         rooms = room_manager.get_room_list()
         return jsonify({'success': True, 'rooms': rooms})
         
@@ -856,7 +944,13 @@ def trigger_dm_response():
             ]
             
             print(f"正在生成AI回应...")
-            dm_reply = call_ai_api(DEFAULT_MODEL, temp_messages)
+            # 相同的互动复用缓存的回应；请求体带 cache: false 时每次重新生成
+            # 未命中时经LLM网关调用，按房间公平排队
+            dm_reply = response_cache.get_or_call(
+                DEFAULT_MODEL, temp_messages,
+                lambda: llm_gateway.call(f"room:{room_id}", call_ai_api, DEFAULT_MODEL, temp_messages),
+                bypass=data.get('cache', True) is False
+            )
             
             if not dm_reply or dm_reply.strip() == "":
                 dm_reply = f"🎲 主持人注意到了这个互动并点了点头..."
@@ -864,6 +958,9 @@ def trigger_dm_response():
             else:
                 print(f"AI回应生成成功，长度: {len(dm_reply)}")
                 
+        except LLMGatewayError as e:
+            print(f"AI回应未能生成: {e}")
+            return llm_busy_response(e)
         except Exception as e:
             print(f"AI回应生成失败: {e}")
             dm_reply = f"🎲 主持人注意到了这个互动：{interaction_content}"
@@ -895,55 +992,93 @@ def get_room_messages():
         username = request.username
         room_id = data.get('room_id', '')
         since_timestamp = data.get('since_timestamp', 0)
-        
-        print(f"=== 获取房间消息 ===")
-        print(f"用户: {username}")
-        print(f"房间ID: {room_id}")
-        print(f"时间戳: {since_timestamp}")
+        since_id = data.get('since_id', 0)
         
         room = room_manager.get_room(room_id)
         if not room:
-            print(f"错误: 房间 {room_id} 不存在")
             return jsonify({'success': False, 'error': '房间不存在'})
         
-        print(f"房间总消息数量: {len(room.messages)}")
-        for i, msg in enumerate(room.messages):
-            print(f"消息 {i}: {msg.sender} -> {msg.content} (类型: {msg.message_type}, 时间戳: {msg.timestamp})")
-        
         if not room.is_user_in_room(username):
-            print(f"错误: 用户 {username} 不在房间中")
             return jsonify({'success': False, 'error': '您不在此房间中'})
         
         # 更新用户活动时间
         room.update_user_activity(username)
         
-        messages = room.get_messages_for_user(username, since_timestamp)
-        print(f"用户可见消息数量: {len(messages)}")
-        
-        # 转换消息格式
-        formatted_messages = []
-        for msg in messages:
-            formatted_messages.append({
-                'id': msg.id,
-                'sender': msg.sender,
-                'content': msg.content,
-                'message_type': msg.message_type,
-                'target_user': msg.target_user,
-                'timestamp': msg.timestamp
-            })
+        messages = room.get_messages_for_user(username, since_timestamp, since_id)
         
         return jsonify({
             'success': True,
-            'messages': formatted_messages,
-            'room_info': {
-                'host_mode': room.host_mode,
-                'users': room.get_user_list()
-            }
+            'messages': [format_room_message(msg) for msg in messages],
+            'room_info': format_room_info(room)
         })
         
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
+def format_room_message(msg):
+    """房间消息的接口格式"""
+    return msg.to_dict()
+
+def format_room_info(room):
+    """房间状态的接口格式"""
+    return {
+        'host_mode': room.host_mode,
+        'users': room.get_user_list()
+    }
+
+def room_event_stream(room, username, last_seq):
+    """房间推送：新消息（按用户可见性过滤）、房间状态变化和心跳"""
+    room.connect(username)
+    try:
+        state_version = None
+        last_touch = time.monotonic()
+        while not room.closed and room.is_user_in_room(username):
+            messages, room_seq, current_version = room.read_updates(username, last_seq)
+            if current_version != state_version:
+                state_version = current_version
+                yield sse_event(format_room_info(room), event='room_info')
+            for msg in messages:
+                yield sse_event_bytes(msg.encode(), event='message', event_id=msg.seq)
+            last_seq = room_seq
+            
+            if not room.wait_for_update(room_seq, state_version, ROOM_HEARTBEAT_INTERVAL):
+                # 心跳：维持在线状态，也让断开的连接尽快被发现
+                room.update_user_activity(username)
+                last_touch = time.monotonic()
+                yield ": heartbeat\n\n"
+            elif time.monotonic() - last_touch >= ROOM_HEARTBEAT_INTERVAL:
+                # 持续有新消息、没有心跳时也按心跳间隔刷新活动时间
+                room.update_user_activity(username)
+                last_touch = time.monotonic()
+    finally:
+        room.disconnect(username)
+
+@app.route('/room_events', methods=['POST'])
+@require_auth
+def room_events():
+    """以SSE推送房间消息；重连时通过 Last-Event-ID 头或 last_id 参数从上次收到的消息之后继续"""
+    try:
+        data = request.json or {}
+        username = request.username
+        room_id = data.get('room_id', '')
+        last_id = int(request.headers.get('Last-Event-ID') or data.get('last_id') or 0)
+        
+        room = room_manager.get_room(room_id)
+        if not room:
+            return jsonify({'success': False, 'error': '房间不存在'})
+        
+        if not room.is_user_in_room(username):
+            return jsonify({'success': False, 'error': '您不在此房间中'})
+        
+        return Response(
+            room_event_stream(room, username, last_id),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+        
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
 @app.route('/set_host_mode', methods=['POST'])
 @require_auth
 def set_host_mode():
@@ -961,7 +1096,7 @@ def set_host_mode():
         if room.host_username != username:
             return jsonify({'success': False, 'error': '只有房主可以设置模式'})
         
-        room.host_mode = host_mode
+        room_manager.set_host_mode(room_id, host_mode)
         
         return jsonify({
             'success': True,
@@ -970,6 +1105,32 @@ def set_host_mode():
         
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
+# ======= 运行指标 API =======
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """获取服务运行指标（连接池等）"""
+    try:
+        return jsonify({
+            'success': True,
+            'db_pool': db_manager.get_pool_stats(),
+            'db_settings': db_manager.get_db_settings(),
+            'wal_checkpoint': db_manager.get_checkpoint_stats(),
+            'config': config_manager.get_reload_stats(),
+            'players': user_manager.get_player_stats(),
+            'sessions': user_manager.sessions.get_stats(),
+            'llm_gateway': llm_gateway.get_stats(),
+            'gemini_models': gemini_client.get_stats(),
+            'llm_provider': llm_provider.name,
+            'llm_resilience': llm_provider.get_stats(),
+            'prompt_context': context_builder.get_stats(),
+            'llm_cache': response_cache.get_stats(),
+            'rooms': room_manager.store.get_stats(),
+            'room_bus': room_manager.bus.get_stats(),
+            'room_janitor': room_manager.get_stats()
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
 # ======= 地图系统 API =======
 @app.route('/get_user_location', methods=['GET'])
 @require_auth
@@ -1306,6 +1467,7 @@ def purchase_item():
             return jsonify({'success': False, 'error': '缺少必要参数'})
         
         success, message = db_manager.purchase_item(username, shop_name, item_id, price)
+        user_manager.invalidate_player(username)
         
         if success:
             return jsonify({
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+房间内存基准
+
+创建一批满载的房间（每个房间 ROOM_MESSAGE_CAPACITY 条消息），用 tracemalloc 统计每个房间占用的内存：
+    python bench_room_memory.py [房间数] [每个房间的用户数]
+
+同样的负载分别用改造前的 dataclass 记录（每条消息带 uuid4 字符串ID，见 LegacyRoomMessage / LegacyRoomUser）
+和当前的 __slots__ 记录各跑一遍，前者作为对照基线
+"""
+import contextlib
+import gc
+import io
+import os
+import sys
+import time
+import tracemalloc
+import uuid
+from dataclasses import dataclass
+from typing import Optional
+
+sys.stdout.reconfigure(encoding='utf-8')
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import room_manager
+from config import ROOM_MESSAGE_CAPACITY
+from room_manager import RoomManager
+
+SAMPLE_CONTENTS = [
+    '我推开酒馆的门，看看里面有没有人。',
+    '向铁匠打听一下最近镇上有没有奇怪的事情发生',
+    'I draw my sword and step forward carefully.',
+    '（DM）昏暗的灯光下，吧台后的矮人抬起头，眯着眼睛打量着你们。角落里一个披着斗篷的身影似乎在低声念诵着什么。',
+]
+
+
+@dataclass
+class LegacyRoomMessage:
+    """改造前的房间消息（基线）：普通 dataclass，每条消息生成一个 uuid4 字符串作为ID"""
+    sender: str
+    content: str
+    message_type: str
+    target_user: Optional[str] = None
+    timestamp: float = None
+    seq: int = 0
+    id: str = None
+
+    def __post_init__(self):
+        if self.id is None:
+            self.id = str(uuid.uuid4())
+        if self.timestamp is None:
+            self.timestamp = time.time()
+
+
+@dataclass
+class LegacyRoomUser:
+    """改造前的房间用户（基线）"""
+    username: str
+    session_token: str
+    is_host: bool = False
+    joined_at: float = None
+    last_activity: float = None
+    connections: int = 0
+
+    def __post_init__(self):
+        if self.joined_at is None:
+            self.joined_at = time.time()
+        if self.last_activity is None:
+            self.last_activity = time.time()
+
+
+@contextlib.contextmanager
+def legacy_records():
+    """临时把 room_manager 中的记录类换成改造前的 dataclass"""
+    saved = room_manager.RoomMessage, room_manager.RoomUser
+    room_manager.RoomMessage, room_manager.RoomUser = LegacyRoomMessage, LegacyRoomUser
+    try:
+        yield
+    finally:
+        room_manager.RoomMessage, room_manager.RoomUser = saved
+
+
+def build_rooms(manager: RoomManager, room_count: int, users_per_room: int):
+    """创建房间并发满消息（私聊、全局、主持人消息混合）"""
+    for index in range(room_count):
+        users = [f'玩家{index}_{n}' for n in range(users_per_room)]
+        room_id = manager.create_room(users[0])
+        for username in users:
+            manager.join_room(room_id, username, 'token')
+        for n in range(ROOM_MESSAGE_CAPACITY):
+            sender = users[n % users_per_room]
+            content = SAMPLE_CONTENTS[n % len(SAMPLE_CONTENTS)] + str(n)
+            if n % 5 == 0:
+                manager.send_message(room_id, '龙与地下城', content, 'global')
+            elif n % 3 == 0:
+                manager.send_message(room_id, sender, content, 'private', users[(n + 1) % users_per_room])
+            else:
+                manager.send_message(room_id, sender, content, 'global')
+
+
+def measure(room_count: int, users_per_room: int):
+    """构建房间，返回 (占用的内存字节数, 耗时秒数)"""
+    manager = RoomManager()
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        build_rooms(manager, room_count, users_per_room)
+    elapsed = time.perf_counter() - started
+    gc.collect()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    return sum(stat.size_diff for stat in after.compare_to(before, 'filename')), elapsed
+
+
+def main():
+    room_count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    users_per_room = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    messages = room_count * ROOM_MESSAGE_CAPACITY
+
+    with legacy_records():
+        baseline, baseline_elapsed = measure(room_count, users_per_room)
+    total, elapsed = measure(room_count, users_per_room)
+
+    print(f"房间数: {room_count}，每个房间 {users_per_room} 名用户、{ROOM_MESSAGE_CAPACITY} 条消息")
+    for label, size, seconds in (('dataclass（基线）', baseline, baseline_elapsed), ('__slots__', total, elapsed)):
+        print(f"{label}: 总内存 {size / 1024 / 1024:.1f} MB，每个房间 {size / room_count / 1024:.1f} KB，"
+              f"每条消息（含房间开销）{size / messages:.0f} 字节，构建耗时 {seconds:.2f} 秒")
+    print(f"每个房间节省: {(baseline - total) / baseline:.0%}")
+
+
+if __name__ == '__main__':
+    main()
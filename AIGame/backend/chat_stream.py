@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+聊天流式输出
+
+- MoveDirectiveFilter：在逐段到达的AI回复中增量识别并去掉 MOVE_TO:xxx 移动指令，
+  可能是指令开头的片段会先暂存，确认不是指令后再输出，玩家看不到指令文本
+- sse_event：把一个事件格式化为 Server-Sent Events 的一条消息
+- sse_event_bytes：同上，数据是已经编码好的 UTF-8 JSON（可以在多个连接间复用）
+"""
+import json
+import re
+from typing import List, Optional
+
+# 与非流式模式相同的移动指令格式（支持带**的写法）
+MOVE_TO_PATTERN = re.compile(r'\*?\*?MOVE_TO:([^\*\s]+)\*?\*?')
+
+_DIRECTIVE = 'MOVE_TO:'
+_DIRECTIVE_PREFIXES = ('**' + _DIRECTIVE, '*' + _DIRECTIVE, _DIRECTIVE)
+
+
+def _is_target_char(ch):
+    return ch != '*' and not ch.isspace()
+
+
+class MoveDirectiveFilter:
+    """增量去除回复中的 MOVE_TO 指令，记录解析到的目标地点"""
+
+    def __init__(self):
+        self._buffer = ''
+        self.targets: List[str] = []
+
+    @property
+    def target(self) -> Optional[str]:
+        """第一个移动目标（与非流式模式一致，只处理第一条指令）"""
+        return self.targets[0] if self.targets else None
+
+    def feed(self, chunk: str) -> str:
+        """输入一段新文本，返回可以安全输出给玩家的部分"""
+        self._buffer += chunk
+        return self._drain(final=False)
+
+    def finish(self) -> str:
+        """流结束，返回暂存的剩余文本"""
+        return self._drain(final=True)
+
+    def _drain(self, final):
+        output = []
+        buffer = self._buffer
+        while buffer:
+            index = buffer.find(_DIRECTIVE)
+            if index < 0:
+                # 结尾可能是指令的开头（如 "**MOV"），暂存等待后续文本
+                hold = 0 if final else self._partial_prefix_length(buffer)
+                output.append(buffer[:len(buffer) - hold])
+                buffer = buffer[len(buffer) - hold:]
+                break
+
+            start = index
+            while start > 0 and index - start < 2 and buffer[start - 1] == '*':
+                start -= 1
+
+            end = index + len(_DIRECTIVE)
+            while end < len(buffer) and _is_target_char(buffer[end]):
+                end += 1
+            if end == len(buffer) and not final:
+                # 目标地点可能还没有传输完
+                output.append(buffer[:start])
+                buffer = buffer[start:]
+                break
+
+            target = buffer[index + len(_DIRECTIVE):end]
+            if not target:
+                # "MOVE_TO:" 后没有目标，不是有效指令，原样输出
+                output.append(buffer[:index + len(_DIRECTIVE)])
+                buffer = buffer[index + len(_DIRECTIVE):]
+                continue
+
+            stars = 0
+            while end + stars < len(buffer) and stars < 2 and buffer[end + stars] == '*':
+                stars += 1
+            if stars < 2 and end + stars == len(buffer) and not final:
+                # 结尾的 ** 可能还没有传输完
+                output.append(buffer[:start])
+                buffer = buffer[start:]
+                break
+
+            self.targets.append(target)
+            output.append(buffer[:start])
+            buffer = buffer[end + stars:]
+
+        self._buffer = buffer
+        return ''.join(output)
+
+    @staticmethod
+    def _partial_prefix_length(buffer):
+        """buffer 结尾与某个指令前缀开头重合的最大长度"""
+        for length in range(min(len(buffer), len(_DIRECTIVE_PREFIXES[0]) - 1), 0, -1):
+            tail = buffer[-length:]
+            if any(prefix.startswith(tail) for prefix in _DIRECTIVE_PREFIXES):
+                return length
+        return 0
+
+
+def sse_event(payload, event: str = None, event_id=None) -> str:
+    """格式化一条SSE消息"""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    if event:
+        lines.append(f"event: {event}")
+    lines.append("data: " + json.dumps(payload, ensure_ascii=False))
+    return "\n".join(lines) + "\n\n"
+
+
+def sse_event_bytes(data: bytes, event: str = None, event_id=None) -> bytes:
+    """格式化一条SSE消息，data 为已编码的 UTF-8 JSON"""
+    header = ''
+    if event_id is not None:
+        header += f"id: {event_id}\n"
+    if event:
+        header += f"event: {event}\n"
+    return header.encode('utf-8') + b"data: " + data + b"\n\n"
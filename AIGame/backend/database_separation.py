@@ -4,13 +4,310 @@
 
 分为两个数据库：
 1. game_data.db - 用户进度、游戏状态等会变化的数据
-2. world_data.db - 地图、敌人、物品等配置数据，每次启动时从JSON重新生成
+2. world_data.db - 地图、敌人、物品等配置数据，由JSON配置生成，只重建内容发生变化的表
 """
+import hashlib
 import sqlite3
 import os
 import json
+import threading
+import time
 from datetime import datetime
 from typing import Dict, List, Any
+from db_pool import SQLiteConnectionPool
+from query_router import GAME_DB, Statement, prepare, route
+from config import (DB_POOL_SIZE, DB_POOL_TIMEOUT, DB_POOL_HEALTH_CHECK_INTERVAL,
+                    GAME_DB_PRAGMAS, WORLD_DB_PRAGMAS,
+                    WAL_CHECKPOINT_INTERVAL, WAL_CHECKPOINT_TRUNCATE_PAGES)
+
+# 允许通过配置设置的PRAGMA（PRAGMA不支持参数绑定，只能拼接，因此限定名称）
+ALLOWED_PRAGMAS = (
+    'journal_mode', 'synchronous', 'mmap_size', 'cache_size', 'busy_timeout',
+    'temp_store', 'wal_autocheckpoint', 'foreign_keys'
+)
+
+
+def apply_pragmas(conn, pragmas):
+    """在连接上应用PRAGMA配置"""
+    for name, value in pragmas.items():
+        if name not in ALLOWED_PRAGMAS:
+            raise ValueError(f"不支持的PRAGMA: {name}")
+        if isinstance(value, str) and not value.isalnum():
+            raise ValueError(f"非法的PRAGMA值: {name}={value}")
+        conn.execute(f"PRAGMA {name} = {value}").fetchall()
+
+
+def _table_exists(cursor, table):
+    """检查表是否存在"""
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,))
+    return cursor.fetchone() is not None
+
+
+def _migrate_v1_unique_constraints(cursor):
+    """合并重复的背包/装备行，并加上唯一约束（purchase_item 的 ON CONFLICT 依赖它）"""
+    # 同一用户同一物品的多行合并为一行，数量相加
+    cursor.execute('''
+        UPDATE user_inventory
+        SET quantity = (
+            SELECT SUM(i2.quantity) FROM user_inventory i2
+            WHERE i2.username = user_inventory.username AND i2.item_id = user_inventory.item_id
+        )
+        WHERE id IN (
+            SELECT MIN(id) FROM user_inventory
+            GROUP BY username, item_id HAVING COUNT(*) > 1
+        )
+    ''')
+    cursor.execute('''
+        DELETE FROM user_inventory
+        WHERE id NOT IN (SELECT MIN(id) FROM user_inventory GROUP BY username, item_id)
+    ''')
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_user_inventory_user_item
+        ON user_inventory (username, item_id)
+    ''')
+    
+    # 同一用户同一槽位只保留一行
+    cursor.execute('''
+        DELETE FROM user_equipment
+        WHERE id NOT IN (SELECT MIN(id) FROM user_equipment GROUP BY username, slot)
+    ''')
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_user_equipment_user_slot
+        ON user_equipment (username, slot)
+    ''')
+
+
+def _migrate_v2_lookup_indexes(cursor):
+    """为高频查询添加组合索引"""
+    # 聊天历史按 (username, character) 过滤、按 timestamp 排序
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_chat_history_user_char_time
+        ON chat_history (username, character, timestamp)
+    ''')
+    # 事件冷却/次数检查按 (event_id, user_id) 过滤、按 triggered_at 排序
+    # event_triggers 由 EventManager 创建，可能晚于本迁移，届时由其自行建索引
+    if _table_exists(cursor, 'event_triggers'):
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_event_triggers_event_user
+            ON event_triggers (event_id, user_id, triggered_at)
+        ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_room_messages_room
+        ON room_messages (room_id, id)
+    ''')
+
+
+def _migrate_v3_equipment_stats(cursor):
+    """user_data 增加物化的装备属性加成列（JSON），由 UserManager 在装备变化时维护"""
+    cursor.execute('PRAGMA table_info(user_data)')
+    if 'equipment_stats' not in [column[1] for column in cursor.fetchall()]:
+        cursor.execute('ALTER TABLE user_data ADD COLUMN equipment_stats TEXT')
+
+
+def _migrate_v4_session_expiry(cursor):
+    """过期会话按 expires_at 分批清理；登出记录用于通知其他工作进程清除会话缓存"""
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_user_sessions_expires
+        ON user_sessions (expires_at)
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS session_revocations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_token TEXT NOT NULL,
+            revoked_at TEXT NOT NULL
+        )
+    ''')
+
+
+def _migrate_v5_chat_summaries(cursor):
+    """每个(用户, 角色)一条滚动摘要，summarized_until 为已并入摘要的最后一条 chat_history.id"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS chat_summaries (
+            username TEXT NOT NULL,
+            character TEXT NOT NULL,
+            summary TEXT NOT NULL,
+            summarized_until INTEGER NOT NULL,
+            updated_at TEXT NOT NULL,
+            PRIMARY KEY (username, character)
+        )
+    ''')
+
+
+def _migrate_v6_room_persistence(cursor):
+    """房间状态持久化：消息序号、主持人模式，每个房间内用户唯一"""
+    cursor.execute('PRAGMA table_info(rooms)')
+    if 'host_mode' not in [column[1] for column in cursor.fetchall()]:
+        cursor.execute("ALTER TABLE rooms ADD COLUMN host_mode TEXT NOT NULL DEFAULT 'private'")
+    cursor.execute('PRAGMA table_info(room_messages)')
+    columns = [column[1] for column in cursor.fetchall()]
+    if 'seq' not in columns:
+        cursor.execute('ALTER TABLE room_messages ADD COLUMN seq INTEGER NOT NULL DEFAULT 0')
+    # message_id 已不再写入（消息ID就是序号 seq），保留该列只是为了不改动已发布的迁移
+    if 'message_id' not in columns:
+        cursor.execute('ALTER TABLE room_messages ADD COLUMN message_id TEXT')
+    cursor.execute('''
+        DELETE FROM room_users WHERE id NOT IN (
+            SELECT MIN(id) FROM room_users GROUP BY room_id, username
+        )
+    ''')
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_room_users_room_user
+        ON room_users (room_id, username)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_room_messages_room_seq
+        ON room_messages (room_id, seq)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_room_messages_timestamp
+        ON room_messages (timestamp)
+    ''')
+
+
+def _migrate_v7_room_expiry(cursor):
+    """房间成员记录最近活动时间，由持有租约的进程在数据库中统一清理不活跃的成员和空房间"""
+    cursor.execute('PRAGMA table_info(room_users)')
+    if 'last_active_at' not in [column[1] for column in cursor.fetchall()]:
+        cursor.execute('ALTER TABLE room_users ADD COLUMN last_active_at TEXT')
+    cursor.execute('UPDATE room_users SET last_active_at = joined_at WHERE last_active_at IS NULL')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_room_users_last_active
+        ON room_users (last_active_at)
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS maintenance_leases (
+            name TEXT PRIMARY KEY,
+            holder TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )
+    ''')
+
+
+# 配置名 -> 由该配置生成的世界数据库表（热重载时只重建对应的表）
+WORLD_CONFIG_TABLES = {
+    'locations': ('map_areas', 'map_locations'),
+    'creatures': ('creatures',),
+    'items': ('items',),
+    'shops': ('shops', 'shop_items'),
+}
+
+
+# 配置名 -> 生成世界数据库所用的配置文件
+WORLD_SOURCE_FILES = {
+    'locations': 'location_control.json',
+    'creatures': 'creature_control.json',
+    'items': 'item_control.json',
+    'shops': 'shop_control.json',
+}
+
+# 世界数据库表结构版本，修改下面的建表语句时递增，已有的 world_data.db 会整体重建
+WORLD_SCHEMA_VERSION = '1'
+WORLD_SCHEMA_KEY = '__schema__'
+
+WORLD_TABLE_SCHEMAS = {
+    # 区域表
+    'map_areas': '''
+        CREATE TABLE IF NOT EXISTS map_areas (
+            area_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            area_name TEXT UNIQUE NOT NULL,
+            display_name TEXT NOT NULL,
+            description TEXT,
+            area_type TEXT NOT NULL,
+            is_accessible BOOLEAN DEFAULT 1,
+            created_at TEXT NOT NULL
+        )
+    ''',
+    # 地点表
+    'map_locations': '''
+        CREATE TABLE IF NOT EXISTS map_locations (
+            location_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            location_name TEXT UNIQUE NOT NULL,
+            display_name TEXT NOT NULL,
+            description TEXT,
+            area_name TEXT NOT NULL,
+            location_type TEXT NOT NULL,
+            is_accessible BOOLEAN DEFAULT 1,
+            interactions TEXT,
+            created_at TEXT NOT NULL
+        )
+    ''',
+    # 生物表
+    'creatures': '''
+        CREATE TABLE IF NOT EXISTS creatures (
+            creature_id TEXT PRIMARY KEY,
+            creature_name TEXT NOT NULL,
+            creature_type TEXT NOT NULL,
+            rarity TEXT NOT NULL,
+            level INTEGER NOT NULL,
+            avatar TEXT,
+            description TEXT,
+            base_stats TEXT NOT NULL,
+            skills TEXT,
+            ai_behavior TEXT,
+            experience_reward INTEGER,
+            gold_reward TEXT,
+            item_drops TEXT,
+            habitat TEXT,
+            spawn_conditions TEXT,
+            created_at TEXT NOT NULL
+        )
+    ''',
+    # 物品表
+    'items': '''
+        CREATE TABLE IF NOT EXISTS items (
+            item_id TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            description TEXT,
+            item_type TEXT NOT NULL,
+            sub_type TEXT,
+            rarity TEXT NOT NULL,
+            base_price INTEGER NOT NULL,
+            stats TEXT,
+            requirements TEXT,
+            effects TEXT,
+            consumable BOOLEAN DEFAULT 0,
+            stackable BOOLEAN DEFAULT 1,
+            max_stack INTEGER DEFAULT 99,
+            created_at TEXT NOT NULL
+        )
+    ''',
+    # 商店表
+    'shops': '''
+        CREATE TABLE IF NOT EXISTS shops (
+            shop_id TEXT PRIMARY KEY,
+            shop_name TEXT NOT NULL,
+            description TEXT,
+            shop_type TEXT NOT NULL,
+            location TEXT NOT NULL,
+            created_at TEXT NOT NULL
+        )
+    ''',
+    # 商店物品表
+    'shop_items': '''
+        CREATE TABLE IF NOT EXISTS shop_items (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            shop_id TEXT NOT NULL,
+            item_id TEXT NOT NULL,
+            price INTEGER NOT NULL,
+            stock INTEGER DEFAULT -1,
+            created_at TEXT NOT NULL,
+            FOREIGN KEY (shop_id) REFERENCES shops (shop_id),
+            FOREIGN KEY (item_id) REFERENCES items (item_id)
+        )
+    ''',
+}
+
+
+# game_data.db 的版本化迁移：(版本号, 描述, 迁移函数)，只能追加，不能修改已发布的条目
+GAME_DB_MIGRATIONS = [
+    (1, '背包(username, item_id)与装备(username, slot)唯一约束', _migrate_v1_unique_constraints),
+    (2, '聊天记录/事件触发/房间消息查询索引', _migrate_v2_lookup_indexes),
+    (3, 'user_data 物化装备属性加成', _migrate_v3_equipment_stats),
+    (4, '会话过期索引与登出记录表', _migrate_v4_session_expiry),
+    (5, '聊天记录滚动摘要表', _migrate_v5_chat_summaries),
+    (6, '房间持久化：消息序号与主持人模式', _migrate_v6_room_persistence),
+    (7, '房间成员活动时间与后台任务租约表', _migrate_v7_room_expiry),
+]
 
 
 class DatabaseSeparationManager:
@@ -28,6 +325,128 @@ class DatabaseSeparationManager:
         
         # 确保backend目录存在
         os.makedirs(self.backend_dir, exist_ok=True)
+        
+        # 每个新连接创建时应用的PRAGMA（可通过configure_pragmas调整，便于压测对比）
+        self.game_pragmas = dict(GAME_DB_PRAGMAS)
+        self.world_pragmas = dict(WORLD_DB_PRAGMAS)
+        
+        # 两个数据库各自的连接池
+        self.game_pool = SQLiteConnectionPool(
+            self.game_db_path, max_size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT,
+            health_check_interval=DB_POOL_HEALTH_CHECK_INTERVAL, name='game_data',
+            on_connect=lambda conn: apply_pragmas(conn, self.game_pragmas)
+        )
+        self.world_pool = SQLiteConnectionPool(
+            self.world_db_path, max_size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT,
+            health_check_interval=DB_POOL_HEALTH_CHECK_INTERVAL, name='world_data',
+            on_connect=lambda conn: apply_pragmas(conn, self.world_pragmas)
+        )
+        
+        # 游戏数据库的表和迁移是否已在本进程中确认过（见 ensure_game_schema）
+        self._game_schema_lock = threading.Lock()
+        self._game_schema_ready = False
+        
+        # WAL检查点
+        self._checkpoint_thread = None
+        self._checkpoint_stop = threading.Event()
+        self._checkpoint_stats = {
+            'runs': 0,
+            'last_run_at': None,
+            'last_mode': None,
+            'last_result': None,
+            'last_duration': 0.0,
+            'errors': 0
+        }
+    
+    def get_pool_stats(self):
+        """获取两个连接池的指标"""
+        return {
+            'game_data': self.game_pool.get_stats(),
+            'world_data': self.world_pool.get_stats()
+        }
+    
+    def configure_pragmas(self, game_pragmas=None, world_pragmas=None):
+        """调整PRAGMA配置，连接池中的旧连接会被回收，新连接使用新配置"""
+        if game_pragmas is not None:
+            self.game_pragmas = dict(game_pragmas)
+            self.game_pool.close_all()
+        if world_pragmas is not None:
+            self.world_pragmas = dict(world_pragmas)
+            self.world_pool.close_all()
+    
+    def get_db_settings(self):
+        """读取两个数据库当前生效的PRAGMA值"""
+        settings = {}
+        for name, pool, pragmas in (('game_data', self.game_pool, self.game_pragmas),
+                                    ('world_data', self.world_pool, self.world_pragmas)):
+            try:
+                with pool.connection() as conn:
+                    settings[name] = {
+                        'configured': dict(pragmas),
+                        'effective': {
+                            pragma: conn.execute(f"PRAGMA {pragma}").fetchone()[0]
+                            for pragma in pragmas
+                        }
+                    }
+            except sqlite3.Error as e:
+                settings[name] = {'configured': dict(pragmas), 'error': str(e)}
+        return settings
+    
+    def checkpoint(self, mode=None):
+        """对game_data.db执行WAL检查点
+        
+        未指定mode时先做PASSIVE（不阻塞读写），WAL页数过多时再做TRUNCATE收缩文件
+        """
+        if str(self.game_pragmas.get('journal_mode', '')).upper() != 'WAL':
+            return None
+        
+        start = time.monotonic()
+        try:
+            with self.game_pool.connection() as conn:
+                run_mode = mode or 'PASSIVE'
+                busy, log_pages, checkpointed = conn.execute(f"PRAGMA wal_checkpoint({run_mode})").fetchone()
+                if mode is None and log_pages >= WAL_CHECKPOINT_TRUNCATE_PAGES:
+                    run_mode = 'TRUNCATE'
+                    busy, log_pages, checkpointed = conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+        except sqlite3.Error as e:
+            self._checkpoint_stats['errors'] += 1
+            print(f"❌ WAL检查点失败: {e}")
+            return None
+        
+        result = {'busy': busy, 'log_pages': log_pages, 'checkpointed_pages': checkpointed}
+        self._checkpoint_stats.update({
+            'runs': self._checkpoint_stats['runs'] + 1,
+            'last_run_at': datetime.now().isoformat(),
+            'last_mode': run_mode,
+            'last_result': result,
+            'last_duration': time.monotonic() - start
+        })
+        return result
+    
+    def start_checkpoint_thread(self, interval=WAL_CHECKPOINT_INTERVAL):
+        """启动后台WAL检查点线程"""
+        if not interval or (self._checkpoint_thread and self._checkpoint_thread.is_alive()):
+            return
+        
+        self._checkpoint_stop.clear()
+        
+        def run():
+            while not self._checkpoint_stop.wait(interval):
+                self.checkpoint()
+        
+        self._checkpoint_thread = threading.Thread(target=run, name='wal-checkpoint', daemon=True)
+        self._checkpoint_thread.start()
+    
+    def stop_checkpoint_thread(self):
+        """停止后台WAL检查点线程"""
+        self._checkpoint_stop.set()
+        if self._checkpoint_thread:
+            self._checkpoint_thread.join(timeout=5)
+            self._checkpoint_thread = None
+    
+    def get_checkpoint_stats(self):
+        """获取WAL检查点指标"""
+        return dict(self._checkpoint_stats)
     
     def init_databases(self):
         """初始化两个数据库"""
@@ -41,6 +460,7 @@ class DatabaseSeparationManager:
         print("🎮 初始化游戏数据库...")
         
         conn = sqlite3.connect(self.game_db_path)
+        apply_pragmas(conn, self.game_pragmas)
         cursor = conn.cursor()
         
         # 用户基本信息表
@@ -198,195 +618,228 @@ class DatabaseSeparationManager:
         ''')
         
         conn.commit()
+        
+        # 执行尚未应用的版本化迁移
+        self._run_game_migrations(conn)
+        
         conn.close()
+        self._game_schema_ready = True
         print("✅ 游戏数据库初始化完成")
     
-    def init_world_database(self):
-        """初始化世界数据库（从JSON配置重新生成）"""
-        print("🌍 初始化世界数据库...")
+    def ensure_game_schema(self):
+        """确保游戏数据库的表已创建、迁移已执行（每个进程只执行一次）
         
-        # 删除现有的世界数据库（每次重新生成）
-        if os.path.exists(self.world_db_path):
-            os.remove(self.world_db_path)
-            print("🗑️ 已删除旧的世界数据库")
-        
-        conn = sqlite3.connect(self.world_db_path)
+        应用无论从哪个入口启动（python app.py、server_start.py），都要在任何读写游戏数据库之前调用
+        """
+        with self._game_schema_lock:
+            if not self._game_schema_ready:
+                self.init_game_database()
+    
+    def _run_game_migrations(self, conn):
+        """按版本号依次执行game_data.db迁移，每个迁移在独立事务中完成并记录版本"""
         cursor = conn.cursor()
-        
-        # 区域表
-        cursor.execute('''
-            CREATE TABLE map_areas (
-                area_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                area_name TEXT UNIQUE NOT NULL,
-                display_name TEXT NOT NULL,
-                description TEXT,
-                area_type TEXT NOT NULL,
-                is_accessible BOOLEAN DEFAULT 1,
-                created_at TEXT NOT NULL
-            )
-        ''')
-        
-        # 地点表
-        cursor.execute('''
-            CREATE TABLE map_locations (
-                location_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                location_name TEXT UNIQUE NOT NULL,
-                display_name TEXT NOT NULL,
-                description TEXT,
-                area_name TEXT NOT NULL,
-                location_type TEXT NOT NULL,
-                is_accessible BOOLEAN DEFAULT 1,
-                interactions TEXT,
-                created_at TEXT NOT NULL
-            )
-        ''')
-        
-        # 生物表
-        cursor.execute('''
-            CREATE TABLE creatures (
-                creature_id TEXT PRIMARY KEY,
-                creature_name TEXT NOT NULL,
-                creature_type TEXT NOT NULL,
-                rarity TEXT NOT NULL,
-                level INTEGER NOT NULL,
-                avatar TEXT,
-                description TEXT,
-                base_stats TEXT NOT NULL,
-                skills TEXT,
-                ai_behavior TEXT,
-                experience_reward INTEGER,
-                gold_reward TEXT,
-                item_drops TEXT,
-                habitat TEXT,
-                spawn_conditions TEXT,
-                created_at TEXT NOT NULL
-            )
-        ''')
-        
-        # 物品表
-        cursor.execute('''
-            CREATE TABLE items (
-                item_id TEXT PRIMARY KEY,
-                name TEXT NOT NULL,
-                description TEXT,
-                item_type TEXT NOT NULL,
-                sub_type TEXT,
-                rarity TEXT NOT NULL,
-                base_price INTEGER NOT NULL,
-                stats TEXT,
-                requirements TEXT,
-                effects TEXT,
-                consumable BOOLEAN DEFAULT 0,
-                stackable BOOLEAN DEFAULT 1,
-                max_stack INTEGER DEFAULT 99,
-                created_at TEXT NOT NULL
-            )
-        ''')
-        
-        # 商店表
-        cursor.execute('''
-            CREATE TABLE shops (
-                shop_id TEXT PRIMARY KEY,
-                shop_name TEXT NOT NULL,
-                description TEXT,
-                shop_type TEXT NOT NULL,
-                location TEXT NOT NULL,
-                created_at TEXT NOT NULL
-            )
-        ''')
-        
-        # 商店物品表
         cursor.execute('''
-            CREATE TABLE shop_items (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                shop_id TEXT NOT NULL,
-                item_id TEXT NOT NULL,
-                price INTEGER NOT NULL,
-                stock INTEGER DEFAULT -1,
-                created_at TEXT NOT NULL,
-                FOREIGN KEY (shop_id) REFERENCES shops (shop_id),
-                FOREIGN KEY (item_id) REFERENCES items (item_id)
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                description TEXT NOT NULL,
+                applied_at TEXT NOT NULL
             )
         ''')
-        
-        # 从JSON配置文件加载数据
-        self._load_world_data_from_json(cursor)
-        
         conn.commit()
-        conn.close()
-        print("✅ 世界数据库初始化完成")
-    
-    def _load_world_data_from_json(self, cursor):
-        """从JSON配置文件加载世界数据"""
-        now = datetime.now().isoformat()
         
-        # 加载地图数据
-        self._load_location_data(cursor, now)
+        cursor.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version')
+        current_version = cursor.fetchone()[0]
         
-        # 加载生物数据
-        self._load_creature_data(cursor, now)
-        
-        # 加载物品数据（如果存在）
-        self._load_item_data(cursor, now)
-        
-        # 加载商店数据（如果存在）
-        self._load_shop_data(cursor, now)
+        for version, description, migrate in GAME_DB_MIGRATIONS:
+            if version <= current_version:
+                continue
+            try:
+                cursor.execute('BEGIN')
+                migrate(cursor)
+                cursor.execute(
+                    'INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)',
+                    (version, description, datetime.now().isoformat())
+                )
+                conn.commit()
+                print(f"✅ 已应用数据库迁移 v{version}: {description}")
+            except sqlite3.Error as e:
+                conn.rollback()
+                print(f"❌ 数据库迁移 v{version} 失败: {e}")
+                raise
     
-    def _load_location_data(self, cursor, now):
-        """加载位置数据"""
-        print("📍 加载位置数据...")
-        
-        location_config_path = os.path.join(self.config_dir, 'location_control.json')
-        
-        if os.path.exists(location_config_path):
-            with open(location_config_path, 'r', encoding='utf-8') as f:
-                location_data = json.load(f)
-            
-            # 首先插入区域数据（从areas数组）
-            for area in location_data.get('areas', []):
-                cursor.execute('''
-                    INSERT OR IGNORE INTO map_areas (area_name, display_name, description, area_type, created_at)
-                    VALUES (?, ?, ?, ?, ?)
-                ''', (
-                    area.get('area_id'),
-                    area.get('display_name', area.get('area_name', '未知区域')),
-                    area.get('description', f"区域：{area.get('display_name', '未知区域')}"),
-                    area.get('area_type', 'unknown'),
-                    now
-                ))
-                print(f"  📍 区域: {area.get('display_name')} ({area.get('area_id')})")
-            
-            # 插入位置数据
-            for location in location_data.get('locations', []):
-                interactions_json = json.dumps(location.get('interactions', []), ensure_ascii=False)
-                
-                # 确保所有必需字段都有值，优先使用location_id作为主键
-                location_name = location.get('location_id') or location.get('location_name')
-                display_name = location.get('display_name') or location.get('location_name') or location.get('location_id')
-                description = location.get('description', f"位置：{display_name}")
-                area_name = location.get('area_id') or location.get('area', 'novice_village')
-                location_type = location.get('type') or location.get('location_type', 'unknown')
-                
-                cursor.execute('''
-                    INSERT OR REPLACE INTO map_locations (
-                        location_name, display_name, description, area_name, 
-                        location_type, is_accessible, interactions, created_at
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    location_name,
-                    display_name,
-                    description,
-                    area_name,
-                    location_type,
-                    location.get('is_accessible', True),
-                    interactions_json,
-                    now
-                ))
-                print(f"    📍 位置: {display_name} ({location_name})")
+    def get_schema_version(self):
+        """获取game_data.db当前的schema版本"""
+        with self.game_pool.connection() as conn:
+            if not _table_exists(conn.cursor(), 'schema_version'):
+                return 0
+            return conn.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version').fetchone()[0]
+    
+    def init_world_database(self):
+        """初始化世界数据库（按配置文件内容哈希增量构建）"""
+        print("🌍 初始化世界数据库...")
+        rebuilt = self.build_world_database()
+        if rebuilt:
+            print(f"✅ 世界数据库初始化完成，已重建: {', '.join(rebuilt)}")
         else:
+            print("✅ 世界数据库已是最新，无需重建")
+
+    def _read_world_sources(self):
+        """读取生成世界数据库所需的配置文件，返回 {配置名: (内容哈希, 解析后的数据或None)}"""
+        sources = {}
+        for config_name, filename in WORLD_SOURCE_FILES.items():
+            filepath = os.path.join(self.config_dir, filename)
+            try:
+                with open(filepath, 'rb') as f:
+                    raw = f.read()
+            except FileNotFoundError:
+                sources[config_name] = ('missing', None)
+                continue
+            # 哈希和解析使用同一份字节，保证记录的哈希与写入的数据一致
+            sources[config_name] = (hashlib.sha256(raw).hexdigest(), json.loads(raw.decode('utf-8')))
+        return sources
+
+    def _read_build_meta(self, cursor):
+        """读取世界数据库中记录的构建哈希，尚未构建过时返回None"""
+        if not _table_exists(cursor, 'build_meta'):
+            return None
+        return dict(cursor.execute('SELECT config_name, content_hash FROM build_meta').fetchall())
+
+    def build_world_database(self, force=None):
+        """增量构建世界数据库
+
+        - build_meta 表记录每个配置文件的内容哈希，只重建来源发生变化的表
+        - 直接在现有数据库中、一个写事务内重建变化的表：world_data.db 使用WAL模式（见 WORLD_DB_PRAGMAS），
+          其他连接在提交前不被阻塞、始终读到旧的完整数据，提交后读到新数据；
+          连接池中的连接保持可用，未变化的表（例如商店库存）不受影响
+        - force: 无论哈希是否变化都要重建的配置名列表
+
+        返回重建的配置名列表
+        """
+        sources = self._read_world_sources()
+
+        conn = sqlite3.connect(self.world_db_path, timeout=DB_POOL_TIMEOUT, isolation_level=None)
+        try:
+            apply_pragmas(conn, self.world_pragmas)
+            cursor = conn.cursor()
+            # 写锁在读取构建哈希之前获取，多个进程同时重建时后到的会看到已更新的哈希
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                meta = self._read_build_meta(cursor)
+                schema_changed = meta is None or meta.get(WORLD_SCHEMA_KEY) != WORLD_SCHEMA_VERSION
+                if schema_changed:
+                    changed = list(WORLD_SOURCE_FILES)
+                else:
+                    force = set(force or [])
+                    changed = [
+                        name for name, (content_hash, _) in sources.items()
+                        if name in force or meta.get(name) != content_hash
+                    ]
+
+                if not changed:
+                    cursor.execute('ROLLBACK')
+                    return []
+
+                if schema_changed:
+                    for table in WORLD_TABLE_SCHEMAS:
+                        cursor.execute(f'DROP TABLE IF EXISTS {table}')
+                    cursor.execute('DROP TABLE IF EXISTS build_meta')
+                for ddl in WORLD_TABLE_SCHEMAS.values():
+                    cursor.execute(ddl)
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS build_meta (
+                        config_name TEXT PRIMARY KEY,
+                        content_hash TEXT NOT NULL,
+                        built_at TEXT NOT NULL
+                    )
+                ''')
+
+                now = datetime.now().isoformat()
+                loaders = {
+                    'locations': self._load_location_data,
+                    'creatures': self._load_creature_data,
+                    'items': self._load_item_data,
+                    'shops': self._load_shop_data,
+                }
+                for name in changed:
+                    for table in WORLD_CONFIG_TABLES[name]:
+                        cursor.execute(f'DELETE FROM {table}')
+                    loaders[name](cursor, now, sources[name][1])
+
+                cursor.executemany(
+                    'INSERT OR REPLACE INTO build_meta (config_name, content_hash, built_at) VALUES (?, ?, ?)',
+                    [(name, sources[name][0], now) for name in changed] + [(WORLD_SCHEMA_KEY, WORLD_SCHEMA_VERSION, now)]
+                )
+                cursor.execute('COMMIT')
+            except BaseException:
+                if conn.in_transaction:
+                    cursor.execute('ROLLBACK')
+                raise
+        finally:
+            conn.close()
+
+        return changed
+
+    def rebuild_world_tables(self, config_names):
+        """配置热重载后，重建受影响的世界数据库表，返回重建的表名"""
+        targets = [name for name in config_names if name in WORLD_CONFIG_TABLES]
+        if not targets:
+            return []
+
+        rebuilt = []
+        for name in self.build_world_database(force=targets):
+            rebuilt.extend(WORLD_CONFIG_TABLES[name])
+
+        print(f"🔄 世界数据库已按新配置重建: {', '.join(rebuilt)}")
+        return rebuilt
+
+    def _load_location_data(self, cursor, now, location_data):
+        """加载位置数据"""
+        if location_data is None:
             print("⚠️ 位置配置文件不存在，使用默认配置")
             self._load_default_locations(cursor, now)
-    
+            return
+
+        # 首先插入区域数据（从areas数组）
+        area_rows = [
+            (
+                area.get('area_id'),
+                area.get('display_name', area.get('area_name', '未知区域')),
+                area.get('description', f"区域：{area.get('display_name', '未知区域')}"),
+                area.get('area_type', 'unknown'),
+                now
+            )
+            for area in location_data.get('areas', [])
+        ]
+        cursor.executemany('''
+            INSERT OR IGNORE INTO map_areas (area_name, display_name, description, area_type, created_at)
+            VALUES (?, ?, ?, ?, ?)
+        ''', area_rows)
+
+        # 插入位置数据
+        location_rows = []
+        for location in location_data.get('locations', []):
+            # 确保所有必需字段都有值，优先使用location_id作为主键
+            location_name = location.get('location_id') or location.get('location_name')
+            display_name = location.get('display_name') or location.get('location_name') or location.get('location_id')
+            location_rows.append((
+                location_name,
+                display_name,
+                location.get('description', f"位置：{display_name}"),
+                location.get('area_id') or location.get('area', 'novice_village'),
+                location.get('type') or location.get('location_type', 'unknown'),
+                location.get('is_accessible', True),
+                json.dumps(location.get('interactions', []), ensure_ascii=False),
+                now
+            ))
+        cursor.executemany('''
+            INSERT OR REPLACE INTO map_locations (
+                location_name, display_name, description, area_name,
+                location_type, is_accessible, interactions, created_at
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', location_rows)
+
+        print(f"📍 位置数据: {len(area_rows)} 个区域, {len(location_rows)} 个位置")
+
     def _load_default_locations(self, cursor, now):
         """加载默认位置配置"""
         # 默认区域
@@ -394,13 +847,12 @@ class DatabaseSeparationManager:
             ('novice_village', '新手村', '一个安全的新手村落', 'town'),
             ('village_outskirts', '村庄外围', '新手村周围的危险区域', 'wilderness')
         ]
-        
-        for area in default_areas:
-            cursor.execute('''
-                INSERT INTO map_areas (area_name, display_name, description, area_type, created_at)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (*area, now))
-        
+
+        cursor.executemany('''
+            INSERT INTO map_areas (area_name, display_name, description, area_type, created_at)
+            VALUES (?, ?, ?, ?, ?)
+        ''', [(*area, now) for area in default_areas])
+
         # 默认位置
         default_locations = [
             ('home', '家', '你的温馨小屋', 'novice_village', 'safe_zone', True, '[]'),
@@ -409,155 +861,143 @@ class DatabaseSeparationManager:
             ('library', '图书馆', '安静的图书馆', 'novice_village', 'shop', True, '[]'),
             ('forest', '村外森林', '郁郁葱葱的森林', 'village_outskirts', 'wilderness', True, '[]')
         ]
-        
-        for location in default_locations:
-            cursor.execute('''
-                INSERT INTO map_locations (
-                    location_name, display_name, description, area_name, 
-                    location_type, is_accessible, interactions, created_at
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (*location, now))
-    
-    def _load_creature_data(self, cursor, now):
+
+        cursor.executemany('''
+            INSERT INTO map_locations (
+                location_name, display_name, description, area_name,
+                location_type, is_accessible, interactions, created_at
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [(*location, now) for location in default_locations])
+
+    def _load_creature_data(self, cursor, now, creature_data):
         """加载生物数据"""
-        print("👹 加载生物数据...")
-        
-        creature_config_path = os.path.join(self.config_dir, 'creature_control.json')
-        
-        if os.path.exists(creature_config_path):
-            with open(creature_config_path, 'r', encoding='utf-8') as f:
-                creature_data = json.load(f)
-            
-            for creature in creature_data.get('creatures', []):
-                cursor.execute('''
-                    INSERT OR REPLACE INTO creatures (
-                        creature_id, creature_name, creature_type, rarity, level, avatar,
-                        description, base_stats, skills, ai_behavior, experience_reward,
-                        gold_reward, item_drops, habitat, spawn_conditions, created_at
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    creature.get('creature_id'),
-                    creature.get('creature_name'),
-                    creature.get('creature_type'),
-                    creature.get('rarity'),
-                    creature.get('level'),
-                    creature.get('avatar', '👹'),
-                    creature.get('description'),
-                    json.dumps(creature.get('base_stats', {}), ensure_ascii=False),
-                    json.dumps(creature.get('skills', []), ensure_ascii=False),
-                    creature.get('ai_behavior'),
-                    creature.get('experience_reward'),
-                    json.dumps(creature.get('gold_reward', {}), ensure_ascii=False),
-                    json.dumps(creature.get('item_drops', []), ensure_ascii=False),
-                    json.dumps(creature.get('habitat', []), ensure_ascii=False),
-                    json.dumps(creature.get('spawn_conditions', {}), ensure_ascii=False),
-                    now
-                ))
-                print(f"  👹 生物: {creature.get('creature_name')} ({creature.get('creature_id')})")
-        else:
+        if creature_data is None:
             print("⚠️ 生物配置文件不存在")
-    
-    def _load_item_data(self, cursor, now):
+            return
+
+        rows = [
+            (
+                creature.get('creature_id'),
+                creature.get('creature_name'),
+                creature.get('creature_type'),
+                creature.get('rarity'),
+                creature.get('level'),
+                creature.get('avatar', '👹'),
+                creature.get('description'),
+                json.dumps(creature.get('base_stats', {}), ensure_ascii=False),
+                json.dumps(creature.get('skills', []), ensure_ascii=False),
+                creature.get('ai_behavior'),
+                creature.get('experience_reward'),
+                json.dumps(creature.get('gold_reward', {}), ensure_ascii=False),
+                json.dumps(creature.get('item_drops', []), ensure_ascii=False),
+                json.dumps(creature.get('habitat', []), ensure_ascii=False),
+                json.dumps(creature.get('spawn_conditions', {}), ensure_ascii=False),
+                now
+            )
+            for creature in creature_data.get('creatures', [])
+        ]
+        cursor.executemany('''
+            INSERT OR REPLACE INTO creatures (
+                creature_id, creature_name, creature_type, rarity, level, avatar,
+                description, base_stats, skills, ai_behavior, experience_reward,
+                gold_reward, item_drops, habitat, spawn_conditions, created_at
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', rows)
+
+        print(f"👹 生物数据: {len(rows)} 个生物")
+
+    def _load_item_data(self, cursor, now, item_data):
         """加载物品数据"""
-        print("📦 加载物品数据...")
-        
-        item_config_path = os.path.join(self.config_dir, 'item_control.json')
-        
-        if os.path.exists(item_config_path):
-            with open(item_config_path, 'r', encoding='utf-8') as f:
-                item_data = json.load(f)
-            
-            for item in item_data.get('items', []):
-                # 确保必要字段存在
-                item_name = item.get('item_name') or item.get('name') or f"物品_{item.get('item_id', 'unknown')}"
-                
-                cursor.execute('''
-                    INSERT OR REPLACE INTO items (
-                        item_id, name, description, item_type, sub_type, rarity,
-                        base_price, stats, requirements, effects, consumable,
-                        stackable, max_stack, created_at
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    item.get('item_id'),
-                    item_name,
-                    item.get('description', ''),
-                    item.get('item_type'),
-                    item.get('sub_type', ''),
-                    item.get('rarity', 'common'),
-                    item.get('base_price', 0),
-                    json.dumps(item.get('stats', {}), ensure_ascii=False),
-                    json.dumps(item.get('requirements', {}), ensure_ascii=False),
-                    json.dumps(item.get('effects', []), ensure_ascii=False),
-                    item.get('consumable', False),
-                    item.get('stackable', True),
-                    item.get('max_stack', 99),
-                    now
-                ))
-                print(f"  📦 物品: {item_name} ({item.get('item_id')})")
-        else:
+        if item_data is None:
             print("⚠️ 物品配置文件不存在")
-    
-    def _load_shop_data(self, cursor, now):
+            return
+
+        rows = []
+        for item in item_data.get('items', []):
+            # 确保必要字段存在
+            item_name = item.get('item_name') or item.get('name') or f"物品_{item.get('item_id', 'unknown')}"
+            rows.append((
+                item.get('item_id'),
+                item_name,
+                item.get('description', ''),
+                item.get('item_type'),
+                item.get('sub_type', ''),
+                item.get('rarity', 'common'),
+                item.get('base_price', 0),
+                json.dumps(item.get('stats', {}), ensure_ascii=False),
+                json.dumps(item.get('requirements', {}), ensure_ascii=False),
+                json.dumps(item.get('effects', []), ensure_ascii=False),
+                item.get('consumable', False),
+                item.get('stackable', True),
+                item.get('max_stack', 99),
+                now
+            ))
+        cursor.executemany('''
+            INSERT OR REPLACE INTO items (
+                item_id, name, description, item_type, sub_type, rarity,
+                base_price, stats, requirements, effects, consumable,
+                stackable, max_stack, created_at
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', rows)
+
+        print(f"📦 物品数据: {len(rows)} 个物品")
+
+    def _load_shop_data(self, cursor, now, shop_data):
         """加载商店数据"""
-        print("🏪 加载商店数据...")
-        
-        shop_config_path = os.path.join(self.config_dir, 'shop_control.json')
-        
-        if os.path.exists(shop_config_path):
-            with open(shop_config_path, 'r', encoding='utf-8') as f:
-                shop_data = json.load(f)
-            
-            for shop in shop_data.get('shops', []):
-                # 使用shop_name作为shop_id（如果没有单独的shop_id）
-                shop_id = shop.get('shop_id') or shop.get('shop_name')
-                location = shop.get('location') or shop.get('location_name')
-                
-                cursor.execute('''
-                    INSERT OR REPLACE INTO shops (
-                        shop_id, shop_name, description, shop_type, location, created_at
-                    ) VALUES (?, ?, ?, ?, ?, ?)
-                ''', (
-                    shop_id,
-                    shop.get('shop_name'),
-                    shop.get('description', ''),
-                    shop.get('shop_type', 'general'),
-                    location,
+        if shop_data is None:
+            print("⚠️ 商店配置文件不存在")
+            return
+
+        shop_rows = []
+        shop_item_rows = []
+        for shop in shop_data.get('shops', []):
+            # 使用shop_name作为shop_id（如果没有单独的shop_id）
+            shop_id = shop.get('shop_id') or shop.get('shop_name')
+            location = shop.get('location') or shop.get('location_name')
+            shop_rows.append((
+                shop_id,
+                shop.get('shop_name'),
+                shop.get('description', ''),
+                shop.get('shop_type', 'general'),
+                location,
+                now
+            ))
+
+            # 商店物品
+            for item in shop.get('items', []):
+                shop_item_rows.append((
+                    shop_id,  # 使用前面计算的shop_id变量
+                    item.get('item_id'),
+                    item.get('price', 0),
+                    item.get('stock', -1),
                     now
                 ))
-                
-                # 插入商店物品
-                for item in shop.get('items', []):
-                    cursor.execute('''
-                        INSERT OR REPLACE INTO shop_items (
-                            shop_id, item_id, price, stock, created_at
-                        ) VALUES (?, ?, ?, ?, ?)
-                    ''', (
-                        shop_id,  # 使用前面计算的shop_id变量
-                        item.get('item_id'),
-                        item.get('price', 0),
-                        item.get('stock', -1),
-                        now
-                    ))
-                
-                print(f"  🏪 商店: {shop.get('shop_name')} ({shop_id})")
-        else:
-            print("⚠️ 商店配置文件不存在")
+
+        cursor.executemany('''
+            INSERT OR REPLACE INTO shops (
+                shop_id, shop_name, description, shop_type, location, created_at
+            ) VALUES (?, ?, ?, ?, ?, ?)
+        ''', shop_rows)
+        cursor.executemany('''
+            INSERT OR REPLACE INTO shop_items (
+                shop_id, item_id, price, stock, created_at
+            ) VALUES (?, ?, ?, ?, ?)
+        ''', shop_item_rows)
+
+        print(f"🏪 商店数据: {len(shop_rows)} 个商店, {len(shop_item_rows)} 件商品")
 
     def get_user_location(self, username):
         """获取用户当前位置"""
         try:
             # 从用户数据库获取用户位置
-            conn = sqlite3.connect(self.game_db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT current_area, current_location, last_updated
-                FROM user_locations 
-                WHERE username = ?
-            ''', (username,))
-            
-            user_location = cursor.fetchone()
-            conn.close()
+            with self.game_pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT current_area, current_location, last_updated
+                    FROM user_locations 
+                    WHERE username = ?
+                ''', (username,))
+                user_location = cursor.fetchone()
             
             if not user_location:
                 return None
@@ -565,17 +1005,14 @@ class DatabaseSeparationManager:
             current_area, current_location, last_updated = user_location
             
             # 从世界数据库获取位置详细信息
-            world_conn = sqlite3.connect(self.world_db_path)
-            world_cursor = world_conn.cursor()
-            
-            world_cursor.execute('''
-                SELECT display_name, description, area_name, location_type, is_accessible
-                FROM map_locations 
-                WHERE location_name = ?
-            ''', (current_location,))
-            
-            location_info = world_cursor.fetchone()
-            world_conn.close()
+            with self.world_pool.connection() as world_conn:
+                world_cursor = world_conn.cursor()
+                world_cursor.execute('''
+                    SELECT display_name, description, area_name, location_type, is_accessible
+                    FROM map_locations 
+                    WHERE location_name = ?
+                ''', (current_location,))
+                location_info = world_cursor.fetchone()
             
             if location_info:
                 return {
@@ -607,19 +1044,15 @@ class DatabaseSeparationManager:
     def initialize_user_location(self, username):
         """为新用户初始化位置"""
         try:
-            conn = sqlite3.connect(self.game_db_path)
-            cursor = conn.cursor()
-            
             now = datetime.now().isoformat()
             
-            cursor.execute('''
-                INSERT OR REPLACE INTO user_locations 
-                (username, current_area, current_location, last_updated) 
-                VALUES (?, ?, ?, ?)
-            ''', (username, 'novice_village', 'home', now))
-            
-            conn.commit()
-            conn.close()
+            with self.game_pool.connection() as conn:
+                conn.execute('''
+                    INSERT OR REPLACE INTO user_locations 
+                    (username, current_area, current_location, last_updated) 
+                    VALUES (?, ?, ?, ?)
+                ''', (username, 'novice_village', 'home', now))
+                conn.commit()
             
             print(f"✅ 用户 {username} 位置初始化完成")
             return True
@@ -628,41 +1061,42 @@ class DatabaseSeparationManager:
             print(f"❌ 初始化用户位置失败: {e}")
             return False
 
+    def prepare(self, query) -> Statement:
+        """预先解析SQL，返回可重复传给execute_query的Statement对象"""
+        return prepare(query)
+
     def execute_query(self, query, params=None, fetch_one=False, fetch_all=False):
-        """执行SQL查询的通用方法，兼容旧的DatabaseManager接口"""
+        """执行SQL查询的通用方法，兼容旧的DatabaseManager接口
+        
+        query 可以是SQL字符串，也可以是 prepare() 返回的 Statement
+        """
         try:
-            # 判断查询类型，决定使用哪个数据库
-            query_lower = query.lower().strip()
-            
-            # 用户相关的表使用游戏数据库 (包括user_sessions, chat_history等)
-            if any(table in query_lower for table in ['users', 'user_data', 'user_locations', 'user_inventory', 'user_equipment', 'user_sessions', 'chat_history', 'rooms', 'room_users', 'room_messages']):
-                db_path = self.game_db_path
-            else:
-                # 其他表使用世界数据库 (creatures, items, shops, map_locations等)
-                db_path = self.world_db_path
-            
-            conn = sqlite3.connect(db_path)
-            conn.row_factory = sqlite3.Row  # 使结果可以通过列名访问
-            cursor = conn.cursor()
-            
-            if params:
-                cursor.execute(query, params)
-            else:
-                cursor.execute(query)
-            
-            result = None
-            if fetch_one:
-                row = cursor.fetchone()
-                result = dict(row) if row else None
-            elif fetch_all:
-                rows = cursor.fetchall()
-                result = [dict(row) for row in rows] if rows else []
+            # 按 表 -> 数据库 注册表路由（每条SQL只解析一次）
+            statement = route(query)
+            pool = self.game_pool if statement.database == GAME_DB else self.world_pool
+            query = statement.sql
             
-            # 如果是INSERT, UPDATE, DELETE等修改操作，需要提交
-            if query_lower.startswith(('insert', 'update', 'delete')):
-                conn.commit()
+            with pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.row_factory = sqlite3.Row  # 使结果可以通过列名访问
+                
+                if params:
+                    cursor.execute(query, params)
+                else:
+                    cursor.execute(query)
+                
+                result = None
+                if fetch_one:
+                    row = cursor.fetchone()
+                    result = dict(row) if row else None
+                elif fetch_all:
+                    rows = cursor.fetchall()
+                    result = [dict(row) for row in rows] if rows else []
+                
+                # 如果是INSERT, UPDATE, DELETE等修改操作，需要提交
+                if statement.is_write:
+                    conn.commit()
             
-            conn.close()
             return result
             
         except Exception as e:
@@ -672,28 +1106,27 @@ class DatabaseSeparationManager:
     def get_area_locations(self, area_name):
         """获取区域内的所有地点"""
         try:
-            conn = sqlite3.connect(self.world_db_path)
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT location_name, display_name, description, location_type, is_accessible
-                FROM map_locations 
-                WHERE area_name = ?
-                ORDER BY location_type, display_name
-            ''', (area_name,))
-            
-            locations = []
-            for row in cursor.fetchall():
-                locations.append({
-                    'location_name': row['location_name'],
-                    'display_name': row['display_name'],
-                    'description': row['description'],
-                    'location_type': row['location_type'],
-                    'is_accessible': bool(row['is_accessible'])
-                })
+            with self.world_pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.row_factory = sqlite3.Row
+                
+                cursor.execute('''
+                    SELECT location_name, display_name, description, location_type, is_accessible
+                    FROM map_locations 
+                    WHERE area_name = ?
+                    ORDER BY location_type, display_name
+                ''', (area_name,))
+                
+                locations = []
+                for row in cursor.fetchall():
+                    locations.append({
+                        'location_name': row['location_name'],
+                        'display_name': row['display_name'],
+                        'description': row['description'],
+                        'location_type': row['location_type'],
+                        'is_accessible': bool(row['is_accessible'])
+                    })
             
-            conn.close()
             return locations
             
         except Exception as e:
@@ -703,18 +1136,17 @@ class DatabaseSeparationManager:
     def get_shop_by_location(self, location_name):
         """根据位置获取商店信息"""
         try:
-            conn = sqlite3.connect(self.world_db_path)
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT shop_name, shop_name as display_name, description, shop_type
-                FROM shops 
-                WHERE location = ?
-            ''', (location_name,))
-            
-            result = cursor.fetchone()
-            conn.close()
+            with self.world_pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.row_factory = sqlite3.Row
+                
+                cursor.execute('''
+                    SELECT shop_name, shop_name as display_name, description, shop_type
+                    FROM shops 
+                    WHERE location = ?
+                ''', (location_name,))
+                
+                result = cursor.fetchone()
             
             if result:
                 return {
@@ -732,28 +1164,27 @@ class DatabaseSeparationManager:
     def get_shop_items(self, shop_name):
         """获取商店商品列表"""
         try:
-            conn = sqlite3.connect(self.world_db_path)
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT si.item_id, si.price, si.stock
-                FROM shop_items si
-                JOIN shops s ON si.shop_id = s.shop_id
-                WHERE s.shop_name = ?
-                ORDER BY si.price
-            ''', (shop_name,))
-            
-            items = []
-            for row in cursor.fetchall():
-                items.append({
-                    'item_id': row['item_id'],
-                    'price': row['price'],
-                    'stock': row['stock'],
-                    'is_available': True  # 所有商品默认可用
-                })
+            with self.world_pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.row_factory = sqlite3.Row
+                
+                cursor.execute('''
+                    SELECT si.item_id, si.price, si.stock
+                    FROM shop_items si
+                    JOIN shops s ON si.shop_id = s.shop_id
+                    WHERE s.shop_name = ?
+                    ORDER BY si.price
+                ''', (shop_name,))
+                
+                items = []
+                for row in cursor.fetchall():
+                    items.append({
+                        'item_id': row['item_id'],
+                        'price': row['price'],
+                        'stock': row['stock'],
+                        'is_available': True  # 所有商品默认可用
+                    })
             
-            conn.close()
             return items
         except Exception as e:
             print(f"❌ 获取商店商品失败: {e}")
@@ -761,123 +1192,101 @@ class DatabaseSeparationManager:
     
     def purchase_item(self, username, shop_name, item_id, price):
         """购买商品"""
-        # 用户数据使用游戏数据库
-        game_conn = sqlite3.connect(self.game_db_path)
-        # 商店数据使用世界数据库
-        world_conn = sqlite3.connect(self.world_db_path)
-        
         try:
-            game_cursor = game_conn.cursor()
-            world_cursor = world_conn.cursor()
-            
-            # 检查用户金币
-            game_cursor.execute('SELECT gold FROM user_data WHERE username = ?', (username,))
-            user_gold_result = game_cursor.fetchone()
-            if not user_gold_result or user_gold_result[0] < price:
-                game_conn.close()
-                world_conn.close()
-                return False, "金币不足"
-            
-            # 检查商品库存
-            world_cursor.execute('''
-                SELECT si.stock FROM shop_items si
-                JOIN shops s ON si.shop_id = s.shop_id
-                WHERE s.shop_name = ? AND si.item_id = ?
-            ''', (shop_name, item_id))
-            
-            stock_result = world_cursor.fetchone()
-            if not stock_result:
-                game_conn.close()
-                world_conn.close()
-                return False, "商品不存在或已下架"
-            
-            stock = stock_result[0]
-            if stock == 0:
-                game_conn.close()
-                world_conn.close()
-                return False, "商品已售完"
-            
-            # 扣除金币
-            game_cursor.execute('''
-                UPDATE user_data SET gold = gold - ?, last_updated = ?
-                WHERE username = ?
-            ''', (price, datetime.now().isoformat(), username))
-            
-            # 减少库存（如果不是无限库存）
-            if stock > 0:
+            # 用户数据使用游戏数据库，商店数据使用世界数据库
+            with self.game_pool.connection() as game_conn, self.world_pool.connection() as world_conn:
+                game_cursor = game_conn.cursor()
+                world_cursor = world_conn.cursor()
+                
+                # 检查用户金币
+                game_cursor.execute('SELECT gold FROM user_data WHERE username = ?', (username,))
+                user_gold_result = game_cursor.fetchone()
+                if not user_gold_result or user_gold_result[0] < price:
+                    return False, "金币不足"
+                
+                # 检查商品库存
                 world_cursor.execute('''
-                    UPDATE shop_items SET stock = stock - 1
-                    WHERE shop_id IN (SELECT shop_id FROM shops WHERE shop_name = ?) AND item_id = ?
+                    SELECT si.stock FROM shop_items si
+                    JOIN shops s ON si.shop_id = s.shop_id
+                    WHERE s.shop_name = ? AND si.item_id = ?
                 ''', (shop_name, item_id))
-            
-            # 添加物品到用户背包
-            game_cursor.execute('''
-                INSERT INTO user_inventory (username, item_id, quantity, acquired_at)
-                VALUES (?, ?, 1, ?)
-                ON CONFLICT(username, item_id) DO UPDATE SET
-                quantity = quantity + 1,
-                acquired_at = ?
-            ''', (username, item_id, datetime.now().isoformat(), datetime.now().isoformat()))
-            
-            game_conn.commit()
-            world_conn.commit()
-            game_conn.close()
-            world_conn.close()
-            return True, "购买成功"
+                
+                stock_result = world_cursor.fetchone()
+                if not stock_result:
+                    return False, "商品不存在或已下架"
+                
+                stock = stock_result[0]
+                if stock == 0:
+                    return False, "商品已售完"
+                
+                # 扣除金币
+                game_cursor.execute('''
+                    UPDATE user_data SET gold = gold - ?, last_updated = ?
+                    WHERE username = ?
+                ''', (price, datetime.now().isoformat(), username))
+                
+                # 减少库存（如果不是无限库存）
+                if stock > 0:
+                    world_cursor.execute('''
+                        UPDATE shop_items SET stock = stock - 1
+                        WHERE shop_id IN (SELECT shop_id FROM shops WHERE shop_name = ?) AND item_id = ?
+                    ''', (shop_name, item_id))
+                
+                # 添加物品到用户背包
+                game_cursor.execute('''
+                    INSERT INTO user_inventory (username, item_id, quantity, acquired_at)
+                    VALUES (?, ?, 1, ?)
+                    ON CONFLICT(username, item_id) DO UPDATE SET
+                    quantity = quantity + 1,
+                    acquired_at = ?
+                ''', (username, item_id, datetime.now().isoformat(), datetime.now().isoformat()))
+                
+                game_conn.commit()
+                world_conn.commit()
+                return True, "购买成功"
             
         except Exception as e:
-            game_conn.rollback()
-            world_conn.rollback()
-            game_conn.close()
-            world_conn.close()
+            # 连接池在异常时会自动回滚未提交的事务
             return False, f"购买失败：{str(e)}"
 
     def update_user_location(self, username, new_location):
         """更新用户位置"""
-        # 位置信息在世界数据库，用户位置在游戏数据库
-        world_conn = sqlite3.connect(self.world_db_path)
-        game_conn = sqlite3.connect(self.game_db_path)
-        
         try:
-            world_cursor = world_conn.cursor()
-            game_cursor = game_conn.cursor()
-            
-            # 检查位置是否存在且可访问
-            print(f"🔍 检查位置: {new_location}")
-            world_cursor.execute('''
-                SELECT area_name FROM map_locations 
-                WHERE location_name = ? AND is_accessible = 1
-            ''', (new_location,))
-            
-            location_data = world_cursor.fetchone()
-            print(f"📍 位置查询结果: {location_data}")
-            
-            if not location_data:
-                # 打印所有可用位置用于调试
-                world_cursor.execute('SELECT location_name, area_name, is_accessible FROM map_locations')
-                all_locations = world_cursor.fetchall()
-                print(f"🗺️ 所有可用位置: {all_locations}")
-                world_conn.close()
-                game_conn.close()
-                return False, "该位置不存在或不可访问"
+            # 位置信息在世界数据库，用户位置在游戏数据库
+            with self.world_pool.connection() as world_conn:
+                world_cursor = world_conn.cursor()
+                
+                # 检查位置是否存在且可访问
+                print(f"🔍 检查位置: {new_location}")
+                world_cursor.execute('''
+                    SELECT area_name FROM map_locations 
+                    WHERE location_name = ? AND is_accessible = 1
+                ''', (new_location,))
+                
+                location_data = world_cursor.fetchone()
+                print(f"📍 位置查询结果: {location_data}")
+                
+                if not location_data:
+                    # 打印所有可用位置用于调试
+                    world_cursor.execute('SELECT location_name, area_name, is_accessible FROM map_locations')
+                    all_locations = world_cursor.fetchall()
+                    print(f"🗺️ 所有可用位置: {all_locations}")
+                    return False, "该位置不存在或不可访问"
             
             area_name = location_data[0]
             
             # 更新用户位置
-            game_cursor.execute('''
-                INSERT OR REPLACE INTO user_locations 
-                (username, current_area, current_location, last_updated) 
-                VALUES (?, ?, ?, ?)
-            ''', (username, area_name, new_location, datetime.now().isoformat()))
+            with self.game_pool.connection() as game_conn:
+                game_conn.execute('''
+                    INSERT OR REPLACE INTO user_locations 
+                    (username, current_area, current_location, last_updated) 
+                    VALUES (?, ?, ?, ?)
+                ''', (username, area_name, new_location, datetime.now().isoformat()))
+                game_conn.commit()
             
-            game_conn.commit()
-            world_conn.close()
-            game_conn.close()
             return True, "位置更新成功"
             
         except Exception as e:
-            world_conn.close()
-            game_conn.close()
             return False, f"位置更新失败：{str(e)}"
 
 
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+SQLite连接池
+
+每个数据库文件对应一个有上限的连接池：
+- 连接按需创建，归还后放回空闲列表复用，避免每次查询都 connect/close
+- 同一线程内嵌套获取连接时复用同一个连接（可重入）
+- 空闲过久的连接在取出前做健康检查，失效则丢弃重建
+- 记录获取次数、等待时间、超时次数等指标，便于观察连接池是否过小
+"""
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Any
+
+
+class PoolTimeoutError(sqlite3.OperationalError):
+    """在超时时间内没有拿到可用连接"""
+
+
+class SQLiteConnectionPool:
+    """有上限的SQLite连接池（线程安全）"""
+
+    def __init__(self, db_path: str, max_size: int = 8, timeout: float = 10.0,
+                 health_check_interval: float = 30.0, name: str = None,
+                 on_connect: Optional[Callable[[sqlite3.Connection], None]] = None):
+        self.db_path = db_path
+        self.max_size = max(1, int(max_size))
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self.name = name or db_path
+        self.on_connect = on_connect
+
+        self._lock = threading.Condition(threading.Lock())
+        self._idle: List[tuple] = []  # [(conn, 归还时间)]
+        self._size = 0  # 已创建且未关闭的连接数
+        self._generation = 0  # close_all 之后递增，旧代连接归还时直接关闭
+        self._conn_generation: Dict[int, int] = {}
+        self._local = threading.local()
+
+        # 指标
+        self._stats = {
+            'acquires': 0,
+            'waits': 0,
+            'timeouts': 0,
+            'total_wait_time': 0.0,
+            'max_wait_time': 0.0,
+            'created': 0,
+            'discarded': 0,
+        }
+
+    def _create_connection(self) -> sqlite3.Connection:
+        """创建新连接"""
+        conn = sqlite3.connect(self.db_path, timeout=self.timeout, check_same_thread=False)
+        if self.on_connect:
+            self.on_connect(conn)
+        return conn
+
+    def _is_healthy(self, conn: sqlite3.Connection) -> bool:
+        """健康检查"""
+        try:
+            conn.execute('SELECT 1').fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _discard(self, conn: sqlite3.Connection):
+        """关闭并丢弃连接（调用方需持有锁）"""
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        self._conn_generation.pop(id(conn), None)
+        self._size -= 1
+        self._stats['discarded'] += 1
+        self._lock.notify()
+
+    def acquire(self, timeout: float = None) -> sqlite3.Connection:
+        """从池中取出一个连接，池满时最多等待timeout秒"""
+        timeout = self.timeout if timeout is None else timeout
+        start = time.monotonic()
+        deadline = start + timeout
+        waited = False
+
+        with self._lock:
+            while True:
+                while self._idle:
+                    conn, released_at = self._idle.pop()
+                    if time.monotonic() - released_at < self.health_check_interval or self._is_healthy(conn):
+                        return self._record_acquire(conn, start, waited)
+                    self._discard(conn)
+
+                if self._size < self.max_size:
+                    self._size += 1
+                    break
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    raise PoolTimeoutError(f"连接池 {self.name} 获取连接超时 ({timeout}秒)")
+                waited = True
+                self._lock.wait(remaining)
+
+        # 在锁外建立连接，避免阻塞其他线程
+        try:
+            conn = self._create_connection()
+        except Exception:
+            with self._lock:
+                self._size -= 1
+                self._lock.notify()
+            raise
+
+        with self._lock:
+            self._stats['created'] += 1
+            self._conn_generation[id(conn)] = self._generation
+            return self._record_acquire(conn, start, waited)
+
+    def _record_acquire(self, conn, start, waited):
+        """记录一次获取的指标（调用方需持有锁）"""
+        wait_time = time.monotonic() - start
+        self._stats['acquires'] += 1
+        if waited:
+            self._stats['waits'] += 1
+        self._stats['total_wait_time'] += wait_time
+        if wait_time > self._stats['max_wait_time']:
+            self._stats['max_wait_time'] = wait_time
+        return conn
+
+    def release(self, conn: sqlite3.Connection):
+        """归还连接，未提交的事务会被回滚"""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            conn.row_factory = None
+        except sqlite3.Error:
+            with self._lock:
+                self._discard(conn)
+            return
+
+        with self._lock:
+            if self._conn_generation.get(id(conn)) != self._generation:
+                self._discard(conn)
+                return
+            self._idle.append((conn, time.monotonic()))
+            self._lock.notify()
+
+    @contextmanager
+    def connection(self):
+        """获取连接的上下文管理器，同一线程内嵌套调用会复用同一连接"""
+        held = getattr(self._local, 'held', None)
+        if held is not None:
+            self._local.depth += 1
+            try:
+                yield held
+            finally:
+                self._local.depth -= 1
+            return
+
+        conn = self.acquire()
+        self._local.held = conn
+        self._local.depth = 1
+        try:
+            yield conn
+        except Exception:
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                pass
+            raise
+        finally:
+            self._local.held = None
+            self._local.depth = 0
+            self.release(conn)
+
+    def close_all(self):
+        """关闭所有空闲连接（例如数据库文件被重建前），使用中的连接在归还时关闭"""
+        with self._lock:
+            self._generation += 1
+            while self._idle:
+                conn, _ = self._idle.pop()
+                self._discard(conn)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取连接池指标"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({
+                'name': self.name,
+                'max_size': self.max_size,
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._size - len(self._idle),
+                'avg_wait_time': (stats['total_wait_time'] / stats['acquires']) if stats['acquires'] else 0.0,
+            })
+            return stats
@@ -3,6 +3,29 @@ from datetime import datetime
 from database import DatabaseManager
 from database_separation import db_separation_manager
 
+# 每轮对话都会执行的预解析语句
+SAVE_MESSAGE = db_separation_manager.prepare(
+    "INSERT INTO chat_history (username, character, role, content, timestamp) VALUES (?, ?, ?, ?, ?)"
+)
+RECENT_MESSAGES = db_separation_manager.prepare(
+    "SELECT id, role, content FROM chat_history WHERE username = ? AND character = ? AND id > ? ORDER BY id DESC LIMIT ?"
+)
+MESSAGES_RANGE = db_separation_manager.prepare(
+    "SELECT id, role, content FROM chat_history WHERE username = ? AND character = ? AND id > ? AND id <= ? ORDER BY id LIMIT ?"
+)
+GET_SUMMARY = db_separation_manager.prepare(
+    "SELECT summary, summarized_until, updated_at FROM chat_summaries WHERE username = ? AND character = ?"
+)
+# 只接受比已有摘要覆盖得更多的新摘要，并发生成时不会被旧结果覆盖
+SAVE_SUMMARY = db_separation_manager.prepare('''
+    INSERT INTO chat_summaries (username, character, summary, summarized_until, updated_at)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (username, character) DO UPDATE SET
+        summary = excluded.summary,
+        summarized_until = excluded.summarized_until,
+        updated_at = excluded.updated_at
+    WHERE excluded.summarized_until > chat_summaries.summarized_until
+''')
 
 class HistoryManager:
     def __init__(self):
@@ -12,7 +35,7 @@ class HistoryManager:
         """保存聊天消息到数据库"""
         try:
             self.db.execute_query(
-                "INSERT INTO chat_history (username, character, role, content, timestamp) VALUES (?, ?, ?, ?, ?)",
+                SAVE_MESSAGE,
                 (username, character, role, content, datetime.now().isoformat())
             )
             return True
@@ -42,6 +65,48 @@ class HistoryManager:
             print(f"获取聊天历史出错: {e}")
             return []
 
+    def get_recent_messages(self, username, character, after_id=0, limit=50):
+        """获取 id 大于 after_id 的最近 limit 条消息（按时间正序，带消息ID）"""
+        try:
+            messages = self.db.execute_query(
+                RECENT_MESSAGES, (username, character, after_id, limit), fetch_all=True
+            )
+            return [dict(msg) for msg in reversed(messages)]
+        except Exception as e:
+            print(f"获取聊天历史出错: {e}")
+            return []
+
+    def get_messages_between(self, username, character, after_id, until_id, limit):
+        """获取 after_id < id <= until_id 的消息（按时间正序，最多 limit 条）"""
+        try:
+            messages = self.db.execute_query(
+                MESSAGES_RANGE, (username, character, after_id, until_id, limit), fetch_all=True
+            )
+            return [dict(msg) for msg in messages]
+        except Exception as e:
+            print(f"获取聊天历史出错: {e}")
+            return []
+
+    def get_summary(self, username, character):
+        """获取较早对话的滚动摘要，没有时返回None"""
+        try:
+            return self.db.execute_query(GET_SUMMARY, (username, character), fetch_one=True)
+        except Exception as e:
+            print(f"获取对话摘要出错: {e}")
+            return None
+
+    def save_summary(self, username, character, summary, summarized_until):
+        """保存滚动摘要（只会向前推进）"""
+        try:
+            self.db.execute_query(
+                SAVE_SUMMARY,
+                (username, character, summary, summarized_until, datetime.now().isoformat())
+            )
+            return True
+        except Exception as e:
+            print(f"保存对话摘要出错: {e}")
+            return False
+
     def get_all_characters(self, username):
         """获取用户的所有聊天角色"""
         try:
@@ -62,6 +127,10 @@ class HistoryManager:
                 "DELETE FROM chat_history WHERE username = ? AND character = ?",
                 (username, character)
             )
+            self.db.execute_query(
+                "DELETE FROM chat_summaries WHERE username = ? AND character = ?",
+                (username, character)
+            )
             return True
         except Exception as e:
             print(f"清除聊天历史出错: {e}")
@@ -70,6 +139,13 @@ class HistoryManager:
     def delete_message(self, username, character, timestamp):
         """删除指定的消息"""
         try:
+            # 被删除的消息已并入摘要时丢弃摘要，之后按剩余消息重新生成
+            self.db.execute_query(
+                """DELETE FROM chat_summaries WHERE username = ? AND character = ? AND summarized_until >= (
+                       SELECT MIN(id) FROM chat_history WHERE username = ? AND character = ? AND timestamp = ?
+                   )""",
+                (username, character, username, character, timestamp)
+            )
             self.db.execute_query(
                 "DELETE FROM chat_history WHERE username = ? AND character = ? AND timestamp = ?",
                 (username, character, timestamp)
@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+"""
+LLM网关
+
+所有对大模型的调用都经过这里：
+- 全局并发上限：同时进行的上游调用不超过 LLM_MAX_CONCURRENCY
+- 公平排队：每个用户/房间一条队列，空出名额时按轮询从各队列取请求，
+  一个用户连续发起很多请求也不会饿死其他人
+- 过载保护：总排队数或单个用户/房间的排队数超限时立即拒绝，排队超时也会拒绝，
+  调用方据此返回“服务繁忙”
+- 指标：排队深度、等待时间、拒绝/超时次数
+非流式调用在共享线程池中执行，调用方可以按超时放弃等待；流式调用拿到名额后在调用方线程中迭代。
+"""
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Dict, Iterator
+from config import (LLM_MAX_CONCURRENCY, LLM_MAX_QUEUE, LLM_MAX_QUEUE_PER_KEY,
+                    LLM_QUEUE_TIMEOUT, LLM_CALL_TIMEOUT)
+
+
+class LLMGatewayError(Exception):
+    """网关无法完成调用"""
+
+
+class GatewayOverloadedError(LLMGatewayError):
+    """排队已满或排队超时"""
+
+
+class GatewayTimeoutError(LLMGatewayError):
+    """上游调用超时"""
+
+
+class _Ticket:
+    """一个排队中的调用"""
+    __slots__ = ('key', 'event', 'enqueued_at', 'granted', 'cancelled')
+
+    def __init__(self, key):
+        self.key = key
+        self.event = threading.Event()
+        self.enqueued_at = time.monotonic()
+        self.granted = False
+        self.cancelled = False
+
+
+class LLMGateway:
+    """带并发上限和按用户/房间公平排队的LLM调用网关（线程安全）"""
+
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY, max_queue: int = LLM_MAX_QUEUE,
+                 max_queue_per_key: int = LLM_MAX_QUEUE_PER_KEY, queue_timeout: float = LLM_QUEUE_TIMEOUT,
+                 call_timeout: float = LLM_CALL_TIMEOUT):
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.max_queue = max_queue
+        self.max_queue_per_key = max_queue_per_key
+        self.queue_timeout = queue_timeout
+        self.call_timeout = call_timeout
+
+        self._lock = threading.Lock()
+        self._queues: "OrderedDict[str, deque]" = OrderedDict()  # key -> 排队中的 _Ticket，按轮询顺序
+        self._queued = 0
+        self._running = 0
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix='llm-gateway')
+
+        self._stats = {
+            'submitted': 0,
+            'granted': 0,
+            'completed': 0,
+            'failed': 0,
+            'rejected': 0,
+            'queue_timeouts': 0,
+            'call_timeouts': 0,
+            'total_wait_time': 0.0,
+            'max_wait_time': 0.0,
+            'max_queue_depth': 0,
+        }
+
+    def _enqueue(self, key: str) -> _Ticket:
+        """加入key对应的队列，超出排队上限时抛出 GatewayOverloadedError"""
+        with self._lock:
+            queue = self._queues.get(key)
+            if self._queued >= self.max_queue or (queue and len(queue) >= self.max_queue_per_key):
+                self._stats['rejected'] += 1
+                raise GatewayOverloadedError("AI服务繁忙，请稍后再试")
+
+            ticket = _Ticket(key)
+            if queue is None:
+                queue = self._queues[key] = deque()
+            queue.append(ticket)
+            self._queued += 1
+            self._stats['submitted'] += 1
+            if self._queued > self._stats['max_queue_depth']:
+                self._stats['max_queue_depth'] = self._queued
+            self._dispatch()
+            return ticket
+
+    def _dispatch(self):
+        """有空闲名额时按轮询从各队列放行（调用方需持有锁）"""
+        while self._running < self.max_concurrency and self._queues:
+            key, queue = next(iter(self._queues.items()))
+            ticket = queue.popleft()
+            if queue:
+                self._queues.move_to_end(key)
+            else:
+                del self._queues[key]
+            self._queued -= 1
+
+            wait_time = time.monotonic() - ticket.enqueued_at
+            self._stats['total_wait_time'] += wait_time
+            if wait_time > self._stats['max_wait_time']:
+                self._stats['max_wait_time'] = wait_time
+
+            self._running += 1
+            self._stats['granted'] += 1
+            ticket.granted = True
+            ticket.event.set()
+
+    def _wait(self, ticket: _Ticket):
+        """等待放行，排队超时则撤销并抛出 GatewayOverloadedError"""
+        if ticket.event.wait(self.queue_timeout):
+            return
+        with self._lock:
+            if ticket.granted:
+                return
+            ticket.cancelled = True
+            queue = self._queues.get(ticket.key)
+            if queue is not None:
+                queue.remove(ticket)
+                self._queued -= 1
+                if not queue:
+                    del self._queues[ticket.key]
+            self._stats['queue_timeouts'] += 1
+        raise GatewayOverloadedError("AI服务排队超时，请稍后再试")
+
+    def _release(self, failed: bool = False):
+        """释放名额并放行下一个"""
+        with self._lock:
+            self._running -= 1
+            self._stats['failed' if failed else 'completed'] += 1
+            self._dispatch()
+
+    def call(self, key: str, fn: Callable[..., Any], *args, timeout: float = None, **kwargs) -> Any:
+        """排队后在线程池中执行 fn(*args, **kwargs)，返回其结果
+
+        key 为公平排队的单位，例如 "user:<用户名>"、"room:<房间ID>"
+        """
+        ticket = self._enqueue(key)
+        self._wait(ticket)
+
+        def run():
+            # 调用方超时放弃等待后，名额仍占用到上游调用真正结束
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException:
+                self._release(failed=True)
+                raise
+            self._release()
+            return result
+
+        try:
+            future = self._executor.submit(run)
+        except Exception:
+            self._release(failed=True)
+            raise
+
+        try:
+            return future.result(timeout=self.call_timeout if timeout is None else timeout)
+        except FutureTimeoutError:
+            with self._lock:
+                self._stats['call_timeouts'] += 1
+            raise GatewayTimeoutError("AI服务响应超时")
+
+    def open_stream(self, key: str, fn: Callable[..., Iterator], *args, **kwargs) -> Iterator:
+        """为流式调用排队，返回迭代器；第一次迭代时等待名额，迭代结束或 close() 时释放
+
+        排队已满会在这里立即抛出 GatewayOverloadedError，便于在开始响应前返回错误
+        """
+        ticket = self._enqueue(key)
+        return _GatewayStream(self, ticket, lambda: fn(*args, **kwargs))
+
+    def _abandon(self, ticket: _Ticket):
+        """放弃一个尚未开始执行的排队"""
+        with self._lock:
+            if ticket.granted:
+                self._running -= 1
+                self._dispatch()
+                return
+            queue = self._queues.get(ticket.key)
+            if queue is not None and ticket in queue:
+                queue.remove(ticket)
+                self._queued -= 1
+                if not queue:
+                    del self._queues[ticket.key]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取网关指标"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({
+                'max_concurrency': self.max_concurrency,
+                'max_queue': self.max_queue,
+                'running': self._running,
+                'queued': self._queued,
+                'queued_keys': len(self._queues),
+                'avg_wait_time': (stats['total_wait_time'] / stats['granted']) if stats['granted'] else 0.0,
+            })
+            return stats
+
+
+class _GatewayStream:
+    """占用网关名额的流式迭代器"""
+
+    def __init__(self, gateway: LLMGateway, ticket: _Ticket, factory: Callable[[], Iterator]):
+        self._gateway = gateway
+        self._ticket = ticket
+        self._factory = factory
+        self._iterator = None
+        self._closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._closed:
+            raise StopIteration
+        if self._iterator is None:
+            try:
+                self._gateway._wait(self._ticket)
+            except GatewayOverloadedError:
+                self._closed = True
+                raise
+            try:
+                self._iterator = iter(self._factory())
+            except BaseException:
+                self._finish(failed=True)
+                raise
+        try:
+            return next(self._iterator)
+        except StopIteration:
+            self._finish()
+            raise
+        except BaseException:
+            self._finish(failed=True)
+            raise
+
+    def close(self):
+        """提前结束（例如客户端断开），释放名额或撤销排队"""
+        if self._closed:
+            return
+        if self._iterator is None:
+            self._closed = True
+            self._gateway._abandon(self._ticket)
+            return
+        close = getattr(self._iterator, 'close', None)
+        try:
+            if close:
+                close()
+        finally:
+            self._finish()
+
+    def _finish(self, failed: bool = False):
+        if not self._closed:
+            self._closed = True
+            self._gateway._release(failed=failed)
+
+    def __del__(self):
+        self.close()
+
+
+# 全局网关实例
+llm_gateway = LLMGateway()
@@ -1,10 +1,91 @@
 # -*- coding: utf-8 -*-
 """
 配置管理器 - 统一管理所有JSON配置文件
+
+加载后会为常用查询建立只读哈希索引（按ID、类型、区域、稀有度），
+按ID查找为O(1)，不再线性扫描配置列表。
+
+配置与索引打包成不可变的快照，热重载时先构建好新快照，
+再一次性替换引用，正在处理的请求不会看到加载了一半的配置。
 """
+import hashlib
 import json
 import os
-from typing import Dict, List, Any, Optional
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from types import MappingProxyType
+from typing import Callable, Dict, List, Any, Optional, Mapping, Tuple
+
+_EMPTY_INDEX: Mapping = MappingProxyType({})
+
+# 配置名 -> 文件名
+CONFIG_FILES = {
+    'shops': 'shop_control.json',
+    'items': 'item_control.json',
+    'locations': 'location_control.json',
+    'creatures': 'creature_control.json',
+    'skills': 'skill_control.json',
+    'events': 'event_control.json'
+}
+
+
+def _index_by(entries, key) -> Mapping[str, Dict[str, Any]]:
+    """按唯一键建立只读索引，键重复时保留第一条（与线性查找的结果一致）"""
+    index = {}
+    for entry in entries:
+        value = entry.get(key)
+        if value is not None and value not in index:
+            index[value] = entry
+    return MappingProxyType(index)
+
+
+def _group_by(entries, key) -> Mapping[str, Tuple[Dict[str, Any], ...]]:
+    """按非唯一键分组建立只读索引，值为保持原顺序的元组；键为列表时每个元素都建索引"""
+    groups = {}
+    for entry in entries:
+        values = entry.get(key)
+        if not isinstance(values, list):
+            values = [values]
+        for value in values:
+            if value is not None:
+                groups.setdefault(value, []).append(entry)
+    return MappingProxyType({value: tuple(group) for value, group in groups.items()})
+
+
+def _build_indexes(configs: Mapping[str, Dict[str, Any]]) -> Mapping[str, Mapping]:
+    """根据配置建立只读索引"""
+    items = configs.get('items', {}).get('items', [])
+    creatures = configs.get('creatures', {}).get('creatures', [])
+    locations = configs.get('locations', {}).get('locations', [])
+
+    return MappingProxyType({
+        'shops_by_name': _index_by(configs.get('shops', {}).get('shops', []), 'shop_name'),
+        'items_by_id': _index_by(items, 'item_id'),
+        'items_by_type': _group_by(items, 'item_type'),
+        'items_by_rarity': _group_by(items, 'rarity'),
+        'areas_by_id': _index_by(configs.get('locations', {}).get('areas', []), 'area_id'),
+        'locations_by_id': _index_by(locations, 'location_id'),
+        'locations_by_area': _group_by(locations, 'area_id'),
+        'creatures_by_id': _index_by(creatures, 'creature_id'),
+        'creatures_by_type': _group_by(creatures, 'creature_type'),
+        'creatures_by_rarity': _group_by(creatures, 'rarity'),
+        'creatures_by_habitat': _group_by(creatures, 'habitat'),
+        'skills_by_id': _index_by(configs.get('skills', {}).get('skills', []), 'skill_id'),
+        'events_by_id': _index_by(configs.get('events', {}).get('events', []), 'event_id'),
+    })
+
+
+@dataclass(frozen=True)
+class ConfigSnapshot:
+    """某一版本的完整配置及其索引"""
+    version: int
+    configs: Mapping[str, Dict[str, Any]]
+    indexes: Mapping[str, Mapping]
+    file_states: Mapping[str, Tuple[Optional[float], Optional[str]]]  # 配置名 -> (mtime, sha256)
+    loaded_at: str = field(default_factory=lambda: datetime.now().isoformat())
+
 
 class ConfigManager:
     def __init__(self, config_dir: str = None):
@@ -13,119 +94,266 @@ class ConfigManager:
             # 获取当前文件所在目录的父目录，然后添加control_data路径
             current_dir = os.path.dirname(os.path.abspath(__file__))
             config_dir = os.path.join(os.path.dirname(current_dir), 'control_data')
-        
+
         self.config_dir = config_dir
-        self._configs = {}
+        self._snapshot = ConfigSnapshot(0, MappingProxyType({}), _EMPTY_INDEX, MappingProxyType({}))
+        self._reload_lock = threading.Lock()
+        self._listeners: List[Callable[[List[str], ConfigSnapshot], None]] = []
+        self._watcher_thread = None
+        self._watcher_stop = threading.Event()
+        self._reload_stats = {
+            'reload_count': 0,
+            'last_reload_at': None,
+            'last_reload_duration': 0.0,
+            'last_changed': [],
+            'errors': 0
+        }
         self._load_all_configs()
-    
+
+    def _read_config_file(self, config_name: str):
+        """读取单个配置文件，返回 (数据, mtime, sha256)；读取失败时数据为{}，解析失败时 sha256 为 None"""
+        filename = CONFIG_FILES[config_name]
+        filepath = os.path.join(self.config_dir, filename)
+        mtime = None
+        try:
+            mtime = os.path.getmtime(filepath)
+            with open(filepath, 'rb') as f:
+                raw = f.read()
+            digest = hashlib.sha256(raw).hexdigest()
+            data = json.loads(raw.decode('utf-8'))
+            print(f"✅ 加载配置文件: {filename}")
+            return data, mtime, digest
+        except FileNotFoundError:
+            print(f"❌ 配置文件不存在: {filepath}")
+            return {}, None, None
+        except (json.JSONDecodeError, UnicodeDecodeError) as e:
+            print(f"❌ JSON格式错误 {filename}: {e}")
+            # 记下mtime，文件修改后监视线程才会再次加载
+            return {}, mtime, None
+
     def _load_all_configs(self):
         """加载所有配置文件"""
-        config_files = {
-            'shops': 'shop_control.json',
-            'items': 'item_control.json',
-            'locations': 'location_control.json',
-            'creatures': 'creature_control.json',
-            'skills': 'skill_control.json',
-            'events': 'event_control.json'
-        }
-        
-        for config_name, filename in config_files.items():
-            filepath = os.path.join(self.config_dir, filename)
+        configs = {}
+        file_states = {}
+        for config_name in CONFIG_FILES:
+            configs[config_name], mtime, digest = self._read_config_file(config_name)
+            file_states[config_name] = (mtime, digest)
+
+        self._snapshot = ConfigSnapshot(
+            version=self._snapshot.version + 1,
+            configs=MappingProxyType(configs),
+            indexes=_build_indexes(configs),
+            file_states=MappingProxyType(file_states)
+        )
+
+    def reload_changed(self) -> List[str]:
+        """只重新解析mtime和内容哈希都发生变化的配置文件，返回变化的配置名列表
+
+        新快照构建完成后一次性替换；解析失败的文件保留旧配置，并记录为 (mtime, None)，
+        直到文件再次被修改才重试，不会每次轮询都重新读取和报错
+        """
+        with self._reload_lock:
+            start = time.monotonic()
+            old = self._snapshot
+            configs = dict(old.configs)
+            file_states = dict(old.file_states)
+            changed = []
+
+            for config_name, filename in CONFIG_FILES.items():
+                filepath = os.path.join(self.config_dir, filename)
+                try:
+                    mtime = os.path.getmtime(filepath)
+                except OSError:
+                    continue
+                old_mtime, old_digest = file_states.get(config_name, (None, None))
+                if mtime == old_mtime:
+                    continue
+
+                try:
+                    with open(filepath, 'rb') as f:
+                        raw = f.read()
+                    digest = hashlib.sha256(raw).hexdigest()
+                    if digest == old_digest:
+                        # 只是被touch过，内容未变
+                        file_states[config_name] = (mtime, digest)
+                        continue
+                    configs[config_name] = json.loads(raw.decode('utf-8'))
+                except (OSError, json.JSONDecodeError, UnicodeDecodeError) as e:
+                    # 文件可能正在被编辑器写入，写完后mtime会再次变化
+                    self._reload_stats['errors'] += 1
+                    file_states[config_name] = (mtime, None)
+                    print(f"⚠️ 配置文件 {filename} 重新加载失败，继续使用旧版本: {e}")
+                    continue
+
+                file_states[config_name] = (mtime, digest)
+                changed.append(config_name)
+
+            if not changed:
+                if file_states != dict(old.file_states):
+                    self._snapshot = ConfigSnapshot(old.version, old.configs, old.indexes,
+                                                    MappingProxyType(file_states), old.loaded_at)
+                return []
+
+            snapshot = ConfigSnapshot(
+                version=old.version + 1,
+                configs=MappingProxyType(configs),
+                indexes=_build_indexes(configs),
+                file_states=MappingProxyType(file_states)
+            )
+            self._snapshot = snapshot  # 原子替换
+
+            self._reload_stats.update({
+                'reload_count': self._reload_stats['reload_count'] + 1,
+                'last_reload_at': snapshot.loaded_at,
+                'last_reload_duration': time.monotonic() - start,
+                'last_changed': changed
+            })
+            print(f"🔄 配置已热重载 (版本 {snapshot.version}): {', '.join(changed)}")
+
+        for listener in list(self._listeners):
             try:
-                with open(filepath, 'r', encoding='utf-8') as f:
-                    self._configs[config_name] = json.load(f)
-                print(f"✅ 加载配置文件: {filename}")
-            except FileNotFoundError:
-                print(f"❌ 配置文件不存在: {filepath}")
-                self._configs[config_name] = {}
-            except json.JSONDecodeError as e:
-                print(f"❌ JSON格式错误 {filename}: {e}")
-                self._configs[config_name] = {}
-    
+                listener(changed, snapshot)
+            except Exception as e:
+                print(f"❌ 配置重载回调失败: {e}")
+
+        return changed
+
+    def add_reload_listener(self, listener: Callable[[List[str], ConfigSnapshot], None]):
+        """注册配置热重载后的回调，参数为 (变化的配置名列表, 新快照)"""
+        self._listeners.append(listener)
+
+    def start_watcher(self, interval: float = 2.0):
+        """启动后台线程，按间隔轮询配置文件变化"""
+        if not interval or (self._watcher_thread and self._watcher_thread.is_alive()):
+            return
+
+        self._watcher_stop.clear()
+
+        def run():
+            while not self._watcher_stop.wait(interval):
+                try:
+                    self.reload_changed()
+                except Exception as e:
+                    print(f"❌ 配置监视线程出错: {e}")
+
+        self._watcher_thread = threading.Thread(target=run, name='config-watcher', daemon=True)
+        self._watcher_thread.start()
+
+    def stop_watcher(self):
+        """停止配置监视线程"""
+        self._watcher_stop.set()
+        if self._watcher_thread:
+            self._watcher_thread.join(timeout=5)
+            self._watcher_thread = None
+
+    @property
+    def version(self) -> int:
+        """当前配置版本号，每次内容发生变化的重载加1"""
+        return self._snapshot.version
+
+    def get_snapshot(self) -> ConfigSnapshot:
+        """获取当前配置快照（同一请求内多次读取时可保证一致性）"""
+        return self._snapshot
+
+    def get_raw_config(self, config_name: str) -> Dict[str, Any]:
+        """获取某个配置文件解析后的原始内容"""
+        return self._snapshot.configs.get(config_name, {})
+
+    def get_reload_stats(self) -> Dict[str, Any]:
+        """获取热重载指标"""
+        snapshot = self._snapshot
+        stats = dict(self._reload_stats)
+        stats.update({
+            'version': snapshot.version,
+            'loaded_at': snapshot.loaded_at,
+            'file_hashes': {name: state[1] for name, state in snapshot.file_states.items()},
+            'watching': bool(self._watcher_thread and self._watcher_thread.is_alive())
+        })
+        return stats
+
+    def _index(self, name: str) -> Mapping:
+        """获取指定的只读索引"""
+        return self._snapshot.indexes.get(name, _EMPTY_INDEX)
+
     def get_shops(self) -> List[Dict[str, Any]]:
         """获取所有商店配置"""
-        return self._configs.get('shops', {}).get('shops', [])
+        return self._snapshot.configs.get('shops', {}).get('shops', [])
     
     def get_shop_by_name(self, shop_name: str) -> Optional[Dict[str, Any]]:
         """根据商店名称获取商店配置"""
-        for shop in self.get_shops():
-            if shop.get('shop_name') == shop_name:
-                return shop
-        return None
+        return self._index('shops_by_name').get(shop_name)
     
     def get_items(self) -> List[Dict[str, Any]]:
         """获取所有物品配置"""
-        return self._configs.get('items', {}).get('items', [])
+        return self._snapshot.configs.get('items', {}).get('items', [])
     
     def get_item_by_id(self, item_id: str) -> Optional[Dict[str, Any]]:
         """根据物品ID获取物品配置"""
-        for item in self.get_items():
-            if item.get('item_id') == item_id:
-                return item
-        return None
+        return self._index('items_by_id').get(item_id)
+    
+    def get_items_by_type(self, item_type: str) -> Tuple[Dict[str, Any], ...]:
+        """获取指定类型的所有物品"""
+        return self._index('items_by_type').get(item_type, ())
+    
+    def get_items_by_rarity(self, rarity: str) -> Tuple[Dict[str, Any], ...]:
+        """获取指定稀有度的所有物品"""
+        return self._index('items_by_rarity').get(rarity, ())
     
     def get_areas(self) -> List[Dict[str, Any]]:
         """获取所有区域配置"""
-        return self._configs.get('locations', {}).get('areas', [])
+        return self._snapshot.configs.get('locations', {}).get('areas', [])
     
     def get_area_by_id(self, area_id: str) -> Optional[Dict[str, Any]]:
         """根据区域ID获取区域配置"""
-        for area in self.get_areas():
-            if area.get('area_id') == area_id:
-                return area
-        return None
+        return self._index('areas_by_id').get(area_id)
     
     def get_locations(self) -> List[Dict[str, Any]]:
         """获取所有地点配置"""
-        return self._configs.get('locations', {}).get('locations', [])
+        return self._snapshot.configs.get('locations', {}).get('locations', [])
     
     def get_location_by_id(self, location_id: str) -> Optional[Dict[str, Any]]:
         """根据地点ID获取地点配置"""
-        for location in self.get_locations():
-            if location.get('location_id') == location_id:
-                return location
-        return None
+        return self._index('locations_by_id').get(location_id)
     
     def get_locations_by_area(self, area_id: str) -> List[Dict[str, Any]]:
         """获取指定区域的所有地点"""
-        locations = []
-        for location in self.get_locations():
-            if location.get('area_id') == area_id:
-                locations.append(location)
-        return locations
+        return list(self._index('locations_by_area').get(area_id, ()))
     
     def get_creatures(self) -> List[Dict[str, Any]]:
         """获取所有生物配置"""
-        return self._configs.get('creatures', {}).get('creatures', [])
+        return self._snapshot.configs.get('creatures', {}).get('creatures', [])
     
     def get_creature_by_id(self, creature_id: str) -> Optional[Dict[str, Any]]:
         """根据生物ID获取生物配置"""
-        for creature in self.get_creatures():
-            if creature.get('creature_id') == creature_id:
-                return creature
-        return None
+        return self._index('creatures_by_id').get(creature_id)
+    
+    def get_creatures_by_type(self, creature_type: str) -> Tuple[Dict[str, Any], ...]:
+        """获取指定种类的所有生物"""
+        return self._index('creatures_by_type').get(creature_type, ())
+    
+    def get_creatures_by_rarity(self, rarity: str) -> Tuple[Dict[str, Any], ...]:
+        """获取指定稀有度的所有生物"""
+        return self._index('creatures_by_rarity').get(rarity, ())
+    
+    def get_creatures_by_habitat(self, location_id: str) -> Tuple[Dict[str, Any], ...]:
+        """获取栖息在指定地点的所有生物"""
+        return self._index('creatures_by_habitat').get(location_id, ())
     
     def get_skills(self) -> List[Dict[str, Any]]:
         """获取所有技能配置"""
-        return self._configs.get('skills', {}).get('skills', [])
+        return self._snapshot.configs.get('skills', {}).get('skills', [])
     
     def get_skill_by_id(self, skill_id: str) -> Optional[Dict[str, Any]]:
         """根据技能ID获取技能配置"""
-        for skill in self.get_skills():
-            if skill.get('skill_id') == skill_id:
-                return skill
-        return None
+        return self._index('skills_by_id').get(skill_id)
     
     def get_events(self) -> List[Dict[str, Any]]:
         """获取所有事件配置"""
-        return self._configs.get('events', {}).get('events', [])
+        return self._snapshot.configs.get('events', {}).get('events', [])
     
     def get_event_by_id(self, event_id: str) -> Optional[Dict[str, Any]]:
         """根据事件ID获取事件配置"""
-        for event in self.get_events():
-            if event.get('event_id') == event_id:
-                return event
-        return None
+        return self._index('events_by_id').get(event_id)
     
     def get_events_by_location(self, location_id: str) -> List[Dict[str, Any]]:
         """获取指定地点的所有事件"""
@@ -143,8 +371,8 @@ class ConfigManager:
     
     def reload_configs(self):
         """重新加载所有配置文件"""
-        self._configs.clear()
-        self._load_all_configs()
+        with self._reload_lock:
+            self._load_all_configs()
     
     def get_config_summary(self) -> Dict[str, int]:
         """获取配置摘要信息"""
@@ -3,12 +3,12 @@ import os
 import json
 from typing import List, Dict, Any, Optional
 from config import BACKEND_DIR
+from database_separation import db_separation_manager
 from models.skill import skill_manager
 
 def get_db():
-    """获取数据库连接"""
-    db_path = os.path.join(BACKEND_DIR, 'game_data.db')
-    return sqlite3.connect(db_path)
+    """获取数据库连接（从game_data.db连接池借出，需配合with使用）"""
+    return db_separation_manager.game_pool.connection()
 
 class Creature:
     def __init__(self, creature_id=None, name=None, description=None, 
@@ -79,117 +79,117 @@ class CreatureManager:
     
     def init_database(self):
         """初始化生物数据库"""
-        conn = get_db()
-        cursor = conn.cursor()
+        with get_db() as conn:
+            cursor = conn.cursor()
         
-        # 创建生物表
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS creatures (
-                creature_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL UNIQUE,
-                description TEXT,
-                quality TEXT DEFAULT '普通',
-                base_attack INTEGER DEFAULT 10,
-                base_hp INTEGER DEFAULT 30,
-                skills TEXT,  -- JSON格式存储技能ID数组
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
+            # 创建生物表
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS creatures (
+                    creature_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT NOT NULL UNIQUE,
+                    description TEXT,
+                    quality TEXT DEFAULT '普通',
+                    base_attack INTEGER DEFAULT 10,
+                    base_hp INTEGER DEFAULT 30,
+                    skills TEXT,  -- JSON格式存储技能ID数组
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
         
-        conn.commit()
-        print("生物数据库初始化完成")
+            conn.commit()
+            print("生物数据库初始化完成")
     
     def add_creature(self, creature: Creature) -> int:
         """添加新生物"""
-        conn = get_db()
-        cursor = conn.cursor()
+        with get_db() as conn:
+            cursor = conn.cursor()
         
-        skills_json = json.dumps(creature.skills)
+            skills_json = json.dumps(creature.skills)
         
-        cursor.execute('''
-            INSERT INTO creatures (name, description, quality, base_attack, base_hp, skills)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (
-            creature.name, creature.description, creature.quality,
-            creature.base_attack, creature.base_hp, skills_json
-        ))
+            cursor.execute('''
+                INSERT INTO creatures (name, description, quality, base_attack, base_hp, skills)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (
+                creature.name, creature.description, creature.quality,
+                creature.base_attack, creature.base_hp, skills_json
+            ))
         
-        creature_id = cursor.lastrowid
-        conn.commit()
-        print(f"添加生物: {creature.name} (ID: {creature_id})")
-        return creature_id
+            creature_id = cursor.lastrowid
+            conn.commit()
+            print(f"添加生物: {creature.name} (ID: {creature_id})")
+            return creature_id
     
     def get_creature(self, creature_id: int) -> Optional[Creature]:
         """获取指定生物"""
-        conn = get_db()
-        cursor = conn.cursor()
+        with get_db() as conn:
+            cursor = conn.cursor()
         
-        cursor.execute('SELECT * FROM creatures WHERE creature_id = ?', (creature_id,))
-        row = cursor.fetchone()
+            cursor.execute('SELECT * FROM creatures WHERE creature_id = ?', (creature_id,))
+            row = cursor.fetchone()
         
-        if row:
-            skills = json.loads(row[6]) if row[6] else []
-            return Creature(
-                creature_id=row[0], name=row[1], description=row[2],
-                quality=row[3], base_attack=row[4], base_hp=row[5],
-                skills=skills
-            )
-        return None
+            if row:
+                skills = json.loads(row[6]) if row[6] else []
+                return Creature(
+                    creature_id=row[0], name=row[1], description=row[2],
+                    quality=row[3], base_attack=row[4], base_hp=row[5],
+                    skills=skills
+                )
+            return None
     
     def get_creature_by_name(self, name: str) -> Optional[Creature]:
         """根据名字获取生物"""
-        conn = get_db()
-        cursor = conn.cursor()
+        with get_db() as conn:
+            cursor = conn.cursor()
         
-        cursor.execute('SELECT * FROM creatures WHERE name = ?', (name,))
-        row = cursor.fetchone()
+            cursor.execute('SELECT * FROM creatures WHERE name = ?', (name,))
+            row = cursor.fetchone()
         
-        if row:
-            skills = json.loads(row[6]) if row[6] else []
-            return Creature(
-                creature_id=row[0], name=row[1], description=row[2],
-                quality=row[3], base_attack=row[4], base_hp=row[5],
-                skills=skills
-            )
-        return None
+            if row:
+                skills = json.loads(row[6]) if row[6] else []
+                return Creature(
+                    creature_id=row[0], name=row[1], description=row[2],
+                    quality=row[3], base_attack=row[4], base_hp=row[5],
+                    skills=skills
+                )
+            return None
     
     def get_creatures_by_quality(self, quality: str) -> List[Creature]:
         """根据品质获取生物列表"""
-        conn = get_db()
-        cursor = conn.cursor()
+        with get_db() as conn:
+            cursor = conn.cursor()
         
-        cursor.execute('SELECT * FROM creatures WHERE quality = ? ORDER BY creature_id', (quality,))
-        rows = cursor.fetchall()
+            cursor.execute('SELECT * FROM creatures WHERE quality = ? ORDER BY creature_id', (quality,))
+            rows = cursor.fetchall()
         
-        creatures = []
-        for row in rows:
-            skills = json.loads(row[6]) if row[6] else []
-            creatures.append(Creature(
-                creature_id=row[0], name=row[1], description=row[2],
-                quality=row[3], base_attack=row[4], base_hp=row[5],
-                skills=skills
-            ))
+            creatures = []
+            for row in rows:
+                skills = json.loads(row[6]) if row[6] else []
+                creatures.append(Creature(
+                    creature_id=row[0], name=row[1], description=row[2],
+                    quality=row[3], base_attack=row[4], base_hp=row[5],
+                    skills=skills
+                ))
         
-        return creatures
+            return creatures
     
     def get_all_creatures(self) -> List[Creature]:
         """获取所有生物"""
-        conn = get_db()
-        cursor = conn.cursor()
+        with get_db() as conn:
+            cursor = conn.cursor()
         
-        cursor.execute('SELECT * FROM creatures ORDER BY quality, creature_id')
-        rows = cursor.fetchall()
+            cursor.execute('SELECT * FROM creatures ORDER BY quality, creature_id')
+            rows = cursor.fetchall()
         
-        creatures = []
-        for row in rows:
-            skills = json.loads(row[6]) if row[6] else []
-            creatures.append(Creature(
-                creature_id=row[0], name=row[1], description=row[2],
-                quality=row[3], base_attack=row[4], base_hp=row[5],
-                skills=skills
-            ))
+            creatures = []
+            for row in rows:
+                skills = json.loads(row[6]) if row[6] else []
+                creatures.append(Creature(
+                    creature_id=row[0], name=row[1], description=row[2],
+                    quality=row[3], base_attack=row[4], base_hp=row[5],
+                    skills=skills
+                ))
         
-        return creatures
+            return creatures
     
     def create_battle_instance(self, creature_id: int, level_modifier=1.0) -> Dict[str, Any]:
         """创建战斗实例（用于战斗系统）"""
@@ -234,50 +234,50 @@ class CreatureManager:
     
     def init_default_creatures(self):
         """初始化默认生物"""
-        conn = get_db()
-        cursor = conn.cursor()
+        with get_db() as conn:
+            cursor = conn.cursor()
         
-        # 检查是否已有生物
-        cursor.execute('SELECT COUNT(*) FROM creatures')
-        if cursor.fetchone()[0] > 0:
-            return
+            # 检查是否已有生物
+            cursor.execute('SELECT COUNT(*) FROM creatures')
+            if cursor.fetchone()[0] > 0:
+                return
         
-        # 获取普通攻击技能ID
-        normal_attack = skill_manager.get_skill_by_name("普通攻击")
-        normal_attack_id = normal_attack.skill_id if normal_attack else 1
+            # 获取普通攻击技能ID
+            normal_attack = skill_manager.get_skill_by_name("普通攻击")
+            normal_attack_id = normal_attack.skill_id if normal_attack else 1
         
-        # 添加默认生物
-        default_creatures = [
-            Creature(
-                name="普通哥布林",
-                description="最常见的绿皮怪物，虽然弱小但数量众多",
-                quality="普通",
-                base_attack=8,
-                base_hp=25,
-                skills=[normal_attack_id]
-            ),
-            Creature(
-                name="精英哥布林",
-                description="经过训练的哥布林战士，比普通同类更加强悍",
-                quality="稀有",
-                base_attack=12,
-                base_hp=40,
-                skills=[normal_attack_id]
-            ),
-            Creature(
-                name="哥布林首领",
-                description="哥布林部族的领导者，拥有强大的战斗技巧",
-                quality="勇者",
-                base_attack=18,
-                base_hp=60,
-                skills=[normal_attack_id]
-            )
-        ]
+            # 添加默认生物
+            default_creatures = [
+                Creature(
+                    name="普通哥布林",
+                    description="最常见的绿皮怪物，虽然弱小但数量众多",
+                    quality="普通",
+                    base_attack=8,
+                    base_hp=25,
+                    skills=[normal_attack_id]
+                ),
+                Creature(
+                    name="精英哥布林",
+                    description="经过训练的哥布林战士，比普通同类更加强悍",
+                    quality="稀有",
+                    base_attack=12,
+                    base_hp=40,
+                    skills=[normal_attack_id]
+                ),
+                Creature(
+                    name="哥布林首领",
+                    description="哥布林部族的领导者，拥有强大的战斗技巧",
+                    quality="勇者",
+                    base_attack=18,
+                    base_hp=60,
+                    skills=[normal_attack_id]
+                )
+            ]
         
-        for creature in default_creatures:
-            self.add_creature(creature)
+            for creature in default_creatures:
+                self.add_creature(creature)
         
-        print("默认生物初始化完成")
+            print("默认生物初始化完成")
 
 # 全局生物管理器实例
 creature_manager = CreatureManager()
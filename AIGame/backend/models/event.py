@@ -4,11 +4,11 @@ import json
 from datetime import datetime
 from typing import List, Dict, Any, Optional
 from config import BACKEND_DIR
+from database_separation import db_separation_manager
 
 def get_db():
-    """获取数据库连接"""
-    db_path = os.path.join(BACKEND_DIR, 'game_data.db')
-    return sqlite3.connect(db_path)
+    """获取数据库连接（从game_data.db连接池借出，需配合with使用）"""
+    return db_separation_manager.game_pool.connection()
 
 class Event:
     def __init__(self, event_id=None, name=None, event_type=None, condition=None, 
@@ -57,110 +57,116 @@ class EventManager:
     
     def init_database(self):
         """初始化事件数据库"""
-        conn = get_db()
-        cursor = conn.cursor()
-        
-        # 创建事件表
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS events (
-                event_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                event_type TEXT NOT NULL,
-                condition TEXT NOT NULL,
-                result TEXT NOT NULL,
-                is_active BOOLEAN DEFAULT TRUE,
-                priority INTEGER DEFAULT 1,
-                cooldown INTEGER DEFAULT 0,
-                max_triggers INTEGER,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # 创建事件触发记录表
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS event_triggers (
-                trigger_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                event_id INTEGER,
-                user_id INTEGER,
-                triggered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                trigger_count INTEGER DEFAULT 1,
-                FOREIGN KEY (event_id) REFERENCES events (event_id),
-                FOREIGN KEY (user_id) REFERENCES users (user_id)
-            )
-        ''')
-        
-        conn.commit()
-        print("事件数据库初始化完成")
+        with get_db() as conn:
+            cursor = conn.cursor()
+        
+            # 创建事件表
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS events (
+                    event_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT NOT NULL,
+                    event_type TEXT NOT NULL,
+                    condition TEXT NOT NULL,
+                    result TEXT NOT NULL,
+                    is_active BOOLEAN DEFAULT TRUE,
+                    priority INTEGER DEFAULT 1,
+                    cooldown INTEGER DEFAULT 0,
+                    max_triggers INTEGER,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+        
+            # 创建事件触发记录表
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS event_triggers (
+                    trigger_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    event_id INTEGER,
+                    user_id INTEGER,
+                    triggered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    trigger_count INTEGER DEFAULT 1,
+                    FOREIGN KEY (event_id) REFERENCES events (event_id),
+                    FOREIGN KEY (user_id) REFERENCES users (user_id)
+                )
+            ''')
+        
+            # 冷却/次数检查按 (event_id, user_id) 查询
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_event_triggers_event_user
+                ON event_triggers (event_id, user_id, triggered_at)
+            ''')
+        
+            conn.commit()
+            print("事件数据库初始化完成")
     
     def add_event(self, event: Event) -> int:
         """添加新事件"""
-        conn = get_db()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO events (name, event_type, condition, result, is_active, priority, cooldown, max_triggers)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            event.name, event.event_type, event.condition, event.result,
-            event.is_active, event.priority, event.cooldown, event.max_triggers
-        ))
-        
-        event_id = cursor.lastrowid
-        conn.commit()
-        print(f"添加事件: {event.name} (ID: {event_id})")
-        return event_id
+        with get_db() as conn:
+            cursor = conn.cursor()
+        
+            cursor.execute('''
+                INSERT INTO events (name, event_type, condition, result, is_active, priority, cooldown, max_triggers)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                event.name, event.event_type, event.condition, event.result,
+                event.is_active, event.priority, event.cooldown, event.max_triggers
+            ))
+        
+            event_id = cursor.lastrowid
+            conn.commit()
+            print(f"添加事件: {event.name} (ID: {event_id})")
+            return event_id
     
     def get_event(self, event_id: int) -> Optional[Event]:
         """获取指定事件"""
-        conn = get_db()
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT * FROM events WHERE event_id = ?', (event_id,))
-        row = cursor.fetchone()
-        
-        if row:
-            return Event(
-                event_id=row[0], name=row[1], event_type=row[2],
-                condition=row[3], result=row[4], is_active=row[5],
-                priority=row[6], cooldown=row[7], max_triggers=row[8]
-            )
-        return None
+        with get_db() as conn:
+            cursor = conn.cursor()
+        
+            cursor.execute('SELECT * FROM events WHERE event_id = ?', (event_id,))
+            row = cursor.fetchone()
+        
+            if row:
+                return Event(
+                    event_id=row[0], name=row[1], event_type=row[2],
+                    condition=row[3], result=row[4], is_active=row[5],
+                    priority=row[6], cooldown=row[7], max_triggers=row[8]
+                )
+            return None
     
     def get_events_by_type(self, event_type: str) -> List[Event]:
         """获取指定类型的所有事件"""
-        conn = get_db()
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT * FROM events WHERE event_type = ? AND is_active = TRUE ORDER BY priority DESC', (event_type,))
-        rows = cursor.fetchall()
-        
-        events = []
-        for row in rows:
-            events.append(Event(
-                event_id=row[0], name=row[1], event_type=row[2],
-                condition=row[3], result=row[4], is_active=row[5],
-                priority=row[6], cooldown=row[7], max_triggers=row[8]
-            ))
+        with get_db() as conn:
+            cursor = conn.cursor()
+        
+            cursor.execute('SELECT * FROM events WHERE event_type = ? AND is_active = TRUE ORDER BY priority DESC', (event_type,))
+            rows = cursor.fetchall()
         
-        return events
+            events = []
+            for row in rows:
+                events.append(Event(
+                    event_id=row[0], name=row[1], event_type=row[2],
+                    condition=row[3], result=row[4], is_active=row[5],
+                    priority=row[6], cooldown=row[7], max_triggers=row[8]
+                ))
+        
+            return events
     
     def get_all_active_events(self) -> List[Event]:
         """获取所有激活的事件"""
-        conn = get_db()
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT * FROM events WHERE is_active = TRUE ORDER BY priority DESC, event_type')
-        rows = cursor.fetchall()
-        
-        events = []
-        for row in rows:
-            events.append(Event(
-                event_id=row[0], name=row[1], event_type=row[2],
-                condition=row[3], result=row[4], is_active=row[5],
-                priority=row[6], cooldown=row[7], max_triggers=row[8]
-            ))
+        with get_db() as conn:
+            cursor = conn.cursor()
+        
+            cursor.execute('SELECT * FROM events WHERE is_active = TRUE ORDER BY priority DESC, event_type')
+            rows = cursor.fetchall()
+        
+            events = []
+            for row in rows:
+                events.append(Event(
+                    event_id=row[0], name=row[1], event_type=row[2],
+                    condition=row[3], result=row[4], is_active=row[5],
+                    priority=row[6], cooldown=row[7], max_triggers=row[8]
+                ))
         
-        return events
+            return events
     
     def check_event_conditions(self, user_context: Dict[str, Any]) -> List[Event]:
         """检查哪些事件满足触发条件"""
@@ -205,26 +211,26 @@ class EventManager:
     
     def _check_cooldown(self, event_id: int, user_id: int) -> bool:
         """检查事件冷却时间"""
-        conn = get_db()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT triggered_at FROM event_triggers 
-            WHERE event_id = ? AND user_id = ? 
-            ORDER BY triggered_at DESC LIMIT 1
-        ''', (event_id, user_id))
-        
-        row = cursor.fetchone()
-        if not row:
-            return True  # 从未触发过
-        
-        # 获取事件的冷却时间
-        event = self.get_event(event_id)
-        if not event or event.cooldown == 0:
-            return True
-        
-        # 计算时间差（这里简化处理，实际应该解析时间戳）
-        return True  # 简化实现，总是允许触发
+        with get_db() as conn:
+            cursor = conn.cursor()
+        
+            cursor.execute('''
+                SELECT triggered_at FROM event_triggers 
+                WHERE event_id = ? AND user_id = ? 
+                ORDER BY triggered_at DESC LIMIT 1
+            ''', (event_id, user_id))
+        
+            row = cursor.fetchone()
+            if not row:
+                return True  # 从未触发过
+        
+            # 获取事件的冷却时间
+            event = self.get_event(event_id)
+            if not event or event.cooldown == 0:
+                return True
+        
+            # 计算时间差（这里简化处理，实际应该解析时间戳）
+            return True  # 简化实现，总是允许触发
     
     def _check_max_triggers(self, event_id: int, user_id: int) -> bool:
         """检查最大触发次数"""
@@ -232,16 +238,16 @@ class EventManager:
         if not event or event.max_triggers is None:
             return True  # 无限制
         
-        conn = get_db()
-        cursor = conn.cursor()
+        with get_db() as conn:
+            cursor = conn.cursor()
         
-        cursor.execute('''
-            SELECT COUNT(*) FROM event_triggers 
-            WHERE event_id = ? AND user_id = ?
-        ''', (event_id, user_id))
+            cursor.execute('''
+                SELECT COUNT(*) FROM event_triggers 
+                WHERE event_id = ? AND user_id = ?
+            ''', (event_id, user_id))
         
-        trigger_count = cursor.fetchone()[0]
-        return trigger_count < event.max_triggers
+            trigger_count = cursor.fetchone()[0]
+            return trigger_count < event.max_triggers
     
     def trigger_event(self, event_id: int, user_id: int) -> Dict[str, Any]:
         """触发事件"""
@@ -250,23 +256,23 @@ class EventManager:
             return {'success': False, 'message': '事件不存在'}
         
         # 记录触发
-        conn = get_db()
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO event_triggers (event_id, user_id)
-            VALUES (?, ?)
-        ''', (event_id, user_id))
-        conn.commit()
-        
-        # 解析事件结果
-        result_data = self._parse_event_result(event)
-        
-        print(f"触发事件: {event.name}")
-        return {
-            'success': True,
-            'event': event.to_dict(),
-            'result': result_data
-        }
+        with get_db() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO event_triggers (event_id, user_id)
+                VALUES (?, ?)
+            ''', (event_id, user_id))
+            conn.commit()
+        
+            # 解析事件结果
+            result_data = self._parse_event_result(event)
+        
+            print(f"触发事件: {event.name}")
+            return {
+                'success': True,
+                'event': event.to_dict(),
+                'result': result_data
+            }
     
     def _parse_event_result(self, event: Event) -> Dict[str, Any]:
         """解析事件结果"""
@@ -317,74 +323,74 @@ class EventManager:
     
     def init_default_events(self):
         """初始化默认事件"""
-        conn = get_db()
-        cursor = conn.cursor()
-        
-        # 检查是否已有事件
-        cursor.execute('SELECT COUNT(*) FROM events')
-        if cursor.fetchone()[0] > 0:
-            return
-        
-        # 添加默认战斗事件
-        default_events = [
-            Event(
-                name="【战斗】lv1哥布林",
-                event_type="battle",
-                condition="进入村外森林",
-                result="与1个lv1级哥布林战斗",
-                priority=5,
-                cooldown=300,  # 5分钟冷却
-                max_triggers=None  # 无限制
-            ),
-            Event(
-                name="【战斗】野狼",
-                event_type="battle", 
-                condition="进入深林",
-                result="与1只野狼战斗",
-                priority=3,
-                cooldown=600,
-                max_triggers=None
-            ),
-            Event(
-                name="【宝藏】森林宝箱",
-                event_type="treasure",
-                condition="进入村外森林",
-                result="发现了一个神秘的宝箱",
-                priority=2,
-                cooldown=1800,  # 30分钟
-                max_triggers=5  # 最多触发5次
-            )
-        ]
-        
-        for event in default_events:
-            self.add_event(event)
-        
-        print("默认事件初始化完成")
+        with get_db() as conn:
+            cursor = conn.cursor()
+        
+            # 检查是否已有事件
+            cursor.execute('SELECT COUNT(*) FROM events')
+            if cursor.fetchone()[0] > 0:
+                return
+        
+            # 添加默认战斗事件
+            default_events = [
+                Event(
+                    name="【战斗】lv1哥布林",
+                    event_type="battle",
+                    condition="进入村外森林",
+                    result="与1个lv1级哥布林战斗",
+                    priority=5,
+                    cooldown=300,  # 5分钟冷却
+                    max_triggers=None  # 无限制
+                ),
+                Event(
+                    name="【战斗】野狼",
+                    event_type="battle", 
+                    condition="进入深林",
+                    result="与1只野狼战斗",
+                    priority=3,
+                    cooldown=600,
+                    max_triggers=None
+                ),
+                Event(
+                    name="【宝藏】森林宝箱",
+                    event_type="treasure",
+                    condition="进入村外森林",
+                    result="发现了一个神秘的宝箱",
+                    priority=2,
+                    cooldown=1800,  # 30分钟
+                    max_triggers=5  # 最多触发5次
+                )
+            ]
+        
+            for event in default_events:
+                self.add_event(event)
+        
+            print("默认事件初始化完成")
     
     def get_event_history(self, user_id: int, limit: int = 10) -> List[Dict]:
         """获取用户事件触发历史"""
-        conn = get_db()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT e.name, e.event_type, et.triggered_at
-            FROM event_triggers et
-            JOIN events e ON et.event_id = e.event_id
-            WHERE et.user_id = ?
-            ORDER BY et.triggered_at DESC
-            LIMIT ?
-        ''', (user_id, limit))
-        
-        rows = cursor.fetchall()
-        history = []
-        for row in rows:
-            history.append({
-                'name': row[0],
-                'type': row[1], 
-                'triggered_at': row[2]
-            })
-        
-        return history
+        with get_db() as conn:
+            cursor = conn.cursor()
+        
+            cursor.execute('''
+                SELECT e.name, e.event_type, et.triggered_at
+                FROM event_triggers et
+                JOIN events e ON et.event_id = e.event_id
+                WHERE et.user_id = ?
+                ORDER BY et.triggered_at DESC
+                LIMIT ?
+            ''', (user_id, limit))
+        
+            rows = cursor.fetchall()
+            history = []
+            for row in rows:
+                history.append({
+                    'name': row[0],
+                    'type': row[1], 
+                    'triggered_at': row[2]
+                })
+        
+            return history
 
 # 全局事件管理器实例
 event_manager = EventManager()
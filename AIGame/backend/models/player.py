@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+"""
+玩家聚合对象
+
+一次查询取回 user_data、背包和装备（见 PLAYER_AGGREGATE_SQL），
+再用已建索引的物品配置补全名称/类型/属性，得到类型化的 Player；
+接口返回的字典结构由 Player.to_dict() 生成，与原来的 get_user_data 保持一致。
+背包/装备的修改先作用在 Player 上，由 UserManager 的工作单元比较 state() 后统一写回。
+"""
+import json
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Any
+
+# 装备可加成的属性
+EQUIPMENT_STAT_KEYS = ('attack', 'defense', 'hp', 'mp', 'critical_rate', 'critical_damage')
+
+# Player 上与 user_data 表同名的列（写回时只更新其中发生变化的列）
+PLAYER_COLUMNS = (
+    'hp', 'mp', 'max_hp', 'max_mp', 'gold', 'experience', 'level',
+    'attack', 'defense', 'critical_rate', 'critical_damage', 'equipment_stats'
+)
+
+
+def compute_equipment_stats(item_configs) -> Dict[str, int]:
+    """汇总一组已装备物品配置的属性加成"""
+    totals = dict.fromkeys(EQUIPMENT_STAT_KEYS, 0)
+    for item_config in item_configs:
+        if item_config and 'stats' in item_config:
+            for stat, value in item_config['stats'].items():
+                if stat in totals:
+                    totals[stat] += value
+    return totals
+
+# user_data 一行 + 背包/装备聚合为JSON数组，一次往返取回整个玩家
+PLAYER_AGGREGATE_SQL = """
+    SELECT d.*,
+        (SELECT json_group_array(json_array(i.item_id, i.quantity))
+         FROM (SELECT item_id, quantity FROM user_inventory
+               WHERE username = d.username ORDER BY id) AS i) AS inventory_json,
+        (SELECT json_group_array(json_array(e.slot, e.item_id, e.equipped_at))
+         FROM (SELECT slot, item_id, equipped_at FROM user_equipment
+               WHERE username = d.username ORDER BY id) AS e) AS equipment_json
+    FROM user_data d
+    WHERE d.username = ?
+"""
+
+
+@dataclass
+class InventoryEntry:
+    """背包中的一种物品"""
+    item_id: str
+    quantity: int
+    name: str
+    description: str
+    item_type: str
+    rarity: str
+
+    def to_dict(self):
+        return {
+            "id": self.item_id,
+            "name": self.name,
+            "description": self.description,
+            "type": self.item_type,
+            "rarity": self.rarity,
+            "quantity": self.quantity
+        }
+
+
+@dataclass
+class EquipmentEntry:
+    """某个槽位上的装备"""
+    item_id: str
+    name: str
+    description: str
+    item_type: str
+    rarity: str
+    equipped_at: Optional[str]
+    stats: Dict[str, Any] = field(default_factory=dict)
+
+    def to_dict(self):
+        return {
+            'id': self.item_id,
+            'name': self.name,
+            'description': self.description,
+            'type': self.item_type,
+            'rarity': self.rarity,
+            'equipped_at': self.equipped_at
+        }
+
+
+def _inventory_entry(item_id, quantity, item_config):
+    """用物品配置补全背包条目"""
+    if not item_config:
+        # 如果配置中找不到物品，使用默认值
+        return InventoryEntry(item_id, quantity, item_id, '未知物品', 'unknown', 'common')
+    return InventoryEntry(
+        item_id=item_id,
+        quantity=quantity,
+        name=item_config.get('item_name', item_id),
+        description=item_config.get('description', ''),
+        item_type=item_config.get('item_type', ''),
+        rarity=item_config.get('rarity', 'common')
+    )
+
+
+def _equipment_entry(item_id, equipped_at, item_config):
+    """用物品配置补全装备条目"""
+    if not item_config:
+        return EquipmentEntry(item_id, item_id, '未知装备', 'unknown', 'common', equipped_at)
+    return EquipmentEntry(
+        item_id=item_id,
+        name=item_config.get('item_name', item_id),
+        description=item_config.get('description', ''),
+        item_type=item_config.get('item_type', ''),
+        rarity=item_config.get('rarity', 'common'),
+        equipped_at=equipped_at,
+        stats=item_config.get('stats', {})
+    )
+
+
+@dataclass
+class Player:
+    """玩家聚合：基础属性 + 背包 + 装备"""
+    username: str
+    hp: int
+    mp: int
+    max_hp: int
+    max_mp: int
+    gold: int
+    experience: int
+    level: int
+    attack: int
+    defense: int
+    critical_rate: int
+    critical_damage: int
+    created_at: str
+    last_updated: str
+    inventory: List[InventoryEntry] = field(default_factory=list)
+    equipment: Dict[str, Optional[EquipmentEntry]] = field(default_factory=dict)
+    # 装备属性加成总和，装备变化/物品配置变化时重新计算并随 user_data 保存
+    equipment_stats: Dict[str, int] = field(default_factory=lambda: dict.fromkeys(EQUIPMENT_STAT_KEYS, 0))
+
+    @classmethod
+    def from_row(cls, row, item_lookup):
+        """由 PLAYER_AGGREGATE_SQL 的结果行构建，item_lookup(item_id) 返回物品配置或None"""
+        player = cls(
+            username=row['username'],
+            hp=row['hp'],
+            mp=row['mp'],
+            max_hp=row['max_hp'] if row['max_hp'] is not None else 100,
+            max_mp=row['max_mp'] if row['max_mp'] is not None else 50,
+            gold=row['gold'],
+            experience=row['experience'] if row['experience'] is not None else 0,
+            level=row['level'] if row['level'] is not None else 1,
+            attack=row['attack'] if row['attack'] is not None else 10,
+            defense=row['defense'] if row['defense'] is not None else 5,
+            critical_rate=row['critical_rate'] if row['critical_rate'] is not None else 5,
+            critical_damage=row['critical_damage'] if row['critical_damage'] is not None else 150,
+            created_at=row['created_at'],
+            last_updated=row['last_updated']
+        )
+
+        for item_id, quantity in json.loads(row['inventory_json'] or '[]'):
+            player.inventory.append(_inventory_entry(item_id, quantity, item_lookup(item_id)))
+
+        for slot, item_id, equipped_at in json.loads(row['equipment_json'] or '[]'):
+            player.equipment[slot] = (
+                _equipment_entry(item_id, equipped_at, item_lookup(item_id)) if item_id else None
+            )
+
+        stored_stats = row.get('equipment_stats')
+        if stored_stats:
+            player.equipment_stats.update(json.loads(stored_stats))
+        else:
+            # 尚未物化（旧数据），现场计算
+            player.refresh_equipment_stats()
+
+        return player
+
+    def state(self):
+        """可持久化的状态：(列值, {物品ID: 数量}, {槽位: (物品ID, 装备时间)})，用于比较脏数据"""
+        columns = {column: getattr(self, column) for column in PLAYER_COLUMNS}
+        columns['equipment_stats'] = json.dumps(self.equipment_stats, sort_keys=True)
+        inventory = {entry.item_id: entry.quantity for entry in self.inventory}
+        equipment = {
+            slot: (entry.item_id, entry.equipped_at) if entry else (None, None)
+            for slot, entry in self.equipment.items()
+        }
+        return columns, inventory, equipment
+
+    def apply_user_data(self, data):
+        """把 to_dict() 形状的用户数据（可能已被修改）写回基础属性"""
+        self.hp = data['HP']
+        self.mp = data['MP']
+        self.max_hp = data.get('base_max_HP', data.get('max_HP', 100))
+        self.max_mp = data.get('base_max_MP', data.get('max_MP', 50))
+        self.gold = data['gold']
+        self.experience = data.get('experience', 0)
+        self.level = data.get('level', 1)
+        self.attack = data.get('base_attack', data.get('attack', 10))
+        self.defense = data.get('base_defense', data.get('defense', 5))
+        self.critical_rate = data.get('base_critical_rate', data.get('critical_rate', 5))
+        self.critical_damage = data.get('base_critical_damage', data.get('critical_damage', 150))
+
+    def quantity_of(self, item_id) -> int:
+        """背包中某物品的数量"""
+        for entry in self.inventory:
+            if entry.item_id == item_id:
+                return entry.quantity
+        return 0
+
+    def add_item(self, item_id, quantity, item_config):
+        """向背包添加物品"""
+        for entry in self.inventory:
+            if entry.item_id == item_id:
+                entry.quantity += quantity
+                return
+        self.inventory.append(_inventory_entry(item_id, quantity, item_config))
+
+    def remove_item(self, item_id, quantity):
+        """从背包移除物品，数量不足时移除整条"""
+        for index, entry in enumerate(self.inventory):
+            if entry.item_id == item_id:
+                if entry.quantity <= quantity:
+                    del self.inventory[index]
+                else:
+                    entry.quantity -= quantity
+                return
+
+    def equip(self, slot, item_id, item_config, equipped_at):
+        """把物品放到装备槽位上（不处理背包）"""
+        self.equipment[slot] = _equipment_entry(item_id, equipped_at, item_config)
+        self.refresh_equipment_stats()
+
+    def unequip(self, slot):
+        """清空装备槽位，返回原来的装备"""
+        entry = self.equipment.get(slot)
+        self.equipment[slot] = None
+        self.refresh_equipment_stats()
+        return entry
+
+    def refresh_equipment_stats(self):
+        """按当前装备重新计算属性加成"""
+        self.equipment_stats = compute_equipment_stats(
+            {'stats': entry.stats} for entry in self.equipment.values() if entry
+        )
+
+    def to_dict(self):
+        """生成接口使用的用户数据字典"""
+        equipment_stats = dict(self.equipment_stats)
+
+        # 计算总的最大值（基础值 + 装备加成）
+        total_max_hp = self.max_hp + equipment_stats['hp']
+        total_max_mp = self.max_mp + equipment_stats['mp']
+
+        return {
+            "username": self.username,
+            # 确保当前血量和魔法值不超过最大值
+            "HP": min(self.hp, total_max_hp),
+            "MP": min(self.mp, total_max_mp),
+            "max_HP": total_max_hp,
+            "max_MP": total_max_mp,
+            "base_max_HP": self.max_hp,
+            "base_max_MP": self.max_mp,
+            "gold": self.gold,
+            "experience": self.experience,
+            "level": self.level,
+            "attack": self.attack + equipment_stats['attack'],
+            "defense": self.defense + equipment_stats['defense'],
+            "critical_rate": self.critical_rate + equipment_stats['critical_rate'],
+            "critical_damage": self.critical_damage + equipment_stats['critical_damage'],
+            "base_attack": self.attack,
+            "base_defense": self.defense,
+            "base_critical_rate": self.critical_rate,
+            "base_critical_damage": self.critical_damage,
+            "equipment_stats": equipment_stats,
+            "inventory": {
+                "items": [entry.to_dict() for entry in self.inventory]
+            },
+            "equipment": {
+                slot: entry.to_dict() if entry else None
+                for slot, entry in self.equipment.items()
+            },
+            "created_at": self.created_at,
+            "last_updated": self.last_updated
+        }
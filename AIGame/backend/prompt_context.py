@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""
+聊天上下文组装
+
+每轮对话发给模型的内容 = 系统提示词（含位置信息和较早对话的摘要）+ 最近若干条原文消息，
+总量按模型的token预算控制，不再随对话变长而线性增长：
+- 尚未并入摘要的消息原文保留，超出预算时从最早的一条开始舍弃
+- 最近 PROMPT_RECENT_MESSAGES 条之前的消息由后台线程经LLM网关合并进 chat_summaries 表中的滚动摘要，
+  摘要记录覆盖到的最后一条消息ID，之后只需增量合并新消息；合并完成前这些消息仍以原文发送
+- token数为估算值：中日韩字符每字约1个token，其余字符约4个计1个token
+"""
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List
+from llm_gateway import llm_gateway, LLMGatewayError
+from config import (DEFAULT_MODEL, PROMPT_TOKEN_BUDGETS, PROMPT_DEFAULT_TOKEN_BUDGET,
+                    PROMPT_REPLY_RESERVE, PROMPT_RECENT_MESSAGES, SUMMARY_TRIGGER_MESSAGES,
+                    SUMMARY_BATCH_MESSAGES, SUMMARY_MAX_CHARS)
+
+# 每条消息的格式开销（角色、分隔符）
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_CJK_PATTERN = re.compile(r'[\u2e80-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]')
+
+SUMMARY_SYSTEM_PROMPT = (
+    '你负责为跑团游戏整理剧情摘要。根据已有摘要和新的对话，输出一份更新后的完整摘要：'
+    '保留玩家的身份、所在位置、获得或失去的物品与金币、遇到的NPC、未完成的任务和关键选择，'
+    '删去寒暄和重复内容。只输出摘要正文，不超过{max_chars}字。'
+)
+
+_ROLE_NAMES = {'user': '玩家', 'assistant': 'DM'}
+
+
+def estimate_tokens(text: str) -> int:
+    """估算一段文本的token数"""
+    if not text:
+        return 0
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def message_tokens(message: Dict[str, Any]) -> int:
+    """估算一条消息的token数"""
+    return estimate_tokens(message.get('content', '')) + MESSAGE_OVERHEAD_TOKENS
+
+
+class ContextBuilder:
+    """按token预算组装聊天上下文，并在后台维护较早对话的滚动摘要（线程安全）"""
+
+    def __init__(self, history, complete: Callable[[str, List[Dict[str, str]]], str],
+                 recent_messages: int = PROMPT_RECENT_MESSAGES,
+                 summary_trigger: int = SUMMARY_TRIGGER_MESSAGES,
+                 summary_batch: int = SUMMARY_BATCH_MESSAGES):
+        self.history = history
+        self.complete = complete
+        self.recent_messages = recent_messages
+        self.summary_trigger = summary_trigger
+        self.summary_batch = summary_batch
+
+        self._lock = threading.Lock()
+        self._pending = set()  # 正在生成摘要的 (username, character)
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='chat-summary')
+        self._stats = {
+            'builds': 0,
+            'builds_with_summary': 0,
+            'prompt_tokens': 0,
+            'max_prompt_tokens': 0,
+            'trimmed_messages': 0,
+            'summaries_scheduled': 0,
+            'summaries_generated': 0,
+            'summary_failures': 0
+        }
+
+    def budget_for(self, model: str) -> int:
+        """模型可用于输入的token预算（已扣除回复预留）"""
+        budget = PROMPT_TOKEN_BUDGETS.get(model, PROMPT_DEFAULT_TOKEN_BUDGET)
+        return max(0, budget - PROMPT_REPLY_RESERVE)
+
+    def build(self, username: str, character: str, system_prompt: str, message: str,
+              is_regenerate: bool, model: str = DEFAULT_MODEL) -> List[Dict[str, str]]:
+        """组装发送给模型的消息列表"""
+        summary = self.history.get_summary(username, character)
+        summarized_until = summary['summarized_until'] if summary else 0
+
+        # 多取一批，用来判断窗口之外还有多少未摘要的消息
+        history = self.history.get_recent_messages(
+            username, character, summarized_until, self.recent_messages + self.summary_batch
+        )
+
+        if is_regenerate and len(history) >= 2 and history[-1]['role'] == 'assistant':
+            # 重新生成：不添加新的用户消息，去掉最后的AI回复
+            history.pop()
+            turn = [{'role': m['role'], 'content': m['content']} for m in history]
+        else:
+            turn = [{'role': m['role'], 'content': m['content']} for m in history]
+            turn.append({'role': 'user', 'content': message})
+
+        system_content = system_prompt or ''
+        if summary and summary['summary']:
+            system_content += f"\n\n【前情提要】以下是你与玩家之前对话的摘要：\n{summary['summary']}"
+
+        messages = [{'role': 'system', 'content': system_content}] if system_content else []
+        used = sum(message_tokens(m) for m in messages)
+        budget = self.budget_for(model)
+
+        # 从最新的消息往前取所有尚未并入摘要的消息，直到预算用完，至少保留最后一条；
+        # 最近窗口之外的消息在并入摘要之前也照常发送，不会在摘要生成前丢失上下文
+        window = []
+        for entry in reversed(turn):
+            cost = message_tokens(entry)
+            if window and used + cost > budget:
+                break
+            window.append(entry)
+            used += cost
+        window.reverse()
+        messages.extend(window)
+
+        # 最近窗口之外的历史消息（不含本轮新增的用户消息）累计到阈值后并入摘要；
+        # 有消息因预算被裁掉时立即摘要，让它们尽快以摘要的形式回到上下文中
+        outside = len(turn) - min(len(turn), self.recent_messages)
+        trimmed = len(turn) - len(window)
+        if outside > 0 and (outside >= self.summary_trigger or trimmed > 0):
+            self._schedule_summary(username, character, history[outside - 1]['id'])
+
+        with self._lock:
+            self._stats['builds'] += 1
+            if summary:
+                self._stats['builds_with_summary'] += 1
+            self._stats['prompt_tokens'] += used
+            if used > self._stats['max_prompt_tokens']:
+                self._stats['max_prompt_tokens'] = used
+            self._stats['trimmed_messages'] += max(0, trimmed)
+        return messages
+
+    def _schedule_summary(self, username, character, until_id):
+        """在后台把 until_id 及之前的消息并入摘要（同一对话同时只有一个任务）"""
+        key = (username, character)
+        with self._lock:
+            if key in self._pending:
+                return
+            self._pending.add(key)
+            self._stats['summaries_scheduled'] += 1
+        try:
+            self._executor.submit(self._run_summary, username, character, until_id)
+        except Exception:
+            with self._lock:
+                self._pending.discard(key)
+            raise
+
+    def _run_summary(self, username, character, until_id):
+        try:
+            while self.summarize(username, character, until_id):
+                pass
+        except Exception as e:
+            with self._lock:
+                self._stats['summary_failures'] += 1
+            print(f"❌ 生成对话摘要失败: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard((username, character))
+
+    def summarize(self, username: str, character: str, until_id: int) -> bool:
+        """把一批未摘要的消息（id <= until_id）并入摘要，返回是否还需要继续"""
+        summary = self.history.get_summary(username, character)
+        summarized_until = summary['summarized_until'] if summary else 0
+        if summarized_until >= until_id:
+            return False
+
+        batch = self.history.get_messages_between(
+            username, character, summarized_until, until_id, self.summary_batch
+        )
+        if not batch:
+            return False
+
+        transcript = '\n'.join(f"{_ROLE_NAMES.get(m['role'], m['role'])}: {m['content']}" for m in batch)
+        previous = summary['summary'] if summary else '（无）'
+        prompt = [
+            {'role': 'system', 'content': SUMMARY_SYSTEM_PROMPT.format(max_chars=SUMMARY_MAX_CHARS)},
+            {'role': 'user', 'content': f"【已有摘要】\n{previous}\n\n【新的对话】\n{transcript}"}
+        ]
+
+        try:
+            reply = llm_gateway.call(f"summary:{username}", self.complete, DEFAULT_MODEL, prompt)
+        except LLMGatewayError as e:
+            # 网关繁忙时放弃，下一轮对话会重新触发
+            raise RuntimeError(f"LLM网关繁忙: {e}")
+        if not reply:
+            raise RuntimeError('模型返回为空')
+
+        self.history.save_summary(username, character, reply.strip(), batch[-1]['id'])
+        with self._lock:
+            self._stats['summaries_generated'] += 1
+        return batch[-1]['id'] < until_id
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取上下文组装指标"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({
+                'summaries_pending': len(self._pending),
+                'avg_prompt_tokens': stats['prompt_tokens'] / stats['builds'] if stats['builds'] else 0.0
+            })
+            return stats
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+SQL路由
+
+根据 表 -> 数据库 的注册表决定一条SQL应该发往 game_data.db 还是 world_data.db。
+每条不同的SQL字符串只解析一次（结果缓存），之后的路由只是一次字典查找；
+调用方也可以先用 prepare() 得到预绑定的 Statement 对象，直接跳过解析。
+"""
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, Tuple
+
+GAME_DB = 'game'
+WORLD_DB = 'world'
+
+# 表 -> 数据库 注册表
+TABLE_ROUTES: Dict[str, str] = {
+    # 游戏数据库：用户进度、会话、聊天、房间
+    'users': GAME_DB,
+    'user_data': GAME_DB,
+    'user_locations': GAME_DB,
+    'user_inventory': GAME_DB,
+    'user_equipment': GAME_DB,
+    'user_sessions': GAME_DB,
+    'session_revocations': GAME_DB,
+    'chat_history': GAME_DB,
+    'chat_summaries': GAME_DB,
+    'rooms': GAME_DB,
+    'room_users': GAME_DB,
+    'room_messages': GAME_DB,
+    'maintenance_leases': GAME_DB,
+    'events': GAME_DB,
+    'event_triggers': GAME_DB,
+    'skills': GAME_DB,
+    'schema_version': GAME_DB,
+    # 世界数据库：从JSON配置生成的只读数据
+    'map_areas': WORLD_DB,
+    'map_locations': WORLD_DB,
+    'creatures': WORLD_DB,
+    'items': WORLD_DB,
+    'shops': WORLD_DB,
+    'shop_items': WORLD_DB,
+    'build_meta': WORLD_DB,
+}
+
+# 不涉及任何表的SQL（如 SELECT 1、PRAGMA）走世界数据库（与旧逻辑一致）；
+# 涉及的表都未登记时报错，不再静默走默认库
+DEFAULT_DB = WORLD_DB
+
+_WRITE_KEYWORDS = ('insert', 'update', 'delete', 'replace', 'create', 'drop', 'alter')
+# WITH 语句的写入判断：正文中出现 DML 关键字（replace( 等同名函数除外）
+_DML_PATTERN = re.compile(r'\b(?:insert|update|delete|replace)\b(?!\s*\()', re.IGNORECASE)
+# WITH 子句中定义的公用表表达式名，不是真实的表
+_CTE_PATTERN = re.compile(
+    r'(?:\bwith(?:\s+recursive)?|,)\s*([a-z_][a-z0-9_]*)\s*(?:\([^)]*\))?\s+as\s*\(',
+    re.IGNORECASE
+)
+# SQLite 内部表和 PRAGMA 表值函数，不需要登记
+_INTERNAL_PREFIXES = ('sqlite_', 'pragma_')
+_TABLE_PATTERN = re.compile(
+    r'\b(?:from|join|into|update|table(?:\s+if\s+(?:not\s+)?exists)?)\s+(?!set\b)["`\[]?([a-z_][a-z0-9_]*)',
+    re.IGNORECASE
+)
+
+
+@dataclass(frozen=True)
+class Statement:
+    """预绑定的SQL语句：目标数据库和读写类型在创建时就已确定"""
+    sql: str
+    database: str
+    is_write: bool
+    tables: Tuple[str, ...] = ()
+
+
+def register_table(table: str, database: str):
+    """登记新表的归属数据库（会清空解析缓存）"""
+    if database not in (GAME_DB, WORLD_DB):
+        raise ValueError(f"未知数据库: {database}")
+    TABLE_ROUTES[table.lower()] = database
+    prepare.cache_clear()
+
+
+@lru_cache(maxsize=1024)
+def prepare(sql: str) -> Statement:
+    """解析SQL，得到目标数据库和读写类型（按SQL字符串缓存）
+
+    涉及的表都未在 TABLE_ROUTES 中登记时抛出 ValueError；部分未登记时按已登记的表路由并打印警告
+    """
+    first_word = sql.lstrip().split(None, 1)[0].lower() if sql.strip() else ''
+    ctes = set()
+    if first_word == 'with':
+        ctes = {name.lower() for name in _CTE_PATTERN.findall(sql)}
+        is_write = _DML_PATTERN.search(sql) is not None
+    else:
+        is_write = first_word in _WRITE_KEYWORDS
+
+    tables = tuple(
+        t for t in (t.lower() for t in _TABLE_PATTERN.findall(sql))
+        if t not in ctes and not t.startswith(_INTERNAL_PREFIXES)
+    )
+    unregistered = [table for table in tables if table not in TABLE_ROUTES]
+
+    database = DEFAULT_DB
+    for table in tables:
+        if table in TABLE_ROUTES:
+            database = TABLE_ROUTES[table]
+            break
+    else:
+        if unregistered:
+            raise ValueError(f"表未登记归属数据库（见 register_table）: {', '.join(unregistered)}")
+    if unregistered:
+        print(f"⚠️ 表未登记归属数据库，按 {database} 路由: {', '.join(unregistered)}")
+
+    return Statement(sql=sql, database=database, is_write=is_write, tables=tables)
+
+
+def route(query) -> Statement:
+    """接受SQL字符串或已准备好的Statement，返回Statement"""
+    if isinstance(query, Statement):
+        return query
+    return prepare(query)
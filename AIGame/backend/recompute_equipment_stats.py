@@ -0,0 +1,24 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+重新计算所有玩家的装备属性加成
+
+修改 item_control.json 中的物品属性（平衡性调整）后运行：
+    python recompute_equipment_stats.py
+"""
+import os
+import sys
+
+sys.stdout.reconfigure(encoding='utf-8')
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from user_manager import UserManager
+
+
+def main():
+    count = UserManager().recompute_equipment_stats()
+    print(f"✅ 已重新计算 {count} 名玩家的装备属性加成")
+
+
+if __name__ == '__main__':
+    main()
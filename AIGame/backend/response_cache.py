@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+LLM回复缓存
+
+按内容寻址：键为 (模型, 规范化后的消息, 调用参数) 的 sha256，同样的提示词直接复用上次的回复，
+不再经过LLM网关。主要用于房间互动的主持人回应——多个房间发送相同的预设互动时只调用一次模型。
+- 内存层：LRU，容量 LLM_CACHE_MEMORY_SIZE
+- 磁盘层：独立的 llm_cache.db（不占用游戏数据库的WAL），容量 LLM_CACHE_DISK_MAX_ENTRIES，
+  超出时按最近命中时间淘汰；重启后仍然有效
+- 两层都按 LLM_CACHE_TTL 过期；调用失败（抛出异常）和空回复不缓存
+- 未命中时相同键的并发请求合并为一次上游调用（single-flight），共享同一个结果
+- 调用方可以对需要多样性的轮次传 bypass=True 跳过缓存和合并（既不读也不写）
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+from db_pool import SQLiteConnectionPool
+from single_flight import SingleFlight
+from database_separation import apply_pragmas
+from config import (BACKEND_DIR, GAME_DB_PRAGMAS, LLM_CACHE_ENABLED, LLM_CACHE_TTL,
+                    LLM_CACHE_MEMORY_SIZE, LLM_CACHE_DISK_MAX_ENTRIES)
+
+# 每写入这么多条检查一次磁盘层容量
+_PRUNE_EVERY = 100
+
+
+def normalize_messages(messages: List[Dict[str, Any]]) -> List[List[str]]:
+    """只保留角色和内容，合并多余空白，使格式上的差异不影响缓存键"""
+    return [
+        [message.get('role', ''), ' '.join(str(message.get('content', '')).split())]
+        for message in messages
+    ]
+
+
+def cache_key(model: str, messages: List[Dict[str, Any]], params: Optional[Dict[str, Any]] = None) -> str:
+    """计算缓存键"""
+    payload = json.dumps(
+        {'model': model, 'messages': normalize_messages(messages), 'params': params or {}},
+        ensure_ascii=False, sort_keys=True, separators=(',', ':')
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """内存LRU + SQLite 两级的LLM回复缓存（线程安全）"""
+
+    def __init__(self, db_path: str = os.path.join(BACKEND_DIR, 'llm_cache.db'),
+                 ttl: float = LLM_CACHE_TTL, memory_size: int = LLM_CACHE_MEMORY_SIZE,
+                 disk_max_entries: int = LLM_CACHE_DISK_MAX_ENTRIES, enabled: bool = LLM_CACHE_ENABLED):
+        self.ttl = ttl
+        self.memory_size = memory_size
+        self.disk_max_entries = disk_max_entries
+        self.enabled = enabled
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # key -> (回复, 过期时间戳)
+        self._writes = 0
+        self.flights = SingleFlight()
+        self._stats = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'stores': 0,
+            'bypassed': 0,
+            'expired': 0,
+            'memory_evicted': 0,
+            'disk_evicted': 0,
+            'disk_errors': 0
+        }
+
+        self.pool = SQLiteConnectionPool(
+            db_path, max_size=4, name='llm_cache',
+            on_connect=lambda conn: apply_pragmas(conn, GAME_DB_PRAGMAS)
+        )
+        if self.enabled:
+            self._init_table()
+
+    def _init_table(self):
+        with self.pool.connection() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS llm_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    model TEXT NOT NULL,
+                    reply TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    expires_at REAL NOT NULL,
+                    last_hit_at REAL NOT NULL,
+                    hits INTEGER NOT NULL DEFAULT 0
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_llm_cache_last_hit ON llm_cache (last_hit_at)')
+            conn.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        """查找缓存，先内存后磁盘；磁盘命中会回填内存"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                reply, expires_at = entry
+                if now < expires_at:
+                    self._memory.move_to_end(key)
+                    self._stats['memory_hits'] += 1
+                    return reply
+                del self._memory[key]
+                self._stats['expired'] += 1
+
+        try:
+            with self.pool.connection() as conn:
+                row = conn.execute(
+                    'SELECT reply, expires_at FROM llm_cache WHERE cache_key = ?', (key,)
+                ).fetchone()
+                if row and now < row[1]:
+                    conn.execute(
+                        'UPDATE llm_cache SET last_hit_at = ?, hits = hits + 1 WHERE cache_key = ?', (now, key)
+                    )
+                    conn.commit()
+        except Exception as e:
+            print(f"❌ 读取LLM回复缓存失败: {e}")
+            row = None
+            with self._lock:
+                self._stats['disk_errors'] += 1
+
+        with self._lock:
+            if row and now < row[1]:
+                self._remember(key, row[0], row[1])
+                self._stats['disk_hits'] += 1
+                return row[0]
+            if row:
+                self._stats['expired'] += 1
+            self._stats['misses'] += 1
+        return None
+
+    def put(self, key: str, model: str, reply: str):
+        """写入两级缓存"""
+        now = time.time()
+        expires_at = now + self.ttl
+        with self._lock:
+            self._remember(key, reply, expires_at)
+            self._stats['stores'] += 1
+            self._writes += 1
+            prune = self._writes % _PRUNE_EVERY == 0
+
+        try:
+            with self.pool.connection() as conn:
+                conn.execute('''
+                    INSERT OR REPLACE INTO llm_cache (cache_key, model, reply, created_at, expires_at, last_hit_at, hits)
+                    VALUES (?, ?, ?, ?, ?, ?, 0)
+                ''', (key, model, reply, now, expires_at, now))
+                conn.commit()
+            if prune:
+                self.prune()
+        except Exception as e:
+            print(f"❌ 写入LLM回复缓存失败: {e}")
+            with self._lock:
+                self._stats['disk_errors'] += 1
+
+    def _remember(self, key, reply, expires_at):
+        """写入内存层（调用方需持有锁）"""
+        self._memory[key] = (reply, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+            self._stats['memory_evicted'] += 1
+
+    def prune(self) -> int:
+        """删除磁盘层中过期的条目，超出容量时按最近命中时间淘汰，返回删除的条数"""
+        with self.pool.connection() as conn:
+            deleted = conn.execute('DELETE FROM llm_cache WHERE expires_at <= ?', (time.time(),)).rowcount
+            overflow = conn.execute('SELECT COUNT(*) FROM llm_cache').fetchone()[0] - self.disk_max_entries
+            if overflow > 0:
+                deleted += conn.execute('''
+                    DELETE FROM llm_cache WHERE cache_key IN (
+                        SELECT cache_key FROM llm_cache ORDER BY last_hit_at LIMIT ?
+                    )
+                ''', (overflow,)).rowcount
+            conn.commit()
+        with self._lock:
+            self._stats['disk_evicted'] += deleted
+        return deleted
+
+    def get_or_call(self, model: str, messages: List[Dict[str, Any]], call: Callable[[], str],
+                    params: Optional[Dict[str, Any]] = None, bypass: bool = False) -> str:
+        """命中缓存时直接返回，否则执行 call() 并缓存有效的回复
+
+        同时未命中的相同请求只执行一次 call()（缓存关闭时也会合并）
+        """
+        if bypass:
+            with self._lock:
+                self._stats['bypassed'] += 1
+            return call()
+
+        key = cache_key(model, messages, params)
+        if self.enabled:
+            reply = self.get(key)
+            if reply is not None:
+                return reply
+
+        def load():
+            if self.enabled:
+                # 上一个领头请求可能刚好在本次查缓存之后写入
+                with self._lock:
+                    entry = self._memory.get(key)
+                if entry is not None and time.time() < entry[1]:
+                    return entry[0]
+            reply = call()
+            if self.enabled and reply and reply.strip():
+                self.put(key, model, reply)
+            return reply
+
+        return self.flights.do(key, load)
+
+    def clear(self):
+        """清空两级缓存"""
+        with self._lock:
+            self._memory.clear()
+        if self.enabled:
+            with self.pool.connection() as conn:
+                conn.execute('DELETE FROM llm_cache')
+                conn.commit()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存指标"""
+        with self._lock:
+            stats = dict(self._stats)
+            lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+            stats.update({
+                'enabled': self.enabled,
+                'coalescing': self.flights.get_stats(),
+                'memory_entries': len(self._memory),
+                'hit_rate': (stats['memory_hits'] + stats['disk_hits']) / lookups if lookups else 0.0
+            })
+        return stats
+
+
+# 全局回复缓存
+response_cache = ResponseCache()
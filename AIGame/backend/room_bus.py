@@ -0,0 +1,575 @@
+# -*- coding: utf-8 -*-
+"""
+房间消息总线
+
+RoomManager 通过总线把房间内的事件（消息、加入/离开、主持人模式、关闭房间）广播给所有工作进程和节点，
+每个进程再推送给连接在自己这里的客户端，负载均衡器后面不需要会话粘滞：
+- LocalRoomBus：只在本进程内广播（单进程部署、默认）
+- RedisRoomBus：通过 Redis 的 PUBLISH/PSUBSCRIBE 广播，只用到很小的命令子集，直接使用 RESP 协议，不依赖 redis 客户端库
+- LocalBroker：实现同一命令子集的本地代理（Unix socket 或 TCP），测试和开发时代替 Redis
+
+房间消息的序号由总线分配：Redis 中由一个脚本原子地递增序号并发布，所有订阅者按相同顺序收到相同序号，
+各进程的消息序号（SSE 事件ID）因此一致，客户端重连到任意进程都能从 Last-Event-ID 继续。
+"""
+import abc
+import fnmatch
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import urlparse, unquote
+from config import (ROOM_BUS_URL, ROOM_BUS_CHANNEL_PREFIX, ROOM_BUS_RECONNECT_DELAY,
+                    ROOM_BUS_MAX_RECONNECT_DELAY, ROOM_BUS_TIMEOUT)
+
+# 原子地分配序号并发布：序号不小于调用方已知的最大序号（Redis 重启丢失计数时从数据库恢复的序号继续）
+SEQ_PUBLISH_SCRIPT = (
+    "local seq = redis.call('INCR', KEYS[1]) "
+    "local floor = tonumber(ARGV[2]) "
+    "if seq <= floor then seq = floor + 1 redis.call('SET', KEYS[1], seq) end "
+    "redis.call('PUBLISH', KEYS[2], seq .. ' ' .. ARGV[1]) "
+    "return seq"
+)
+
+# 发布连接空闲超过该时间（秒）后，执行非幂等命令前先确认连接可用
+IDLE_CHECK_INTERVAL = 1.0
+
+# handler(room_id, seq, payload)：seq 为消息序号，非消息事件为 0
+BusHandler = Callable[[str, int, Dict[str, Any]], None]
+
+
+class RoomBusError(Exception):
+    """总线命令失败"""
+
+
+class RoomBus(abc.ABC):
+    """房间总线接口"""
+
+    # 是否跨进程广播（决定 RoomManager 能否只凭本进程的状态关闭房间）
+    distributed = False
+
+    def __init__(self):
+        self.node_id = uuid.uuid4().hex[:12]  # 本进程标识，用于忽略自己发出的状态事件
+        self._handlers: List[BusHandler] = []
+        self._reset_handlers: List[Callable[[], None]] = []
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'published_messages': 0,
+            'published_events': 0,
+            'delivered': 0,
+            'handler_errors': 0
+        }
+
+    def subscribe(self, handler: BusHandler, on_reset: Callable[[], None] = None):
+        """订阅所有房间的事件；on_reset 在订阅中断（可能漏掉事件）并恢复后调用"""
+        self._handlers.append(handler)
+        if on_reset:
+            self._reset_handlers.append(on_reset)
+
+    @abc.abstractmethod
+    def publish_message(self, room_id: str, payload: Dict[str, Any], floor_seq: int = 0) -> int:
+        """广播一条房间消息，返回分配的序号"""
+
+    @abc.abstractmethod
+    def publish_event(self, room_id: str, payload: Dict[str, Any]):
+        """广播一个房间状态事件（不分配序号）"""
+
+    def release(self, room_id: str):
+        """房间关闭后释放序号计数"""
+
+    def start(self):
+        """启动后台订阅"""
+
+    def close(self):
+        """停止后台订阅"""
+
+    def _count(self, key: str, amount: int = 1):
+        with self._stats_lock:
+            self._stats[key] += amount
+
+    def _deliver(self, room_id: str, seq: int, payload: Dict[str, Any]):
+        """把收到的事件交给订阅者"""
+        self._count('delivered')
+        for handler in self._handlers:
+            try:
+                handler(room_id, seq, payload)
+            except Exception as e:
+                self._count('handler_errors')
+                print(f"房间总线事件处理失败 ({room_id}): {e}")
+
+    def _reset(self):
+        for handler in self._reset_handlers:
+            try:
+                handler()
+            except Exception as e:
+                print(f"房间总线重置处理失败: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取总线指标"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats.update({'backend': type(self).__name__, 'node_id': self.node_id})
+        return stats
+
+
+class LocalRoomBus(RoomBus):
+    """进程内总线：发布时同步交给订阅者"""
+
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+        self._seqs: Dict[str, int] = {}
+
+    def publish_message(self, room_id: str, payload: Dict[str, Any], floor_seq: int = 0) -> int:
+        # 持锁投递，保证各订阅者看到的顺序与序号一致
+        with self._lock:
+            seq = max(self._seqs.get(room_id, 0), floor_seq) + 1
+            self._seqs[room_id] = seq
+            self._count('published_messages')
+            self._deliver(room_id, seq, payload)
+        return seq
+
+    def publish_event(self, room_id: str, payload: Dict[str, Any]):
+        with self._lock:
+            self._count('published_events')
+            self._deliver(room_id, 0, payload)
+
+    def release(self, room_id: str):
+        with self._lock:
+            self._seqs.pop(room_id, None)
+
+
+# ---------- RESP 协议 ----------
+
+def encode_command(*args) -> bytes:
+    """编码一条 RESP 命令"""
+    parts = [b'*%d\r\n' % len(args)]
+    for arg in args:
+        if isinstance(arg, bytes):
+            data = arg
+        else:
+            data = str(arg).encode('utf-8')
+        parts.append(b'$%d\r\n%s\r\n' % (len(data), data))
+    return b''.join(parts)
+
+
+def read_reply(stream) -> Any:
+    """从类文件对象读取一个 RESP 回复（错误回复返回 RoomBusError 实例）"""
+    line = stream.readline()
+    if not line:
+        raise ConnectionError("连接已关闭")
+    kind, body = line[:1], line[1:-2]
+    if kind == b'+':
+        return body.decode('utf-8')
+    if kind == b'-':
+        return RoomBusError(body.decode('utf-8', 'replace'))
+    if kind == b':':
+        return int(body)
+    if kind == b'$':
+        length = int(body)
+        if length < 0:
+            return None
+        data = stream.read(length + 2)
+        if len(data) < length + 2:
+            raise ConnectionError("连接已关闭")
+        return data[:-2]
+    if kind == b'*':
+        length = int(body)
+        if length < 0:
+            return None
+        return [read_reply(stream) for _ in range(length)]
+    raise RoomBusError(f"无法解析的回复: {line[:32]!r}")
+
+
+def _text(value) -> str:
+    return value.decode('utf-8') if isinstance(value, bytes) else str(value)
+
+
+class _RespConnection:
+    """一条到 Redis（或 LocalBroker）的连接"""
+
+    def __init__(self, url: str, timeout: Optional[float]):
+        parsed = urlparse(url)
+        if parsed.scheme == 'unix':
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            address = unquote(parsed.path)
+        elif parsed.scheme in ('redis', 'tcp'):
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            address = (parsed.hostname or 'localhost', parsed.port or 6379)
+        else:
+            raise ValueError(f"不支持的总线地址: {url}")
+        self.sock.settimeout(ROOM_BUS_TIMEOUT)
+        self.sock.connect(address)
+        self.sock.settimeout(timeout)
+        self.stream = self.sock.makefile('rb')
+
+        if parsed.password:
+            self.call('AUTH', unquote(parsed.password))
+        database = parsed.path.strip('/') if parsed.scheme != 'unix' else ''
+        if database and database != '0':
+            self.call('SELECT', database)
+
+    def send(self, *args):
+        self.sock.sendall(encode_command(*args))
+
+    def call(self, *args) -> Any:
+        self.send(*args)
+        reply = read_reply(self.stream)
+        if isinstance(reply, RoomBusError):
+            raise reply
+        return reply
+
+    def close(self):
+        for closer in (lambda: self.sock.shutdown(socket.SHUT_RDWR), self.stream.close, self.sock.close):
+            try:
+                closer()
+            except OSError:
+                pass
+
+
+class RedisRoomBus(RoomBus):
+    """通过 Redis 发布/订阅广播房间事件"""
+
+    distributed = True
+
+    def __init__(self, url: str, prefix: str = ROOM_BUS_CHANNEL_PREFIX):
+        super().__init__()
+        self.url = url
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._conn: Optional[_RespConnection] = None
+        self._conn_used_at = 0.0
+        self._subscriber: Optional[_RespConnection] = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._subscribed = threading.Event()
+        self._stats.update({'publish_errors': 0, 'reconnects': 0})
+
+    def _channel(self, room_id: str) -> str:
+        return f"{self.prefix}{room_id}"
+
+    def _command(self, *args, idempotent: bool = True) -> Any:
+        """执行一条命令，连接断开时重连并重试一次
+
+        命令发出后才断开时可能已经执行过，非幂等命令（idempotent=False）此时不重试，直接报错
+        """
+        with self._lock:
+            if not idempotent and self._conn and time.monotonic() - self._conn_used_at > IDLE_CHECK_INTERVAL:
+                # 空闲过的连接可能已被服务端关闭：先用 PING 确认，避免非幂等命令因此失败
+                try:
+                    self._conn.call('PING')
+                except (OSError, ConnectionError, RoomBusError):
+                    self._conn.close()
+                    self._conn = None
+            for attempt in range(2):
+                sent = False
+                try:
+                    if self._conn is None:
+                        self._conn = _RespConnection(self.url, ROOM_BUS_TIMEOUT)
+                    self._conn.send(*args)
+                    sent = True
+                    reply = read_reply(self._conn.stream)
+                except (OSError, ConnectionError) as e:
+                    if self._conn:
+                        self._conn.close()
+                        self._conn = None
+                    if attempt or (sent and not idempotent):
+                        self._count('publish_errors')
+                        raise RoomBusError(f"房间总线不可用: {e}")
+                    continue
+                except RoomBusError:
+                    self._count('publish_errors')
+                    raise
+                self._conn_used_at = time.monotonic()
+                if isinstance(reply, RoomBusError):
+                    self._count('publish_errors')
+                    raise reply
+                return reply
+
+    def publish_message(self, room_id: str, payload: Dict[str, Any], floor_seq: int = 0) -> int:
+        data = json.dumps(payload, ensure_ascii=False)
+        # 脚本可能已经分配序号并发布，只是回复丢失：重试会以新序号重复发布，因此不重试
+        seq = self._command('EVAL', SEQ_PUBLISH_SCRIPT, 2, self._channel(room_id) + ':seq',
+                            self._channel(room_id), data, floor_seq, idempotent=False)
+        self._count('published_messages')
+        return int(seq)
+
+    def publish_event(self, room_id: str, payload: Dict[str, Any]):
+        self._command('PUBLISH', self._channel(room_id), '0 ' + json.dumps(payload, ensure_ascii=False))
+        self._count('published_events')
+
+    def release(self, room_id: str):
+        try:
+            self._command('DEL', self._channel(room_id) + ':seq')
+        except RoomBusError as e:
+            print(f"删除房间序号计数失败 ({room_id}): {e}")
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._listen, name='room-bus', daemon=True)
+        self._thread.start()
+
+    def wait_until_subscribed(self, timeout: float = None) -> bool:
+        """等待订阅建立（测试和启动检查用）"""
+        return self._subscribed.wait(timeout)
+
+    def _listen(self):
+        """订阅所有房间频道，断开后按指数退避重连"""
+        delay = ROOM_BUS_RECONNECT_DELAY
+        interrupted = False
+        while not self._stop.is_set():
+            try:
+                self._subscriber = _RespConnection(self.url, None)
+                self._subscriber.send('PSUBSCRIBE', self.prefix + '*')
+                delay = ROOM_BUS_RECONNECT_DELAY
+                while not self._stop.is_set():
+                    reply = read_reply(self._subscriber.stream)
+                    if not isinstance(reply, list) or not reply:
+                        continue
+                    kind = _text(reply[0])
+                    if kind == 'psubscribe':
+                        self._subscribed.set()
+                        if interrupted:
+                            # 断线期间可能漏掉了事件，让订阅者丢弃本地状态
+                            interrupted = False
+                            self._reset()
+                    elif kind == 'pmessage' and len(reply) == 4:
+                        self._dispatch(_text(reply[2]), reply[3])
+            except (OSError, ConnectionError, RoomBusError, ValueError) as e:
+                if self._stop.is_set():
+                    break
+                self._subscribed.clear()
+                interrupted = True
+                self._count('reconnects')
+                print(f"房间总线订阅断开，{delay:.0f}秒后重连: {e}")
+                self._stop.wait(delay)
+                delay = min(delay * 2, ROOM_BUS_MAX_RECONNECT_DELAY)
+            finally:
+                if self._subscriber:
+                    self._subscriber.close()
+                    self._subscriber = None
+
+    def _dispatch(self, channel: str, data: bytes):
+        if not channel.startswith(self.prefix) or channel.endswith(':seq'):
+            return
+        seq, _, body = _text(data).partition(' ')
+        try:
+            payload = json.loads(body)
+            seq = int(seq)
+        except ValueError:
+            self._count('handler_errors')
+            return
+        self._deliver(channel[len(self.prefix):], seq, payload)
+
+    def close(self):
+        self._stop.set()
+        subscriber = self._subscriber
+        if subscriber:
+            subscriber.close()
+        with self._lock:
+            if self._conn:
+                self._conn.close()
+                self._conn = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = super().get_stats()
+        stats['subscribed'] = self._subscribed.is_set()
+        return stats
+
+
+def create_room_bus(url: str = ROOM_BUS_URL) -> RoomBus:
+    """按配置创建总线：没有配置地址时只在本进程内广播"""
+    if not url:
+        return LocalRoomBus()
+    return RedisRoomBus(url)
+
+
+# ---------- 本地代理 ----------
+
+class _BrokerHandler(socketserver.StreamRequestHandler):
+    """处理一个客户端连接"""
+
+    def handle(self):
+        broker = self.server.broker
+        write_lock = threading.Lock()
+
+        def write(data: bytes):
+            with write_lock:
+                self.wfile.write(data)
+                self.wfile.flush()
+
+        patterns: List[str] = []
+        broker.add_client(self.request)
+        try:
+            while True:
+                try:
+                    command = read_reply(self.rfile)
+                except (ConnectionError, OSError):
+                    break
+                if not isinstance(command, list) or not command:
+                    write(b'-ERR protocol error\r\n')
+                    continue
+                name = _text(command[0]).upper()
+                args = [_text(arg) for arg in command[1:]]
+                if name == 'PSUBSCRIBE':
+                    for pattern in args:
+                        patterns.append(pattern)
+                        broker.add_subscriber(pattern, write)
+                        write(_encode_array([b'psubscribe', pattern.encode('utf-8'), len(patterns)]))
+                else:
+                    write(broker.execute(name, args))
+        finally:
+            broker.remove_subscriber(write)
+            broker.remove_client(self.request)
+
+
+def _encode_array(items) -> bytes:
+    parts = [b'*%d\r\n' % len(items)]
+    for item in items:
+        if isinstance(item, int):
+            parts.append(b':%d\r\n' % item)
+        else:
+            parts.append(b'$%d\r\n%s\r\n' % (len(item), item))
+    return b''.join(parts)
+
+
+class _TCPBrokerServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+if hasattr(socketserver, 'ThreadingUnixStreamServer'):
+    class _UnixBrokerServer(socketserver.ThreadingUnixStreamServer):
+        daemon_threads = True
+else:
+    _UnixBrokerServer = None
+
+
+class LocalBroker:
+    """实现 RedisRoomBus 所需命令子集的本地代理
+
+    支持 PING、AUTH、SELECT、GET、SET、DEL、INCR、PUBLISH、PSUBSCRIBE，以及 EVAL 执行 SEQ_PUBLISH_SCRIPT；
+    address 为 Unix socket 路径或 (host, port)
+    """
+
+    def __init__(self, address):
+        self.address = address
+        self._lock = threading.Lock()
+        self._values: Dict[str, int] = {}
+        self._subscribers: List[tuple] = []  # (pattern, write)
+        self._clients = set()
+        if isinstance(address, str):
+            if os.path.exists(address):
+                os.unlink(address)
+            self.server = _UnixBrokerServer(address, _BrokerHandler)
+        else:
+            self.server = _TCPBrokerServer(address, _BrokerHandler)
+        self.server.broker = self
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        """RedisRoomBus 使用的地址"""
+        if isinstance(self.address, str):
+            return f"unix://{self.address}"
+        host, port = self.server.server_address[:2]
+        return f"redis://{host}:{port}/0"
+
+    def start(self) -> 'LocalBroker':
+        self._thread = threading.Thread(target=self.server.serve_forever, name='room-broker', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """停止代理并断开所有客户端"""
+        self.server.shutdown()
+        self.server.server_close()
+        with self._lock:
+            clients = list(self._clients)
+        for client in clients:
+            try:
+                client.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.unlink(self.address)
+
+    def add_client(self, client: socket.socket):
+        with self._lock:
+            self._clients.add(client)
+
+    def remove_client(self, client: socket.socket):
+        with self._lock:
+            self._clients.discard(client)
+
+    def add_subscriber(self, pattern: str, write):
+        with self._lock:
+            self._subscribers.append((pattern, write))
+
+    def remove_subscriber(self, write):
+        with self._lock:
+            self._subscribers = [s for s in self._subscribers if s[1] is not write]
+
+    def _publish(self, channel: str, message: str) -> int:
+        """调用方需持有锁，保证所有订阅者收到的顺序一致"""
+        delivered = 0
+        for pattern, write in self._subscribers:
+            if fnmatch.fnmatchcase(channel, pattern):
+                try:
+                    write(_encode_array([b'pmessage', pattern.encode('utf-8'),
+                                         channel.encode('utf-8'), message.encode('utf-8')]))
+                    delivered += 1
+                except OSError:
+                    pass
+        return delivered
+
+    def execute(self, name: str, args: List[str]) -> bytes:
+        """执行一条命令，返回编码后的回复"""
+        with self._lock:
+            if name == 'PING':
+                return b'+PONG\r\n'
+            if name in ('AUTH', 'SELECT'):
+                return b'+OK\r\n'
+            if name == 'GET' and len(args) == 1:
+                value = self._values.get(args[0])
+                if value is None:
+                    return b'$-1\r\n'
+                data = str(value).encode()
+                return b'$%d\r\n%s\r\n' % (len(data), data)
+            if name == 'SET' and len(args) >= 2:
+                self._values[args[0]] = int(args[1])
+                return b'+OK\r\n'
+            if name == 'DEL' and args:
+                return b':%d\r\n' % sum(self._values.pop(key, None) is not None for key in args)
+            if name == 'INCR' and len(args) == 1:
+                value = self._values[args[0]] = self._values.get(args[0], 0) + 1
+                return b':%d\r\n' % value
+            if name == 'PUBLISH' and len(args) == 2:
+                return b':%d\r\n' % self._publish(args[0], args[1])
+            if name == 'EVAL' and args and args[0] == SEQ_PUBLISH_SCRIPT and len(args) == 6:
+                seq_key, channel, data, floor = args[2], args[3], args[4], int(args[5])
+                seq = self._values.get(seq_key, 0) + 1
+                if seq <= floor:
+                    seq = floor + 1
+                self._values[seq_key] = seq
+                self._publish(channel, f"{seq} {data}")
+                return b':%d\r\n' % seq
+        return f"-ERR unsupported command '{name}'\r\n".encode('utf-8')
+
+
+if __name__ == '__main__':
+    # 启动本地代理：python room_bus.py /tmp/aigame-room.sock 或 python room_bus.py 127.0.0.1:6390
+    import sys
+    target = sys.argv[1] if len(sys.argv) > 1 else '127.0.0.1:6390'
+    if ':' in target and not target.startswith('/'):
+        host, port = target.rsplit(':', 1)
+        broker = LocalBroker((host, int(port)))
+    else:
+        broker = LocalBroker(target)
+    print(f"房间总线本地代理已启动: {broker.url}")
+    broker.server.serve_forever()
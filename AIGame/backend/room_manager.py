@@ -1,38 +1,174 @@
 # -*- coding: utf-8 -*-
+import atexit
+import heapq
+import json
+import sys
 import uuid
 import time
+import threading
+from collections import deque
 from datetime import datetime
-from typing import Dict, List, Optional
-from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+from config import (ROOM_PRESENCE_TIMEOUT, ROOM_MESSAGE_CAPACITY, ROOM_USER_IDLE_TIMEOUT, ROOM_JANITOR_INTERVAL,
+                    ROOM_JANITOR_LEASE_TTL, ROOM_MESSAGE_CACHE_JSON)
+from room_bus import LocalRoomBus, RoomBusError
+
+# 所有人都能看到的消息类型；私聊消息只有发送者和目标用户能看到
+PUBLIC_MESSAGE_TYPES = ('global', 'interaction')
+
+# 在数据库中清理不活跃成员和空房间的租约名，同一时间只有一个进程执行
+JANITOR_LEASE = 'room-janitor'
 
-@dataclass
 class RoomMessage:
-    """房间消息"""
-    id: str
-    sender: str
-    content: str
-    message_type: str  # 'private', 'global', 'interaction'
-    target_user: Optional[str] = None  # 私聊目标用户
-    timestamp: float = None
-    
-    def __post_init__(self):
-        if self.timestamp is None:
-            self.timestamp = time.time()
-
-@dataclass 
+    """房间消息
+
+    使用 __slots__ 的紧凑记录（每个房间保留 ROOM_MESSAGE_CAPACITY 条，房间多时数量很大）：
+    - 以房间内递增的序号作为消息ID，不再为每条消息生成 uuid 字符串
+    - 发送者、目标用户和消息类型使用驻留字符串，同一个名字在所有消息中只保存一份
+    - 开启 ROOM_MESSAGE_CACHE_JSON 时，第一次推送时编码的 UTF-8 JSON 会缓存下来，推送给其他连接时复用
+    """
+    __slots__ = ('seq', 'sender', 'content', 'message_type', 'target_user', 'timestamp', '_encoded')
+    
+    def __init__(self, sender: str, content: str, message_type: str, target_user: Optional[str] = None,
+                 timestamp: float = None, seq: int = 0):
+        self.seq = seq  # 房间内递增的序号，推送时作为事件ID，断线重连后从这里继续
+        self.sender = sys.intern(sender)
+        self.content = content
+        self.message_type = sys.intern(message_type)  # 'private', 'global', 'interaction'
+        self.target_user = sys.intern(target_user) if target_user else None  # 私聊目标用户
+        self.timestamp = time.time() if timestamp is None else timestamp
+        self._encoded = None
+    
+    @property
+    def id(self) -> str:
+        """消息ID（即序号）"""
+        return str(self.seq)
+    
+    def to_dict(self) -> Dict:
+        """接口格式"""
+        return {
+            'id': self.id,
+            'seq': self.seq,
+            'sender': self.sender,
+            'content': self.content,
+            'message_type': self.message_type,
+            'target_user': self.target_user,
+            'timestamp': self.timestamp
+        }
+    
+    def encode(self) -> bytes:
+        """UTF-8 编码的 JSON（to_dict 的内容）"""
+        if self._encoded is not None:
+            return self._encoded
+        data = json.dumps(self.to_dict(), ensure_ascii=False).encode('utf-8')
+        if ROOM_MESSAGE_CACHE_JSON and self.seq:
+            self._encoded = data
+        return data
+    
+    def memory_size(self) -> int:
+        """本条消息独占的内存（字节，驻留的名字不计）"""
+        size = sys.getsizeof(self) + sys.getsizeof(self.content)
+        if self._encoded is not None:
+            size += sys.getsizeof(self._encoded)
+        return size
+    
+    def __repr__(self):
+        return f"RoomMessage(seq={self.seq}, sender={self.sender!r}, message_type={self.message_type!r})"
+
 class RoomUser:
     """房间用户"""
-    username: str
-    session_token: str
-    joined_at: float
-    last_activity: float
-    is_host: bool = False
-    
-    def __post_init__(self):
-        if not hasattr(self, 'joined_at') or self.joined_at is None:
-            self.joined_at = time.time()
-        if not hasattr(self, 'last_activity') or self.last_activity is None:
-            self.last_activity = time.time()
+    __slots__ = ('username', 'session_token', 'joined_at', 'last_activity', 'is_host', 'connections')
+    
+    def __init__(self, username: str, session_token: str, joined_at: float = None,
+                 last_activity: float = None, is_host: bool = False, connections: int = 0):
+        now = time.time()
+        self.username = sys.intern(username)
+        self.session_token = session_token
+        self.joined_at = now if joined_at is None else joined_at
+        self.last_activity = now if last_activity is None else last_activity
+        self.is_host = is_host
+        self.connections = connections  # 当前打开的推送连接数，大于0即在线
+
+class RoomMessageLog:
+    """房间消息日志（调用方负责加锁）
+
+    - 所有消息存放在有界的环形缓冲中，超出容量时自动丢弃最旧的，不再整体切片重建
+    - 序号单调递增且连续；公开消息和每个用户的私聊消息另有子列表
+    - 查询“某序号之后某用户可见的消息”从子列表尾部向前扫描到该序号为止，
+      代价与新消息数成正比，与房间历史长度无关
+    """
+
+    def __init__(self, capacity: int = ROOM_MESSAGE_CAPACITY):
+        self.capacity = capacity
+        self._all = deque(maxlen=capacity)
+        self._public = deque(maxlen=capacity)
+        self._private: Dict[str, deque] = {}  # 用户名 -> 该用户收发的私聊消息
+        self.last_seq = 0
+        self._last_timestamp = 0.0
+
+    def __len__(self):
+        return len(self._all)
+
+    def __iter__(self):
+        return iter(self._all)
+
+    @property
+    def first_seq(self) -> int:
+        """仍保留的最早消息的序号"""
+        return self.last_seq - len(self._all) + 1
+
+    def append(self, message: RoomMessage) -> int:
+        """追加消息，分配序号"""
+        message.seq = self.last_seq + 1
+        self.restore(message)
+        return message.seq
+
+    def restore(self, message: RoomMessage):
+        """按已分配的序号放入一条消息（已持久化或由总线分配，序号需递增）"""
+        self.last_seq = message.seq
+        # 时间戳保持单调，按时间戳查询时也能从尾部提前停止
+        if message.timestamp < self._last_timestamp:
+            message.timestamp = self._last_timestamp
+        self._last_timestamp = message.timestamp
+        self._all.append(message)
+        if message.message_type in PUBLIC_MESSAGE_TYPES:
+            self._public.append(message)
+        elif message.message_type == 'private':
+            for username in {message.sender, message.target_user}:
+                if username:
+                    stream = self._private.get(username)
+                    if stream is None:
+                        stream = self._private[username] = deque(maxlen=self.capacity)
+                    stream.append(message)
+
+    @staticmethod
+    def _tail(stream, since_seq: int, since_timestamp: float) -> List[RoomMessage]:
+        """stream 中序号和时间戳都大于给定值的消息（按序号正序）"""
+        result = []
+        for msg in reversed(stream):
+            if msg.seq <= since_seq or msg.timestamp <= since_timestamp:
+                break
+            result.append(msg)
+        result.reverse()
+        return result
+
+    def since(self, since_seq: int = 0, since_timestamp: float = 0) -> List[RoomMessage]:
+        """某序号/时间戳之后的所有消息"""
+        return self._tail(self._all, since_seq, since_timestamp)
+
+    def visible_since(self, username: str, since_seq: int = 0, since_timestamp: float = 0) -> List[RoomMessage]:
+        """某序号/时间戳之后该用户可见的消息（按序号正序）"""
+        # 私聊子列表可能比主缓冲保留得更久，按主缓冲的范围截断
+        since_seq = max(since_seq, self.first_seq - 1)
+        public = self._tail(self._public, since_seq, since_timestamp)
+        private_stream = self._private.get(username)
+        private = self._tail(private_stream, since_seq, since_timestamp) if private_stream else []
+        if not private:
+            return public
+        if not public:
+            return private
+        return list(heapq.merge(public, private, key=lambda msg: msg.seq))
+
 
 class GameRoom:
     """游戏房间"""
@@ -40,89 +176,204 @@ class GameRoom:
         self.room_id = room_id
         self.host_username = host_username
         self.users: Dict[str, RoomUser] = {}
-        self.messages: List[RoomMessage] = []
+        self.log = RoomMessageLog()
         self.created_at = time.time()
         self.host_mode = 'private'  # 'private' 或 'global'
         self.max_users = 10
+        # 新消息、用户列表/在线状态/主持人模式变化时唤醒等待中的推送连接
+        self._cond = threading.Condition()
+        self.state_version = 0
+        self.closed = False
+        # 成员活动时的回调 (房间ID, 用户名, 时间戳)，RoomManager 据此记录需要写入数据库的活动时间
+        self.on_activity = None
         
+    @classmethod
+    def restore(cls, state: Dict) -> 'GameRoom':
+        """由 RoomStore.load_room 读取的状态重建房间"""
+        room = cls(state['room_id'], state['host'])
+        room.created_at = state['created_at']
+        room.max_users = state['max_users']
+        room.host_mode = state['host_mode']
+        now = time.time()
+        for username, joined_at in state['users']:
+            room.users[username] = RoomUser(
+                username=username,
+                session_token='',
+                joined_at=joined_at,
+                # 恢复后先视为刚活跃过，之后按推送连接/活动时间判断在线
+                last_activity=now,
+                is_host=username == room.host_username
+            )
+        for seq, sender, content, message_type, target_user, timestamp in state['messages']:
+            room.log.restore(RoomMessage(
+                sender=sender,
+                content=content,
+                message_type=message_type,
+                target_user=target_user,
+                timestamp=timestamp,
+                seq=seq
+            ))
+        return room
+    
     def add_user(self, username: str, session_token: str) -> bool:
-        """添加用户到房间"""
-        if len(self.users) >= self.max_users:
-            return False
-            
-        is_host = username == self.host_username
-        self.users[username] = RoomUser(
-            username=username,
-            session_token=session_token,
-            joined_at=time.time(),
-            last_activity=time.time(),
-            is_host=is_host
-        )
+        """添加用户到房间；已在房间中的用户（例如从另一个标签页重新加入）只更新令牌和活动时间"""
+        with self._cond:
+            user = self.users.get(username)
+            if user:
+                # 保留原记录：其推送连接计数仍然有效，不会被当作已断开而过期
+                if session_token:
+                    user.session_token = session_token
+                self._touch(user)
+                return True
+            if len(self.users) >= self.max_users:
+                return False
+            user = RoomUser(
+                username=username,
+                session_token=session_token,
+                is_host=username == self.host_username
+            )
+            self.users[user.username] = user
+            self._state_changed()
         return True
     
     def remove_user(self, username: str):
         """从房间移除用户"""
-        if username in self.users:
-            del self.users[username]
+        with self._cond:
+            if username in self.users:
+                del self.users[username]
+                self._state_changed()
     
-    def add_message(self, message: RoomMessage):
-        """添加消息到房间"""
-        self.messages.append(message)
-        
-        # 智能模式切换逻辑
-        if message.message_type == 'interaction':
-            # 互动消息切换为全局模式
-            self.host_mode = 'global'
-        elif message.sender != "系统" and message.message_type == 'private':
-            # 普通私聊消息切换回私聊模式
-            self.host_mode = 'private'
-        
-        # 只保留最近100条消息
-        if len(self.messages) > 100:
-            self.messages = self.messages[-100:]
-    
-    def get_messages_for_user(self, username: str, since_timestamp: float = 0) -> List[RoomMessage]:
-        """获取用户可见的消息"""
-        print(f"获取用户 {username} 的可见消息，时间戳: {since_timestamp}")
-        visible_messages = []
-        
-        for msg in self.messages:
-            print(f"检查消息: {msg.sender} -> {msg.content} (类型: {msg.message_type}, 时间戳: {msg.timestamp})")
-            
-            if msg.timestamp <= since_timestamp:
-                print(f"  跳过: 消息时间戳 {msg.timestamp} <= {since_timestamp}")
-                continue
-                
-            # 全局消息所有人都能看到
-            if msg.message_type == 'global':
-                print(f"  添加全局消息: {msg.content}")
-                visible_messages.append(msg)
-            # 私聊消息只有发送者和目标用户能看到
-            elif msg.message_type == 'private':
-                if msg.sender == username or msg.target_user == username:
-                    print(f"  添加私聊消息: {msg.content}")
-                    visible_messages.append(msg)
-                else:
-                    print(f"  跳过私聊消息: 不是发送者或接收者")
-            # 互动消息所有人都能看到
-            elif msg.message_type == 'interaction':
-                print(f"  添加互动消息: {msg.content}")
-                visible_messages.append(msg)
+    @property
+    def messages(self) -> List[RoomMessage]:
+        """当前保留的所有消息（副本）"""
+        with self._cond:
+            return list(self.log)
+    
+    @property
+    def last_seq(self) -> int:
+        """最新消息的序号"""
+        return self.log.last_seq
+    
+    def add_message(self, message: RoomMessage, seq: int = None) -> bool:
+        """添加消息到房间，并唤醒推送连接
+
+        seq 为总线分配的序号；不大于已有最大序号的消息是重复投递，忽略
+        """
+        with self._cond:
+            # 超出 ROOM_MESSAGE_CAPACITY 时环形缓冲自动丢弃最旧的消息
+            if seq is None:
+                self.log.append(message)
+            elif seq <= self.log.last_seq:
+                return False
             else:
-                print(f"  未知消息类型: {msg.message_type}")
-                
-        print(f"最终可见消息数量: {len(visible_messages)}")
-        return visible_messages
+                message.seq = seq
+                self.log.restore(message)
+            
+            # 智能模式切换逻辑
+            old_mode = self.host_mode
+            if message.message_type == 'interaction':
+                # 互动消息切换为全局模式
+                self.host_mode = 'global'
+            elif message.sender != "系统" and message.message_type == 'private':
+                # 普通私聊消息切换回私聊模式
+                self.host_mode = 'private'
+            if self.host_mode != old_mode:
+                self.state_version += 1
+            self._cond.notify_all()
+        return True
+    
+    def set_host_mode(self, mode: str):
+        """设置主持人模式"""
+        with self._cond:
+            if self.host_mode != mode:
+                self.host_mode = mode
+                self._state_changed()
+    
+    def _state_changed(self):
+        """用户列表、在线状态或主持人模式变化（调用方需持有锁）"""
+        self.state_version += 1
+        self._cond.notify_all()
+    
+    def get_messages_for_user(self, username: str, since_timestamp: float = 0,
+                              since_seq: int = 0) -> List[RoomMessage]:
+        """获取用户可见的消息（时间戳或序号之后的）"""
+        with self._cond:
+            return self.log.visible_since(username, since_seq, since_timestamp)
+    
+    def read_updates(self, username: str, since_seq: int) -> Tuple[List[RoomMessage], int, int]:
+        """推送连接读取更新：返回 (序号之后的可见消息, 当前最新序号, 当前状态版本)"""
+        with self._cond:
+            return self.log.visible_since(username, since_seq), self.log.last_seq, self.state_version
+    
+    def wait_for_update(self, last_seq: int, state_version: int, timeout: float) -> bool:
+        """等待新消息或状态变化，超时返回False"""
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: self.closed or self.last_seq > last_seq or self.state_version != state_version,
+                timeout
+            )
+    
+    def connect(self, username: str):
+        """用户打开推送连接"""
+        with self._cond:
+            user = self.users.get(username)
+            if user:
+                user.connections += 1
+                self._touch(user)
+                if user.connections == 1:
+                    self._state_changed()
+    
+    def disconnect(self, username: str):
+        """用户的推送连接断开"""
+        with self._cond:
+            user = self.users.get(username)
+            if user and user.connections > 0:
+                user.connections -= 1
+                self._touch(user)
+                if user.connections == 0:
+                    self._state_changed()
+    
+    def close(self):
+        """房间被删除，结束所有推送连接"""
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
     
     def update_user_activity(self, username: str):
         """更新用户活动时间"""
-        if username in self.users:
-            self.users[username].last_activity = time.time()
+        user = self.users.get(username)
+        if user:
+            self._touch(user)
+    
+    def _touch(self, user: RoomUser):
+        """记录用户活动"""
+        user.last_activity = time.time()
+        if self.on_activity:
+            self.on_activity(self.room_id, user.username, user.last_activity)
     
     def is_user_in_room(self, username: str) -> bool:
         """检查用户是否在房间中"""
         return username in self.users
     
+    def next_expiry(self, idle_timeout: float) -> Optional[float]:
+        """最早会因不活跃而过期的用户的过期时间；有推送连接的用户不过期，没有可过期的用户时返回 None"""
+        with self._cond:
+            idle = [user.last_activity for user in self.users.values() if user.connections == 0]
+        return min(idle) + idle_timeout if idle else None
+    
+    def idle_users(self, now: float, idle_timeout: float) -> List[str]:
+        """已过期（没有推送连接且超时未活动）的用户"""
+        with self._cond:
+            return [
+                user.username for user in self.users.values()
+                if user.connections == 0 and now - user.last_activity >= idle_timeout
+            ]
+    
+    def estimate_memory(self) -> int:
+        """估算房间消息占用的内存（字节）"""
+        with self._cond:
+            return sum(message.memory_size() for message in self.log)
+    
     def get_user_list(self) -> List[Dict]:
         """获取房间用户列表"""
         return [
@@ -130,44 +381,178 @@ class GameRoom:
                 'username': user.username,
                 'is_host': user.is_host,
                 'joined_at': user.joined_at,
-                'is_online': time.time() - user.last_activity < 30  # 30秒内活跃算在线
+                # 有推送连接（心跳维持）即在线；没有连接时最近活跃也算在线
+                'is_online': user.connections > 0 or time.time() - user.last_activity < ROOM_PRESENCE_TIMEOUT
             }
-            for user in self.users.values()
+            for user in list(self.users.values())
         ]
 
 class RoomManager:
-    """房间管理器"""
-    def __init__(self):
+    """房间管理器
+
+    传入 store（RoomStore）时房间状态持久化到数据库：本进程内存中没有的房间在第一次访问时从数据库恢复，
+    多个工作进程可以服务同一个房间；不传时只保存在内存中。
+    房间事件经 bus（RoomBus）广播，各进程收到后更新自己内存中的房间并推送给本进程的连接；
+    消息也经总线分配序号后再加入房间，默认的 LocalRoomBus 只在本进程内同步投递
+    不活跃成员和空房间由持有数据库租约的进程统一清理，各进程只负责上报活动时间和释放自己的内存
+    """
+    def __init__(self, store=None, bus=None):
         self.rooms: Dict[str, GameRoom] = {}
+        self.store = store
+        self.bus = bus or LocalRoomBus()
+        self.bus.subscribe(self._on_bus_event, on_reset=self._on_bus_reset)
+        self._lock = threading.Lock()
+        
+        # 清理调度：按下次检查时间排序的最小堆 (时间, 房间ID)；_deadlines 记录每个房间当前有效的时间，
+        # 过时的堆条目在弹出时直接丢弃，每次清理只处理到期的房间
+        self.idle_timeout = ROOM_USER_IDLE_TIMEOUT
+        self.janitor_interval = ROOM_JANITOR_INTERVAL
+        self.lease_ttl = ROOM_JANITOR_LEASE_TTL
+        self._lease_held = False
+        self._janitor_lock = threading.Lock()
+        self._expiry_heap: List[Tuple[float, str]] = []
+        self._deadlines: Dict[str, float] = {}
+        # 上次清理以来有活动的成员 (房间ID, 用户名) -> 最近活动时间，清理时批量写入数据库
+        self._activity: Dict[Tuple[str, str], float] = {}
+        self._janitor_stop = threading.Event()
+        self._janitor_thread = None
+        self._janitor_stats = {
+            'sweeps': 0,
+            'checked_rooms': 0,
+            'expired_users': 0,
+            'evicted_rooms': 0,
+            'expired_persisted_users': 0,
+            'closed_persisted_rooms': 0,
+            'freed_messages': 0,
+            'freed_bytes': 0,
+            'last_sweep_duration': 0.0,
+            'last_sweep_at': None
+        }
         
     def create_room(self, host_username: str) -> str:
         """创建房间"""
         room_id = str(uuid.uuid4())[:8]  # 使用短ID
         room = GameRoom(room_id, host_username)
+        if self.store:
+            self.store.save_room(room)
+            room.on_activity = self._record_activity
         self.rooms[room_id] = room
+        self._schedule(room_id, time.time() + self.idle_timeout)
         return room_id
     
     def join_room(self, room_id: str, username: str, session_token: str) -> bool:
         """加入房间"""
-        if room_id not in self.rooms:
+        room = self.get_room(room_id)
+        if not room:
             return False
             
-        room = self.rooms[room_id]
-        return room.add_user(username, session_token)
+        if not room.add_user(username, session_token):
+            return False
+        if self.store:
+            self.store.add_user(room_id, username, room.users[username].joined_at)
+        self._publish_event(room_id, 'join', username=username, joined_at=room.users[username].joined_at)
+        return True
     
     def leave_room(self, room_id: str, username: str):
         """离开房间"""
-        if room_id in self.rooms:
-            room = self.rooms[room_id]
+        room = self.get_room(room_id)
+        if room:
             room.remove_user(username)
+            if self.store:
+                self.store.remove_user(room_id, username)
+            self._publish_event(room_id, 'leave', username=username)
             
             # 如果房间为空，删除房间
             if not room.users:
-                del self.rooms[room_id]
+                self._close_room(room_id)
+    
+    def _close_room(self, room_id: str):
+        """删除房间，结束其推送连接（所有进程）"""
+        self._evict_room(room_id)
+        if self.store:
+            self.store.close_room(room_id)
+        self._publish_event(room_id, 'close')
+        self.bus.release(room_id)
+    
+    def _evict_room(self, room_id: str):
+        """只从本进程内存中移除房间，结束本进程的推送连接"""
+        room = self.rooms.pop(room_id, None)
+        if room:
+            room.close()
+    
+    def _publish_event(self, room_id: str, event_type: str, **fields):
+        """广播房间状态事件；本进程已经更新过，失败时其他进程会在重新加载房间后看到"""
+        try:
+            self.bus.publish_event(room_id, dict(fields, type=event_type, origin=self.bus.node_id))
+        except RoomBusError as e:
+            print(f"广播房间事件失败 ({room_id}, {event_type}): {e}")
+    
+    def _on_bus_event(self, room_id: str, seq: int, payload: Dict):
+        """处理总线投递的事件（包括本进程发出的消息）；只更新已在本进程内存中的房间"""
+        room = self.rooms.get(room_id)
+        if room is None:
+            return
+        event_type = payload.get('type')
+        if event_type == 'message':
+            message = RoomMessage(
+                sender=payload['sender'],
+                content=payload['content'],
+                message_type=payload['message_type'],
+                target_user=payload.get('target_user'),
+                timestamp=payload['timestamp']
+            )
+            room.add_message(message, seq=seq)
+            if message.sender in room.users:
+                room.update_user_activity(message.sender)
+            return
+        if payload.get('origin') == self.bus.node_id:
+            return
+        if event_type == 'join':
+            username = payload['username']
+            if username not in room.users and room.add_user(username, ''):
+                room.users[username].joined_at = payload.get('joined_at') or room.users[username].joined_at
+        elif event_type == 'leave':
+            room.remove_user(payload['username'])
+            if not room.users:
+                self._evict_room(room_id)
+        elif event_type == 'host_mode':
+            room.set_host_mode(payload['host_mode'])
+        elif event_type == 'close':
+            self._evict_room(room_id)
+    
+    def _on_bus_reset(self):
+        """订阅中断后本地房间可能漏掉了事件：全部移出内存，下次访问时从数据库重新加载
+        
+        推送连接随之结束，客户端带 Last-Event-ID 重连后从重新加载的房间继续
+        """
+        for room_id in list(self.rooms):
+            self._evict_room(room_id)
     
     def get_room(self, room_id: str) -> Optional[GameRoom]:
-        """获取房间"""
-        return self.rooms.get(room_id)
+        """获取房间（本进程内存中没有时从数据库恢复）"""
+        room = self.rooms.get(room_id)
+        if room or not self.store or not room_id:
+            return room
+        with self._lock:
+            room = self.rooms.get(room_id)
+            if room is None:
+                state = self.store.load_room(room_id)
+                if state:
+                    room = self.rooms[room_id] = GameRoom.restore(state)
+                    room.on_activity = self._record_activity
+                    self._schedule(room_id, time.time() + self.idle_timeout)
+            return room
+    
+    def set_host_mode(self, room_id: str, host_mode: str) -> bool:
+        """设置主持人模式"""
+        room = self.get_room(room_id)
+        if not room:
+            return False
+        room.set_host_mode(host_mode)
+        if self.store:
+            self.store.save_host_mode(room_id, host_mode)
+        self._publish_event(room_id, 'host_mode', host_mode=host_mode)
+        return True
     
     def send_message(self, room_id: str, sender: str, content: str, 
                     message_type: str = 'private', target_user: str = None) -> bool:
@@ -185,7 +570,6 @@ class RoomManager:
             return False
             
         message = RoomMessage(
-            id=str(uuid.uuid4()),
             sender=sender,
             content=content,
             message_type=message_type,
@@ -193,13 +577,30 @@ class RoomManager:
         )
         
         print(f"创建消息: {message.content}")
-        room.add_message(message)
+        # 由总线分配序号并投递给所有进程（包括本进程），各进程按相同顺序加入房间
+        try:
+            message.seq = self.bus.publish_message(room_id, {
+                'type': 'message',
+                'sender': message.sender,
+                'content': message.content,
+                'message_type': message.message_type,
+                'target_user': message.target_user,
+                'timestamp': message.timestamp
+            }, floor_seq=room.last_seq)
+        except RoomBusError as e:
+            print(f"错误: 房间消息广播失败: {e}")
+            return False
+        if self.store:
+            # 按批写入数据库（write-behind）
+            self.store.append_message(room_id, message, room.host_mode)
         room.update_user_activity(sender)
-        print(f"消息已添加到房间，当前消息数量: {len(room.messages)}")
+        print(f"消息已添加到房间，序号: {message.seq}")
         return True
     
     def get_room_list(self) -> List[Dict]:
         """获取房间列表"""
+        if self.store:
+            return self.store.list_active_rooms()
         return [
             {
                 'room_id': room_id,
@@ -211,18 +612,151 @@ class RoomManager:
             for room_id, room in self.rooms.items()
         ]
     
-    def cleanup_inactive_rooms(self):
-        """清理不活跃的房间"""
-        current_time = time.time()
-        rooms_to_delete = []
+    def _record_activity(self, room_id: str, username: str, timestamp: float):
+        """记录成员活动，下次清理时写入 room_users.last_active_at"""
+        with self._janitor_lock:
+            self._activity[(room_id, username)] = timestamp
+    
+    def _schedule(self, room_id: str, deadline: float):
+        """安排房间在 deadline 时检查一次"""
+        with self._janitor_lock:
+            self._deadlines[room_id] = deadline
+            heapq.heappush(self._expiry_heap, (deadline, room_id))
+    
+    def _pop_due(self, now: float) -> List[str]:
+        """取出所有到期的房间，丢弃过时的堆条目"""
+        due = []
+        with self._janitor_lock:
+            heap = self._expiry_heap
+            while heap and heap[0][0] <= now:
+                deadline, room_id = heapq.heappop(heap)
+                if self._deadlines.get(room_id) == deadline:
+                    del self._deadlines[room_id]
+                    due.append(room_id)
+            # 已删除房间的条目只在到期时才会被弹出，过多时整体重建一次
+            if len(heap) > 2 * len(self._deadlines) + 64:
+                self._expiry_heap = [(d, r) for r, d in self._deadlines.items()]
+                heapq.heapify(self._expiry_heap)
+        return due
+    
+    def cleanup_inactive_rooms(self, now: float = None) -> int:
+        """清理到期的不活跃用户和房间，返回删除的房间数
+        
+        没有推送连接、超过 idle_timeout 未活动的用户移出房间，房间空了随之删除；
+        仍有用户的房间按最早可能过期的用户重新安排检查时间。
+        有 store 时还会清理数据库中的房间（见 _sweep_store），覆盖不在本进程内存中的房间
+        """
+        started = time.perf_counter()
+        now = time.time() if now is None else now
+        due = self._pop_due(now)
+        expired_users = evicted = freed_messages = freed_bytes = 0
+        
+        for room_id in due:
+            room = self.rooms.get(room_id)
+            if room is None:
+                continue
+            idle = room.idle_users(now, self.idle_timeout)
+            if not room.users or len(idle) == len(room.users):
+                # 整个房间都不活跃：释放消息占用的内存
+                freed_messages += len(room.log)
+                freed_bytes += room.estimate_memory()
+                evicted += 1
+                if self.bus.distributed and room.users:
+                    # 其他进程上可能还有活跃连接，只释放本进程的内存，房间保留在数据库中
+                    self._evict_room(room_id)
+                    continue
+            if not self.bus.distributed:
+                for username in idle:
+                    self.leave_room(room_id, username)
+                    expired_users += 1
+            if room_id in self.rooms:
+                if not room.users:
+                    self._close_room(room_id)
+                    continue
+                next_expiry = room.next_expiry(self.idle_timeout)
+                self._schedule(room_id, max(next_expiry or now + self.idle_timeout, now + 1))
+        
+        expired_persisted = closed_persisted = 0
+        if self.store:
+            expired_persisted, closed_persisted = self._sweep_store(now)
+        
+        with self._janitor_lock:
+            stats = self._janitor_stats
+            stats['sweeps'] += 1
+            stats['expired_persisted_users'] += expired_persisted
+            stats['closed_persisted_rooms'] += closed_persisted
+            stats['checked_rooms'] += len(due)
+            stats['expired_users'] += expired_users
+            stats['evicted_rooms'] += evicted
+            stats['freed_messages'] += freed_messages
+            stats['freed_bytes'] += freed_bytes
+            stats['last_sweep_duration'] = time.perf_counter() - started
+            stats['last_sweep_at'] = datetime.fromtimestamp(now).isoformat()
+        return evicted + closed_persisted
+    
+    def _sweep_store(self, now: float) -> Tuple[int, int]:
+        """在数据库中清理不活跃的成员和空房间，返回 (删除的成员数, 关闭的房间数)
         
-        for room_id, room in self.rooms.items():
-            # 如果房间空了或者所有用户都超过5分钟不活跃，删除房间
-            if not room.users or all(
-                current_time - user.last_activity > 300 
-                for user in room.users.values()
-            ):
-                rooms_to_delete.append(room_id)
+        每个进程先写入上次清理以来有活动的成员（推送连接至少每个心跳间隔记一次活动），代价与活动的成员数成正比；
+        持有租约的进程再按 room_users.last_active_at 统一清理，并广播 leave / close 事件让其他进程更新内存。
+        重启前留下、没有任何进程加载过的房间也由这里关闭。过期判断多留一个清理间隔，等其他进程写完最近的活动
+        """
+        with self._janitor_lock:
+            activity, self._activity = self._activity, {}
+        try:
+            self.store.touch_users([(room_id, username, ts) for (room_id, username), ts in activity.items()])
+        except Exception:
+            # 写入失败时放回，下次清理重试（期间的新活动更晚，优先保留）
+            with self._janitor_lock:
+                for key, ts in activity.items():
+                    self._activity.setdefault(key, ts)
+            raise
         
-        for room_id in rooms_to_delete:
-            del self.rooms[room_id]
+        self._lease_held = self.store.acquire_lease(JANITOR_LEASE, self.bus.node_id, self.lease_ttl)
+        if not self._lease_held:
+            return 0, 0
+        expired, closed = self.store.expire_idle(now - self.idle_timeout - self.janitor_interval)
+        for room_id, username in expired:
+            room = self.rooms.get(room_id)
+            if room:
+                room.remove_user(username)
+            self._publish_event(room_id, 'leave', username=username)
+        for room_id in closed:
+            self._evict_room(room_id)
+            self._publish_event(room_id, 'close')
+            self.bus.release(room_id)
+        return len(expired), len(closed)
+    
+    def start_janitor(self, interval: float = ROOM_JANITOR_INTERVAL):
+        """启动后台清理线程"""
+        if self._janitor_thread and self._janitor_thread.is_alive():
+            return
+        self.janitor_interval = interval
+        self._janitor_stop.clear()
+        
+        def run():
+            while not self._janitor_stop.wait(interval):
+                try:
+                    self.cleanup_inactive_rooms()
+                except Exception as e:
+                    print(f"清理不活跃房间失败: {e}")
+        
+        self._janitor_thread = threading.Thread(target=run, name='room-janitor', daemon=True)
+        self._janitor_thread.start()
+        atexit.register(self.stop_janitor)
+    
+    def stop_janitor(self):
+        """停止后台清理线程"""
+        self._janitor_stop.set()
+    
+    def get_stats(self) -> Dict:
+        """获取房间和清理指标"""
+        with self._janitor_lock:
+            stats = dict(self._janitor_stats)
+            stats['scheduled_rooms'] = len(self._deadlines)
+            stats['heap_size'] = len(self._expiry_heap)
+            stats['pending_activity'] = len(self._activity)
+        stats['rooms_in_memory'] = len(self.rooms)
+        stats['idle_timeout'] = self.idle_timeout
+        stats['lease_held'] = self._lease_held
+        return stats
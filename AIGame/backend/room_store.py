@@ -0,0 +1,363 @@
+# -*- coding: utf-8 -*-
+"""
+房间状态持久化
+
+RoomManager 的内存房间以 rooms / room_users / room_messages 三张表为准，重启或换一个工作进程后可以恢复：
+- 创建房间、加入/离开、关闭房间这类低频操作同步写入
+- 消息先进入内存队列，由后台线程按批写入 room_messages（write-behind），
+  主持人模式随同一批写入；进程退出时写完剩余的消息
+- 房间第一次在本进程被访问时从数据库恢复成员和最近的消息（见 RoomManager.get_room）
+- 定期删除超过保留天数的消息，并把每个房间的消息压缩到最近 ROOM_MESSAGES_PER_ROOM 条
+- 成员的最近活动时间记在 room_users.last_active_at，持有租约的进程据此在数据库中删除不活跃的成员、
+  关闭空房间（包括重启前留下、没有任何进程加载过的房间）
+"""
+import atexit
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+from config import (ROOM_FLUSH_INTERVAL, ROOM_FLUSH_BATCH_SIZE, ROOM_PENDING_MAX_MESSAGES, ROOM_MESSAGE_RETENTION_DAYS,
+                    ROOM_MESSAGES_PER_ROOM, ROOM_COMPACT_INTERVAL, ROOM_MESSAGE_CAPACITY)
+
+# 清理旧消息时每批删除的行数（每批一个短事务）
+COMPACT_BATCH_SIZE = 1000
+
+
+class RoomStore:
+    """房间的数据库存储（线程安全）"""
+
+    def __init__(self, db, flush_interval: float = ROOM_FLUSH_INTERVAL,
+                 batch_size: int = ROOM_FLUSH_BATCH_SIZE, max_pending: int = ROOM_PENDING_MAX_MESSAGES):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending: List[tuple] = []  # 待写入的消息行
+        self._pending_modes: Dict[str, str] = {}  # room_id -> 最新的主持人模式
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._stats = {
+            'queued': 0,
+            'flushed': 0,
+            'flush_batches': 0,
+            'flush_errors': 0,
+            'dropped': 0,
+            'rehydrated': 0,
+            'compacted': 0,
+            'expired_users': 0,
+            'expired_rooms': 0,
+            'last_flush_at': None,
+            'last_compact_at': None
+        }
+
+    # ---------- 同步写入 ----------
+
+    def save_room(self, room):
+        """保存新房间"""
+        with self.db.game_pool.connection() as conn:
+            conn.execute('''
+                INSERT OR REPLACE INTO rooms (room_id, host, max_users, created_at, status, host_mode)
+                VALUES (?, ?, ?, ?, 'active', ?)
+            ''', (room.room_id, room.host_username, room.max_users,
+                  datetime.fromtimestamp(room.created_at).isoformat(), room.host_mode))
+            conn.commit()
+
+    def add_user(self, room_id: str, username: str, joined_at: float):
+        """记录房间成员；已是成员时保留加入时间，只刷新活动时间"""
+        with self.db.game_pool.connection() as conn:
+            conn.execute('''
+                INSERT INTO room_users (room_id, username, joined_at, last_active_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT (room_id, username) DO UPDATE SET last_active_at = excluded.last_active_at
+            ''', (room_id, username, datetime.fromtimestamp(joined_at).isoformat(), datetime.now().isoformat()))
+            conn.commit()
+
+    def remove_user(self, room_id: str, username: str):
+        """删除房间成员"""
+        with self.db.game_pool.connection() as conn:
+            conn.execute('DELETE FROM room_users WHERE room_id = ? AND username = ?', (room_id, username))
+            conn.commit()
+
+    def save_host_mode(self, room_id: str, host_mode: str):
+        """保存主持人模式"""
+        with self._lock:
+            self._pending_modes.pop(room_id, None)
+        with self.db.game_pool.connection() as conn:
+            conn.execute('UPDATE rooms SET host_mode = ? WHERE room_id = ?', (host_mode, room_id))
+            conn.commit()
+
+    def close_room(self, room_id: str):
+        """关闭房间：先写完该房间待写入的消息，再标记关闭并清空成员"""
+        self.flush()
+        with self.db.game_pool.connection() as conn:
+            conn.execute("UPDATE rooms SET status = 'closed' WHERE room_id = ?", (room_id,))
+            conn.execute('DELETE FROM room_users WHERE room_id = ?', (room_id,))
+            conn.commit()
+
+    def touch_users(self, activity: List[Tuple[str, str, float]]):
+        """记录成员的最近活动时间 [(room_id, username, 时间戳)]，只会往后推（多个进程各自上报时取最新的）"""
+        if not activity:
+            return
+        with self.db.game_pool.connection() as conn:
+            conn.executemany('''
+                UPDATE room_users SET last_active_at = MAX(COALESCE(last_active_at, ''), ?)
+                WHERE room_id = ? AND username = ?
+            ''', [(datetime.fromtimestamp(ts).isoformat(), room_id, username) for room_id, username, ts in activity])
+            conn.commit()
+
+    def acquire_lease(self, name: str, holder: str, ttl: float) -> bool:
+        """获取或续约名为 name 的租约，返回本进程是否持有（同一时间只有一个持有者）"""
+        now = time.time()
+        with self.db.game_pool.connection() as conn:
+            conn.execute('''
+                INSERT INTO maintenance_leases (name, holder, expires_at) VALUES (?, ?, ?)
+                ON CONFLICT (name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at
+                WHERE maintenance_leases.holder = excluded.holder OR maintenance_leases.expires_at < ?
+            ''', (name, holder, now + ttl, now))
+            conn.commit()
+            row = conn.execute('SELECT holder FROM maintenance_leases WHERE name = ?', (name,)).fetchone()
+        return bool(row) and row[0] == holder
+
+    def expire_idle(self, idle_before: float) -> Tuple[List[Tuple[str, str]], List[str]]:
+        """删除最近活动早于 idle_before 的成员，关闭没有成员且创建早于 idle_before 的房间
+
+        在一个事务中完成，返回 (删除的 (room_id, username) 列表, 关闭的房间ID列表)
+        """
+        self.flush()
+        cutoff = datetime.fromtimestamp(idle_before).isoformat()
+        with self.db.game_pool.connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                expired = conn.execute('''
+                    SELECT u.room_id, u.username FROM room_users u
+                    JOIN rooms r ON r.room_id = u.room_id
+                    WHERE r.status = 'active' AND u.last_active_at < ?
+                ''', (cutoff,)).fetchall()
+                conn.executemany(
+                    'DELETE FROM room_users WHERE room_id = ? AND username = ?', expired
+                )
+                closed = [row[0] for row in conn.execute('''
+                    SELECT room_id FROM rooms r
+                    WHERE status = 'active' AND created_at < ?
+                        AND NOT EXISTS (SELECT 1 FROM room_users u WHERE u.room_id = r.room_id)
+                ''', (cutoff,)).fetchall()]
+                conn.executemany(
+                    "UPDATE rooms SET status = 'closed' WHERE room_id = ?", [(room_id,) for room_id in closed]
+                )
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        with self._lock:
+            self._stats['expired_users'] += len(expired)
+            self._stats['expired_rooms'] += len(closed)
+        return [tuple(row) for row in expired], closed
+
+    # ---------- 消息 write-behind ----------
+
+    def append_message(self, room_id: str, message, host_mode: str = None):
+        """把消息加入待写入队列"""
+        with self._lock:
+            self._pending.append((
+                room_id, message.seq, message.sender, message.content,
+                message.message_type, message.target_user, message.timestamp
+            ))
+            if host_mode is not None:
+                self._pending_modes[room_id] = host_mode
+            self._stats['queued'] += 1
+            self._trim_pending()
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self._wakeup.set()
+
+    def flush(self) -> int:
+        """把待写入的消息和主持人模式在一个事务中写入，返回写入的消息数"""
+        with self._flush_lock:
+            with self._lock:
+                rows, self._pending = self._pending, []
+                modes, self._pending_modes = self._pending_modes, {}
+            if not rows and not modes:
+                return 0
+
+            try:
+                with self.db.game_pool.connection() as conn:
+                    conn.executemany('''
+                        INSERT INTO room_messages
+                            (room_id, seq, sender, content, message_type, target_user, timestamp)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ''', rows)
+                    conn.executemany(
+                        'UPDATE rooms SET host_mode = ? WHERE room_id = ?',
+                        [(mode, room_id) for room_id, mode in modes.items()]
+                    )
+                    conn.commit()
+            except Exception:
+                # 写入失败时放回队列，下次重试
+                with self._lock:
+                    self._pending[:0] = rows
+                    for room_id, mode in modes.items():
+                        self._pending_modes.setdefault(room_id, mode)
+                    self._stats['flush_errors'] += 1
+                    self._trim_pending()
+                raise
+
+            with self._lock:
+                self._stats['flushed'] += len(rows)
+                self._stats['flush_batches'] += 1
+                self._stats['last_flush_at'] = datetime.now().isoformat()
+            return len(rows)
+
+    def _trim_pending(self):
+        """数据库持续不可写时积压有上限，超出部分丢弃最旧的消息，计入 dropped（调用方需持有锁）"""
+        overflow = len(self._pending) - self.max_pending
+        if overflow > 0:
+            del self._pending[:overflow]
+            self._stats['dropped'] += overflow
+
+    # ---------- 读取 ----------
+
+    def load_room(self, room_id: str, message_limit: int = ROOM_MESSAGE_CAPACITY) -> Optional[Dict[str, Any]]:
+        """读取一个未关闭房间的状态：房间行、成员和最近的消息（按序号正序），不存在时返回None"""
+        with self.db.game_pool.connection() as conn:
+            room = conn.execute('''
+                SELECT room_id, host, max_users, created_at, host_mode FROM rooms
+                WHERE room_id = ? AND status = 'active'
+            ''', (room_id,)).fetchone()
+            if not room:
+                return None
+            users = conn.execute(
+                'SELECT username, joined_at FROM room_users WHERE room_id = ? ORDER BY id', (room_id,)
+            ).fetchall()
+            messages = conn.execute('''
+                SELECT seq, sender, content, message_type, target_user, timestamp
+                FROM room_messages WHERE room_id = ? ORDER BY seq DESC LIMIT ?
+            ''', (room_id, message_limit)).fetchall()
+
+        with self._lock:
+            self._stats['rehydrated'] += 1
+        return {
+            'room_id': room[0],
+            'host': room[1],
+            'max_users': room[2],
+            'created_at': datetime.fromisoformat(room[3]).timestamp(),
+            'host_mode': room[4],
+            'users': [(username, datetime.fromisoformat(joined_at).timestamp()) for username, joined_at in users],
+            'messages': list(reversed(messages))
+        }
+
+    def list_active_rooms(self) -> List[Dict[str, Any]]:
+        """所有未关闭的房间及其人数"""
+        with self.db.game_pool.connection() as conn:
+            rows = conn.execute('''
+                SELECT r.room_id, r.host, r.max_users, r.created_at, COUNT(u.id)
+                FROM rooms r LEFT JOIN room_users u ON u.room_id = r.room_id
+                WHERE r.status = 'active'
+                GROUP BY r.room_id
+                ORDER BY r.created_at
+            ''').fetchall()
+        return [
+            {
+                'room_id': room_id,
+                'host': host,
+                'user_count': user_count,
+                'max_users': max_users,
+                'created_at': datetime.fromisoformat(created_at).timestamp()
+            }
+            for room_id, host, max_users, created_at, user_count in rows
+        ]
+
+    # ---------- 保留与压缩 ----------
+
+    def compact(self, retention_days: float = ROOM_MESSAGE_RETENTION_DAYS,
+                per_room: int = ROOM_MESSAGES_PER_ROOM) -> int:
+        """分批删除过期消息和每个房间超出保留条数的旧消息，返回删除的条数"""
+        cutoff = time.time() - retention_days * 86400
+        total = 0
+        while True:
+            with self.db.game_pool.connection() as conn:
+                deleted = conn.execute('''
+                    DELETE FROM room_messages WHERE id IN (
+                        SELECT id FROM room_messages WHERE timestamp < ? LIMIT ?
+                    )
+                ''', (cutoff, COMPACT_BATCH_SIZE)).rowcount
+                conn.commit()
+            total += deleted
+            if deleted < COMPACT_BATCH_SIZE:
+                break
+
+        while True:
+            with self.db.game_pool.connection() as conn:
+                deleted = conn.execute('''
+                    DELETE FROM room_messages WHERE id IN (
+                        SELECT m.id FROM room_messages m
+                        JOIN (SELECT room_id, MAX(seq) AS max_seq FROM room_messages GROUP BY room_id) latest
+                            ON latest.room_id = m.room_id
+                        WHERE m.seq <= latest.max_seq - ?
+                        LIMIT ?
+                    )
+                ''', (per_room, COMPACT_BATCH_SIZE)).rowcount
+                conn.commit()
+            total += deleted
+            if deleted < COMPACT_BATCH_SIZE:
+                break
+
+        with self._lock:
+            self._stats['compacted'] += total
+            self._stats['last_compact_at'] = datetime.now().isoformat()
+        return total
+
+    # ---------- 后台线程 ----------
+
+    def start_background(self, compact_interval: float = ROOM_COMPACT_INTERVAL):
+        """启动后台线程：按批写入消息，定期清理旧消息"""
+        if self._thread and self._thread.is_alive():
+            return
+
+        # room_messages.seq 等列由迁移 v6 添加，线程启动前确保迁移已执行
+        self.db.ensure_game_schema()
+        self._stop.clear()
+
+        def run():
+            next_compact = time.monotonic()
+            while not self._stop.is_set():
+                self._wakeup.wait(self.flush_interval)
+                self._wakeup.clear()
+                try:
+                    self.flush()
+                    if compact_interval and time.monotonic() >= next_compact:
+                        compacted = self.compact()
+                        if compacted:
+                            print(f"🧹 已清理 {compacted} 条旧房间消息")
+                        next_compact = time.monotonic() + compact_interval
+                except Exception as e:
+                    print(f"❌ 房间消息写入线程出错: {e}")
+
+        self._thread = threading.Thread(target=run, name='room-writer', daemon=True)
+        self._thread.start()
+        # 进程退出时写完剩余的消息
+        atexit.register(self.stop_background)
+
+    def stop_background(self):
+        """停止后台线程并写完剩余的消息"""
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"❌ 写入剩余房间消息失败: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取持久化指标"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({
+                'pending': len(self._pending),
+                'running': bool(self._thread and self._thread.is_alive())
+            })
+            return stats
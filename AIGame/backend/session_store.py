@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+会话存储
+
+require_auth 每个请求都要验证会话令牌，这里在 user_sessions 表前面加一层内存缓存：
+- 有效令牌按 LRU 缓存，缓存时间不超过 SESSION_CACHE_TTL，也不超过会话本身的过期时间
+- 不存在/已过期的令牌做负缓存，重复使用无效令牌不会反复查库
+- 登出时写入 session_revocations 表，其他工作进程的后台线程轮询该表并清除本地缓存
+- 后台线程定期分批删除过期会话，避免 user_sessions 表无限增长
+"""
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, Any, Optional, Tuple
+from config import (SESSION_LIFETIME_HOURS, SESSION_CACHE_TTL, SESSION_CACHE_SIZE,
+                    SESSION_NEGATIVE_TTL, SESSION_REVOCATION_POLL_INTERVAL,
+                    SESSION_SWEEP_INTERVAL, SESSION_SWEEP_BATCH_SIZE)
+
+# 吊销记录保留时间（秒），远大于轮询间隔即可
+REVOCATION_RETENTION = 3600
+
+
+class SessionStore:
+    """带内存缓存的会话令牌存储（线程安全）"""
+
+    def __init__(self, db, cache_ttl: float = SESSION_CACHE_TTL, cache_size: int = SESSION_CACHE_SIZE,
+                 negative_ttl: float = SESSION_NEGATIVE_TTL):
+        self.db = db
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self.negative_ttl = negative_ttl
+
+        self._lock = threading.Lock()
+        self._valid = OrderedDict()  # token -> (username, 会话过期时间戳, 缓存过期时间戳)
+        self._invalid = OrderedDict()  # token -> 负缓存过期时间戳
+        self._last_revocation_id = None
+
+        self._lookup = db.prepare("SELECT username, expires_at FROM user_sessions WHERE session_token = ?")
+        self._insert = db.prepare(
+            "INSERT INTO user_sessions (username, session_token, created_at, expires_at) VALUES (?, ?, ?, ?)"
+        )
+
+        self._thread = None
+        self._stop = threading.Event()
+        self._stats = {
+            'hits': 0,
+            'negative_hits': 0,
+            'misses': 0,
+            'revocations_applied': 0,
+            'swept': 0,
+            'last_sweep_at': None
+        }
+
+    def create(self, username: str) -> str:
+        """创建会话，返回令牌"""
+        session_token = secrets.token_urlsafe(32)
+        created_at = datetime.now()
+        expires_at = created_at + timedelta(hours=SESSION_LIFETIME_HOURS)
+
+        self.db.execute_query(
+            self._insert,
+            (username, session_token, created_at.isoformat(), expires_at.isoformat())
+        )
+
+        with self._lock:
+            self._invalid.pop(session_token, None)
+            self._cache_valid(session_token, username, expires_at.timestamp())
+        return session_token
+
+    def validate(self, session_token: str) -> Tuple[bool, Optional[str]]:
+        """验证令牌，返回 (是否有效, 用户名)；命中缓存时不访问数据库"""
+        now = time.time()
+        with self._lock:
+            entry = self._valid.get(session_token)
+            if entry is not None:
+                username, expires_at, cached_until = entry
+                if now < cached_until:
+                    self._valid.move_to_end(session_token)
+                    self._stats['hits'] += 1
+                    return True, username
+                del self._valid[session_token]
+
+            invalid_until = self._invalid.get(session_token)
+            if invalid_until is not None:
+                if now < invalid_until:
+                    self._stats['negative_hits'] += 1
+                    return False, None
+                del self._invalid[session_token]
+
+            self._stats['misses'] += 1
+
+        session = self.db.execute_query(self._lookup, (session_token,), fetch_one=True)
+        if session:
+            expires_at = datetime.fromisoformat(session['expires_at']).timestamp()
+            if now < expires_at:
+                with self._lock:
+                    self._cache_valid(session_token, session['username'], expires_at)
+                return True, session['username']
+            # 过期会话由后台清理线程分批删除
+
+        with self._lock:
+            self._cache_invalid(session_token, now)
+        return False, None
+
+    def revoke(self, session_token: str):
+        """登出：删除会话并通知其他工作进程"""
+        now = datetime.now().isoformat()
+        with self.db.game_pool.connection() as conn:
+            conn.execute('DELETE FROM user_sessions WHERE session_token = ?', (session_token,))
+            conn.execute(
+                'INSERT INTO session_revocations (session_token, revoked_at) VALUES (?, ?)',
+                (session_token, now)
+            )
+            conn.commit()
+
+        with self._lock:
+            self._valid.pop(session_token, None)
+            self._cache_invalid(session_token, time.time())
+
+    def _cache_valid(self, session_token, username, expires_at):
+        """缓存有效令牌（调用方需持有锁）"""
+        if not self.cache_ttl:
+            return
+        cached_until = min(expires_at, time.time() + self.cache_ttl)
+        self._valid[session_token] = (username, expires_at, cached_until)
+        self._valid.move_to_end(session_token)
+        while len(self._valid) > self.cache_size:
+            self._valid.popitem(last=False)
+
+    def _cache_invalid(self, session_token, now):
+        """负缓存无效令牌（调用方需持有锁）"""
+        if not self.negative_ttl:
+            return
+        self._invalid[session_token] = now + self.negative_ttl
+        self._invalid.move_to_end(session_token)
+        while len(self._invalid) > self.cache_size:
+            self._invalid.popitem(last=False)
+
+    def apply_revocations(self) -> int:
+        """拉取其他工作进程的登出记录并清除本地缓存，返回处理的条数"""
+        with self.db.game_pool.connection() as conn:
+            if self._last_revocation_id is None:
+                # 启动时本地缓存为空，只需从当前位置开始跟踪
+                self._last_revocation_id = conn.execute(
+                    'SELECT COALESCE(MAX(id), 0) FROM session_revocations'
+                ).fetchone()[0]
+                return 0
+            rows = conn.execute(
+                'SELECT id, session_token FROM session_revocations WHERE id > ? ORDER BY id',
+                (self._last_revocation_id,)
+            ).fetchall()
+
+        if not rows:
+            return 0
+        now = time.time()
+        with self._lock:
+            for revocation_id, session_token in rows:
+                if self._valid.pop(session_token, None) is not None:
+                    self._cache_invalid(session_token, now)
+            self._stats['revocations_applied'] += len(rows)
+        self._last_revocation_id = rows[-1][0]
+        return len(rows)
+
+    def sweep_expired(self, batch_size: int = SESSION_SWEEP_BATCH_SIZE) -> int:
+        """分批删除过期会话和旧的吊销记录，每批一个短事务，返回删除的会话数"""
+        now = datetime.now()
+        cutoff = now.isoformat()
+        total = 0
+        while True:
+            with self.db.game_pool.connection() as conn:
+                deleted = conn.execute('''
+                    DELETE FROM user_sessions WHERE id IN (
+                        SELECT id FROM user_sessions WHERE expires_at < ? LIMIT ?
+                    )
+                ''', (cutoff, batch_size)).rowcount
+                conn.commit()
+            total += deleted
+            if deleted < batch_size:
+                break
+
+        with self.db.game_pool.connection() as conn:
+            conn.execute(
+                'DELETE FROM session_revocations WHERE revoked_at < ?',
+                ((now - timedelta(seconds=REVOCATION_RETENTION)).isoformat(),)
+            )
+            conn.commit()
+
+        with self._lock:
+            self._stats['swept'] += total
+            self._stats['last_sweep_at'] = cutoff
+        return total
+
+    def start_background(self, poll_interval: float = SESSION_REVOCATION_POLL_INTERVAL,
+                         sweep_interval: float = SESSION_SWEEP_INTERVAL):
+        """启动后台线程：轮询吊销记录，定期清理过期会话"""
+        if self._thread and self._thread.is_alive():
+            return
+
+        # session_revocations 表由迁移 v4 创建，线程启动前确保迁移已执行
+        self.db.ensure_game_schema()
+        self._stop.clear()
+
+        def run():
+            next_sweep = time.monotonic()
+            while True:
+                try:
+                    self.apply_revocations()
+                    if sweep_interval and time.monotonic() >= next_sweep:
+                        swept = self.sweep_expired()
+                        if swept:
+                            print(f"🧹 已清理 {swept} 个过期会话")
+                        next_sweep = time.monotonic() + sweep_interval
+                except Exception as e:
+                    print(f"❌ 会话后台线程出错: {e}")
+                if self._stop.wait(poll_interval):
+                    break
+
+        self._thread = threading.Thread(target=run, name='session-sweeper', daemon=True)
+        self._thread.start()
+
+    def stop_background(self):
+        """停止后台线程"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取会话缓存指标"""
+        with self._lock:
+            stats = dict(self._stats)
+            lookups = stats['hits'] + stats['negative_hits'] + stats['misses']
+            stats.update({
+                'cached': len(self._valid),
+                'negative_cached': len(self._invalid),
+                'hit_rate': (stats['hits'] + stats['negative_hits']) / lookups if lookups else 0.0,
+                'running': bool(self._thread and self._thread.is_alive())
+            })
+            return stats
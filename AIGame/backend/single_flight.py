@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+请求合并（single-flight）
+
+同一个键同时只执行一次：第一个到达的请求（领头请求）真正执行，
+在它完成前到达的相同请求只等待并共享它的结果或异常，不会重复调用上游。
+用于LLM回复缓存未命中时，避免多个房间同时发送相同的互动而重复付费。
+"""
+import threading
+from typing import Any, Callable, Dict
+
+
+class _Flight:
+    """一次正在执行的调用"""
+    __slots__ = ('event', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """按键合并并发调用（线程安全）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights: Dict[str, _Flight] = {}
+        self._stats = {
+            'calls': 0,
+            'executed': 0,
+            'coalesced': 0,
+            'errors': 0,
+            'max_waiters': 0
+        }
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        """执行 fn()，若相同的 key 正在执行则等待并返回它的结果"""
+        with self._lock:
+            self._stats['calls'] += 1
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight.waiters += 1
+                self._stats['coalesced'] += 1
+                if flight.waiters > self._stats['max_waiters']:
+                    self._stats['max_waiters'] = flight.waiters
+                leader = False
+            else:
+                flight = self._flights[key] = _Flight()
+                self._stats['executed'] += 1
+                leader = True
+
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = fn()
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            with self._lock:
+                self._stats['errors'] += 1
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.event.set()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取合并指标"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({
+                'in_flight': len(self._flights),
+                'coalesce_rate': stats['coalesced'] / stats['calls'] if stats['calls'] else 0.0
+            })
+            return stats
@@ -1,15 +1,201 @@
 # -*- coding: utf-8 -*-
+import copy
 import hashlib
-from datetime import datetime, timedelta
-import secrets
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
 from database import DatabaseManager
 from database_separation import db_separation_manager
 from models.config_manager import config_manager
+from models.player import Player, PLAYER_AGGREGATE_SQL, PLAYER_COLUMNS, compute_equipment_stats
+from config import PLAYER_CACHE_TTL, PLAYER_CACHE_SIZE
+from session_store import SessionStore
+
+# 热路径上的预解析语句
+PLAYER_LOOKUP = db_separation_manager.prepare(PLAYER_AGGREGATE_SQL)
+
+class PlayerWriteError(Exception):
+    """请求结束时写回玩家数据失败"""
+
+
+class PlayerCache:
+    """跨请求的玩家聚合缓存（LRU + 短TTL），玩家被写入时失效"""
+
+    def __init__(self, ttl=PLAYER_CACHE_TTL, max_size=PLAYER_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()  # username -> (Player, 过期时间)
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+    def get(self, username):
+        """取出缓存的玩家副本，未命中或已过期返回None"""
+        if not self.ttl:
+            return None
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is None or entry[1] < time.monotonic():
+                self._entries.pop(username, None)
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(username)
+            self._stats['hits'] += 1
+            player = entry[0]
+        # 调用方会修改返回的对象，缓存里始终保留干净的副本
+        return copy.deepcopy(player)
+
+    def put(self, player):
+        """缓存从数据库加载的玩家"""
+        if not self.ttl:
+            return
+        player = copy.deepcopy(player)
+        with self._lock:
+            self._entries[player.username] = (player, time.monotonic() + self.ttl)
+            self._entries.move_to_end(player.username)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, username):
+        """玩家数据被写入后调用"""
+        with self._lock:
+            if self._entries.pop(username, None) is not None:
+                self._stats['invalidations'] += 1
+
+    def clear(self):
+        """清空缓存（例如物品配置热重载后）"""
+        with self._lock:
+            self._stats['invalidations'] += len(self._entries)
+            self._entries.clear()
+
+    def get_stats(self):
+        """获取缓存指标"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({'size': len(self._entries), 'max_size': self.max_size, 'ttl': self.ttl})
+            return stats
+
+
+class PlayerUnitOfWork:
+    """一个请求内的玩家身份映射
+
+    同一玩家在一个工作单元内只加载一次，所有修改作用在同一个 Player 上；
+    结束时与加载时的状态比较，只把变化的列和行在一个事务中写回。
+    """
+
+    def __init__(self, manager):
+        self.manager = manager
+        self._players = {}  # username -> Player
+        self._original = {}  # username -> 加载/上次写回时的 Player.state()
+
+    def get(self, username):
+        """获取玩家，不存在时返回None"""
+        player = self._players.get(username)
+        if player is None:
+            player = self.manager._fetch_player(username)
+            if player is None:
+                return None
+            self._players[username] = player
+            self._original[username] = player.state()
+        return player
+
+    def flush(self):
+        """在一个事务中写回所有脏数据，返回写回的玩家数"""
+        changes = []
+        for username, player in self._players.items():
+            original = self._original[username]
+            current = player.state()
+            if current != original:
+                changes.append((username, player, original, current))
+        if not changes:
+            return 0
+
+        now = datetime.now().isoformat()
+        try:
+            with self.manager.db.game_pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('BEGIN IMMEDIATE')
+                for username, player, original, current in changes:
+                    _write_player_changes(cursor, username, original, current, now)
+                conn.commit()
+        except sqlite3.Error as e:
+            raise PlayerWriteError(str(e)) from e
+
+        for username, player, original, current in changes:
+            player.last_updated = now
+            self._original[username] = current
+            self.manager.player_cache.invalidate(username)
+        self.manager._stats['flushes'] += 1
+        self.manager._stats['flushed_players'] += len(changes)
+        return len(changes)
+
+
+def _write_player_changes(cursor, username, original, current, now):
+    """写回一个玩家发生变化的列和行"""
+    old_columns, old_inventory, old_equipment = original
+    columns, inventory, equipment = current
+
+    # 数值列按增量写回：加载来源可能是稍旧的缓存，其他工作进程同时修改同一玩家（例如金币、HP）时也不会丢失对方的修改
+    assignments = []
+    values = []
+    for column in PLAYER_COLUMNS:
+        old_value, value = old_columns[column], columns[column]
+        if value == old_value:
+            continue
+        if isinstance(value, int) and isinstance(old_value, int):
+            assignments.append(f"{column} = {column} + ?")
+            values.append(value - old_value)
+        else:
+            assignments.append(f"{column} = ?")
+            values.append(value)
+    if assignments:
+        cursor.execute(
+            f"UPDATE user_data SET {', '.join(assignments)}, last_updated = ? WHERE username = ?",
+            values + [now, username]
+        )
+
+    # 背包按增量写回，不覆盖同一时间其他请求（例如购买）对数量的修改
+    deltas = []
+    for item_id in set(old_inventory) | set(inventory):
+        delta = inventory.get(item_id, 0) - old_inventory.get(item_id, 0)
+        if delta:
+            deltas.append((username, item_id, delta, now))
+    if deltas:
+        cursor.executemany('''
+            INSERT INTO user_inventory (username, item_id, quantity, acquired_at)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(username, item_id) DO UPDATE SET quantity = quantity + excluded.quantity
+        ''', deltas)
+        cursor.execute(
+            "DELETE FROM user_inventory WHERE username = ? AND quantity <= 0",
+            (username,)
+        )
+
+    slots = [
+        (username, slot, item_id, equipped_at)
+        for slot, (item_id, equipped_at) in equipment.items()
+        if old_equipment.get(slot) != (item_id, equipped_at)
+    ]
+    if slots:
+        cursor.executemany('''
+            INSERT INTO user_equipment (username, slot, item_id, equipped_at)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(username, slot) DO UPDATE SET
+            item_id = excluded.item_id,
+            equipped_at = excluded.equipped_at
+        ''', slots)
 
 
 class UserManager:
     def __init__(self):
         self.db = db_separation_manager
+        self.player_cache = PlayerCache()
+        self.sessions = SessionStore(self.db)
+        self._local = threading.local()
+        self._stats = {'flushes': 0, 'flushed_players': 0, 'loads': 0}
 
     def register_user(self, username, password):
         """用户注册"""
@@ -72,37 +258,15 @@ class UserManager:
 
     def create_session(self, username):
         """创建用户会话"""
-        session_token = secrets.token_urlsafe(32)
-        created_at = datetime.now()
-        expires_at = created_at + timedelta(hours=24)  # 24小时后过期
-        
-        self.db.execute_query(
-            "INSERT INTO user_sessions (username, session_token, created_at, expires_at) VALUES (?, ?, ?, ?)",
-            (username, session_token, created_at.isoformat(), expires_at.isoformat())
-        )
-        
-        return session_token
+        return self.sessions.create(username)
 
     def validate_session(self, session_token):
-        """验证会话令牌"""
-        session = self.db.execute_query(
-            "SELECT username, expires_at FROM user_sessions WHERE session_token = ?",
-            (session_token,), fetch_one=True
-        )
-        
-        if not session:
-            return False, None
-        
-        expires_at = datetime.fromisoformat(session['expires_at'])
-        if datetime.now() > expires_at:
-            # 删除过期会话
-            self.db.execute_query(
-                "DELETE FROM user_sessions WHERE session_token = ?",
-                (session_token,)
-            )
-            return False, None
-        
-        return True, session['username']
+        """验证会话令牌（优先命中内存缓存，过期会话由后台线程清理）"""
+        return self.sessions.validate(session_token)
+
+    def logout(self, session_token):
+        """登出：删除会话令牌，并让所有工作进程的会话缓存失效"""
+        self.sessions.revoke(session_token)
 
     def create_user_data(self, username):
         """创建用户数据"""
@@ -130,159 +294,111 @@ class UserManager:
         
         return self.get_user_data(username)
 
+    @contextmanager
+    def unit_of_work(self):
+        """玩家数据的工作单元，同一线程内嵌套使用时复用最外层；正常退出时写回脏数据"""
+        uow = getattr(self._local, 'uow', None)
+        if uow is not None:
+            yield uow
+            return
+
+        uow = PlayerUnitOfWork(self)
+        self._local.uow = uow
+        try:
+            yield uow
+            uow.flush()
+        finally:
+            self._local.uow = None
+
+    def _fetch_player(self, username):
+        """从缓存或数据库加载玩家（一次查询），返回可修改的新对象"""
+        player = self.player_cache.get(username)
+        if player is not None:
+            return player
+
+        row = self.db.execute_query(PLAYER_LOOKUP, (username,), fetch_one=True)
+        if not row:
+            return None
+        player = Player.from_row(row, config_manager.get_item_by_id)
+        self._stats['loads'] += 1
+        self.player_cache.put(player)
+        return player
+
+    def load_player(self, username):
+        """加载玩家聚合（基础数据+背包+装备），用户不存在时返回None
+
+        在工作单元内返回身份映射中的同一个对象，对它的修改会在工作单元结束时写回
+        """
+        uow = getattr(self._local, 'uow', None)
+        if uow is not None:
+            return uow.get(username)
+        return self._fetch_player(username)
+
+    def invalidate_player(self, username):
+        """绕过UserManager直接修改玩家数据后调用（例如购买）"""
+        self.player_cache.invalidate(username)
+
+    def get_player_stats(self):
+        """获取玩家缓存与写回指标"""
+        stats = dict(self._stats)
+        stats['cache'] = self.player_cache.get_stats()
+        return stats
+
+    def recompute_equipment_stats(self, only_missing=False):
+        """按当前物品配置重新计算并保存玩家的装备属性加成（平衡性调整、物品配置热重载后调用）
+
+        only_missing: 只处理尚未物化的玩家（升级数据库后补算）
+        返回更新的玩家数
+        """
+        query = '''
+            SELECT d.username, e.item_id
+            FROM user_data d
+            LEFT JOIN user_equipment e ON e.username = d.username AND e.item_id IS NOT NULL
+        '''
+        if only_missing:
+            query += ' WHERE d.equipment_stats IS NULL'
+        
+        with self.db.game_pool.connection() as conn:
+            equipped = {}
+            for username, item_id in conn.execute(query):
+                item_ids = equipped.setdefault(username, [])
+                if item_id:
+                    item_ids.append(item_id)
+            
+            rows = [
+                (json.dumps(compute_equipment_stats(map(config_manager.get_item_by_id, item_ids)), sort_keys=True),
+                 username)
+                for username, item_ids in equipped.items()
+            ]
+            if rows:
+                conn.execute('BEGIN IMMEDIATE')
+                conn.executemany('UPDATE user_data SET equipment_stats = ? WHERE username = ?', rows)
+                conn.commit()
+        
+        self.player_cache.clear()
+        return len(rows)
+
     def get_user_data(self, username):
         """获取用户数据"""
         try:
-            # 获取基础用户数据
-            user_data = self.db.execute_query(
-                "SELECT * FROM user_data WHERE username = ?",
-                (username,), fetch_one=True
-            )
+            player = self.load_player(username)
             
-            if not user_data:
+            if not player:
                 return self.create_user_data(username)
             
-            # 获取背包数据
-            inventory_items = self.db.execute_query(
-                "SELECT item_id, quantity FROM user_inventory WHERE username = ?",
-                (username,), fetch_all=True
-            )
-            
-            # 获取装备数据
-            equipment_items = self.db.execute_query(
-                "SELECT slot, item_id, equipped_at FROM user_equipment WHERE username = ?",
-                (username,), fetch_all=True
-            )
-            
-            # 组装完整用户数据
-            inventory_with_details = []
-            for item in inventory_items:
-                item_config = config_manager.get_item_by_id(item['item_id'])
-                if item_config:
-                    inventory_with_details.append({
-                        "id": item['item_id'],
-                        "name": item_config.get('item_name', item['item_id']),
-                        "description": item_config.get('description', ''),
-                        "type": item_config.get('item_type', ''),
-                        "rarity": item_config.get('rarity', 'common'),
-                        "quantity": item['quantity']
-                    })
-                else:
-                    # 如果配置中找不到物品，使用默认值
-                    inventory_with_details.append({
-                        "id": item['item_id'],
-                        "name": item['item_id'],
-                        "description": '未知物品',
-                        "type": 'unknown',
-                        "rarity": 'common',
-                        "quantity": item['quantity']
-                    })
-            
-            # 计算装备属性加成
-            equipment_stats = {
-                'attack': 0,
-                'defense': 0,
-                'hp': 0,
-                'mp': 0,
-                'critical_rate': 0,
-                'critical_damage': 0
-            }
-            
-            # 遍历装备计算总加成
-            for equipment in equipment_items:
-                if equipment['item_id']:
-                    item_config = config_manager.get_item_by_id(equipment['item_id'])
-                    if item_config and 'stats' in item_config:
-                        stats = item_config['stats']
-                        for stat, value in stats.items():
-                            if stat in equipment_stats:
-                                equipment_stats[stat] += value
-
-            # 计算总的最大值（基础值 + 装备加成）
-            total_max_hp = user_data.get('max_hp', 100) + equipment_stats['hp']
-            total_max_mp = user_data.get('max_mp', 50) + equipment_stats['mp']
-            
-            # 确保当前血量和魔法值不超过最大值
-            current_hp = min(user_data['hp'], total_max_hp)
-            current_mp = min(user_data['mp'], total_max_mp)
-
-            result = {
-                "username": user_data['username'],
-                "HP": current_hp,
-                "MP": current_mp,
-                "max_HP": total_max_hp,
-                "max_MP": total_max_mp,
-                "base_max_HP": user_data.get('max_hp', 100),
-                "base_max_MP": user_data.get('max_mp', 50),
-                "gold": user_data['gold'],
-                "experience": user_data.get('experience', 0),
-                "level": user_data.get('level', 1),
-                "attack": user_data.get('attack', 10) + equipment_stats['attack'],
-                "defense": user_data.get('defense', 5) + equipment_stats['defense'],
-                "critical_rate": user_data.get('critical_rate', 5) + equipment_stats['critical_rate'],
-                "critical_damage": user_data.get('critical_damage', 150) + equipment_stats['critical_damage'],
-                "base_attack": user_data.get('attack', 10),
-                "base_defense": user_data.get('defense', 5),
-                "base_critical_rate": user_data.get('critical_rate', 5),
-                "base_critical_damage": user_data.get('critical_damage', 150),
-                "equipment_stats": equipment_stats,
-                "inventory": {
-                    "items": inventory_with_details
-                },
-                "equipment": {},
-                "created_at": user_data['created_at'],
-                "last_updated": user_data['last_updated']
-            }
-            
-            # 处理装备数据
-            for equipment in equipment_items:
-                if equipment['item_id']:
-                    item_config = config_manager.get_item_by_id(equipment['item_id'])
-                    if item_config:
-                        result["equipment"][equipment['slot']] = {
-                            'id': equipment['item_id'],
-                            'name': item_config.get('item_name', equipment['item_id']),
-                            'description': item_config.get('description', ''),
-                            'type': item_config.get('item_type', ''),
-                            'rarity': item_config.get('rarity', 'common'),
-                            'equipped_at': equipment['equipped_at']
-                        }
-                    else:
-                        result["equipment"][equipment['slot']] = {
-                            'id': equipment['item_id'],
-                            'name': equipment['item_id'],
-                            'description': '未知装备',
-                            'type': 'unknown',
-                            'rarity': 'common',
-                            'equipped_at': equipment['equipped_at']
-                        }
-                else:
-                    result["equipment"][equipment['slot']] = None
-            
-            return result
+            return player.to_dict()
         except Exception as e:
             print(f"获取用户数据出错: {e}")
             return self.create_user_data(username)
 
     def save_user_data(self, username, data):
-        """保存用户数据"""
+        """保存用户数据（只写回发生变化的列）"""
         try:
-            now = datetime.now().isoformat()
-            
-            # 更新基础用户数据
-            self.db.execute_query(
-                "UPDATE user_data SET hp = ?, mp = ?, max_hp = ?, max_mp = ?, gold = ?, experience = ?, level = ?, attack = ?, defense = ?, critical_rate = ?, critical_damage = ?, last_updated = ? WHERE username = ?",
-                (data['HP'], data['MP'], 
-                 data.get('base_max_HP', data.get('max_HP', 100)), 
-                 data.get('base_max_MP', data.get('max_MP', 50)),
-                 data['gold'], 
-                 data.get('experience', 0), data.get('level', 1), 
-                 data.get('base_attack', data.get('attack', 10)), 
-                 data.get('base_defense', data.get('defense', 5)),
-                 data.get('base_critical_rate', data.get('critical_rate', 5)), 
-                 data.get('base_critical_damage', data.get('critical_damage', 150)),
-                 now, username)
-            )
+            with self.unit_of_work() as uow:
+                player = uow.get(username)
+                if not player:
+                    return False
+                player.apply_user_data(data)
             
             return True
         except Exception as e:
@@ -292,25 +408,11 @@ class UserManager:
     def add_item_to_inventory(self, username, item_id, quantity=1):
         """向背包添加物品"""
         try:
-            # 查找是否已有该物品
-            existing_item = self.db.execute_query(
-                "SELECT id, quantity FROM user_inventory WHERE username = ? AND item_id = ?",
-                (username, item_id), fetch_one=True
-            )
-            
-            if existing_item:
-                # 更新数量
-                new_quantity = existing_item['quantity'] + quantity
-                self.db.execute_query(
-                    "UPDATE user_inventory SET quantity = ? WHERE id = ?",
-                    (new_quantity, existing_item['id'])
-                )
-            else:
-                # 添加新物品
-                self.db.execute_query(
-                    "INSERT INTO user_inventory (username, item_id, quantity, acquired_at) VALUES (?, ?, ?, ?)",
-                    (username, item_id, quantity, datetime.now().isoformat())
-                )
+            with self.unit_of_work() as uow:
+                player = uow.get(username)
+                if not player:
+                    return False
+                player.add_item(item_id, quantity, config_manager.get_item_by_id(item_id))
             
             return True
         except Exception as e:
@@ -320,25 +422,10 @@ class UserManager:
     def remove_item_from_inventory(self, username, item_id, quantity=1):
         """从背包移除物品"""
         try:
-            existing_item = self.db.execute_query(
-                "SELECT id, quantity FROM user_inventory WHERE username = ? AND item_id = ?",
-                (username, item_id), fetch_one=True
-            )
-            
-            if existing_item:
-                if existing_item['quantity'] <= quantity:
-                    # 删除物品
-                    self.db.execute_query(
-                        "DELETE FROM user_inventory WHERE id = ?",
-                        (existing_item['id'],)
-                    )
-                else:
-                    # 减少数量
-                    new_quantity = existing_item['quantity'] - quantity
-                    self.db.execute_query(
-                        "UPDATE user_inventory SET quantity = ? WHERE id = ?",
-                        (new_quantity, existing_item['id'])
-                    )
+            with self.unit_of_work() as uow:
+                player = uow.get(username)
+                if player:
+                    player.remove_item(item_id, quantity)
             
             return True
         except Exception as e:
@@ -348,33 +435,21 @@ class UserManager:
     def equip_item(self, username, item_id, slot):
         """装备物品"""
         try:
-            # 检查背包中是否有该物品
-            inventory_item = self.db.execute_query(
-                "SELECT quantity FROM user_inventory WHERE username = ? AND item_id = ?",
-                (username, item_id), fetch_one=True
-            )
-            
-            if not inventory_item or inventory_item['quantity'] < 1:
-                return False, "背包中没有该物品"
-            
-            # 获取当前装备
-            current_equipment = self.db.execute_query(
-                "SELECT item_id FROM user_equipment WHERE username = ? AND slot = ?",
-                (username, slot), fetch_one=True
-            )
-            
-            # 如果该槽位已有装备，先卸下
-            if current_equipment and current_equipment['item_id']:
-                self.add_item_to_inventory(username, current_equipment['item_id'], 1)
-            
-            # 装备新物品
-            self.db.execute_query(
-                "UPDATE user_equipment SET item_id = ?, equipped_at = ? WHERE username = ? AND slot = ?",
-                (item_id, datetime.now().isoformat(), username, slot)
-            )
-            
-            # 从背包移除
-            self.remove_item_from_inventory(username, item_id, 1)
+            with self.unit_of_work() as uow:
+                player = uow.get(username)
+                
+                # 检查背包中是否有该物品
+                if not player or player.quantity_of(item_id) < 1:
+                    return False, "背包中没有该物品"
+                
+                # 如果该槽位已有装备，先卸下放回背包
+                current = player.unequip(slot)
+                if current:
+                    player.add_item(current.item_id, 1, config_manager.get_item_by_id(current.item_id))
+                
+                # 装备新物品并从背包移除
+                player.equip(slot, item_id, config_manager.get_item_by_id(item_id), datetime.now().isoformat())
+                player.remove_item(item_id, 1)
             
             return True, "装备成功"
         except Exception as e:
@@ -383,24 +458,16 @@ class UserManager:
     def unequip_item(self, username, slot):
         """卸下装备"""
         try:
-            current_equipment = self.db.execute_query(
-                "SELECT item_id FROM user_equipment WHERE username = ? AND slot = ?",
-                (username, slot), fetch_one=True
-            )
-            
-            if not current_equipment or not current_equipment['item_id']:
-                return False, "该槽位没有装备"
-            
-            item_id = current_equipment['item_id']
-            
-            # 卸下装备
-            self.db.execute_query(
-                "UPDATE user_equipment SET item_id = ?, equipped_at = ? WHERE username = ? AND slot = ?",
-                (None, None, username, slot)
-            )
-            
-            # 放回背包
-            self.add_item_to_inventory(username, item_id, 1)
+            with self.unit_of_work() as uow:
+                player = uow.get(username)
+                current = player.equipment.get(slot) if player else None
+                
+                if not current:
+                    return False, "该槽位没有装备"
+                
+                # 卸下装备并放回背包
+                player.unequip(slot)
+                player.add_item(current.item_id, 1, config_manager.get_item_by_id(current.item_id))
             
             return True, "卸下成功"
         except Exception as e:
@@ -331,17 +331,32 @@ async function sendMessage() {
             body: JSON.stringify({
                 message: message,
                 character: currentCharacter,
-                language: '中文'
+                language: '中文',
+                stream: true
             })
         });
         
         if (!response) return; // 认证失败已处理
         
-        const data = await response.json();
+        // 流式接收AI回复，收到第一段文字时就开始显示
+        let replySpan = null;
+        const data = await readChatStream(response, (text) => {
+            if (!replySpan) {
+                hideTypingIndicator();
+                replySpan = addMessageToChat(currentCharacter, '', 'assistant');
+            }
+            replySpan.textContent += text;
+            const chatDisplay = document.getElementById('chatDisplay');
+            chatDisplay.scrollTop = chatDisplay.scrollHeight;
+        });
         
         if (data.success) {
-            // 添加AI回复到聊天窗口
-            addMessageToChat(currentCharacter, data.reply, 'assistant');
+            // 添加AI回复到聊天窗口（流式时替换为服务器保存的完整回复）
+            if (replySpan) {
+                replySpan.textContent = data.reply;
+            } else {
+                addMessageToChat(currentCharacter, data.reply, 'assistant');
+            }
             
             // 在联机模式下，AI回复只在本地显示，不发送到房间
             // if (isMultiplayerMode && currentRoomId) {
@@ -370,6 +385,46 @@ async function sendMessage() {
     }
 }
 
+// 读取 /chat 的SSE流，每收到一段文字调用 onDelta，返回 {success, reply} 或 {success: false, error}
+async function readChatStream(response, onDelta) {
+    const contentType = response.headers.get('Content-Type') || '';
+    if (!contentType.includes('text/event-stream')) {
+        // 服务器返回了普通JSON（例如参数错误）
+        return await response.json();
+    }
+    
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder('utf-8');
+    let buffer = '';
+    let result = { success: false, error: '连接中断' };
+    
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) >= 0) {
+            const rawEvent = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+            
+            const dataLine = rawEvent.split('\n').find(line => line.startsWith('data: '));
+            if (!dataLine) continue;
+            
+            const event = JSON.parse(dataLine.slice(6));
+            if (event.type === 'delta') {
+                onDelta(event.text);
+            } else if (event.type === 'done') {
+                result = { success: true, reply: event.reply };
+            } else if (event.type === 'error') {
+                result = { success: false, error: event.error };
+            }
+        }
+    }
+    
+    return result;
+}
+
 // 加载角色聊天历史
 async function loadCharacterHistory(character) {
     try {
@@ -640,6 +695,8 @@ function addMessageToChat(sender, content, type) {
     
     chatDisplay.appendChild(messageDiv);
     chatDisplay.scrollTop = chatDisplay.scrollHeight;
+    
+    return contentSpan;
 }
 
 // 显示输入状态指示器
@@ -1182,8 +1239,9 @@ async function getCurrentUserData() {
 // ===== 联机功能 =====
 let currentRoomId = null;
 let currentRoomUsers = null;
-let lastMessageTimestamp = 0;
+let lastRoomMessageSeq = 0;
 let messagePollingInterval = null;
+let roomEventController = null;
 let isMultiplayerMode = false;
 
 // 打开联机模态框
@@ -1324,9 +1382,10 @@ function exitMultiplayerMode() {
     isMultiplayerMode = false;
     currentRoomId = null;
     currentRoomUsers = null;
-    lastMessageTimestamp = 0;
+    lastRoomMessageSeq = 0;
     
-    // 停止消息轮询
+    // 停止消息推送/轮询
+    stopRoomEvents();
     if (messagePollingInterval) {
         clearInterval(messagePollingInterval);
         messagePollingInterval = null;
@@ -1681,14 +1740,115 @@ async function sendInteraction() {
     }
 }
 
-// 开始消息轮询
+// 开始接收房间消息：优先使用服务器推送，浏览器不支持流式读取时退回5秒轮询
 function startMessagePolling() {
     if (messagePollingInterval) {
         clearInterval(messagePollingInterval);
+        messagePollingInterval = null;
     }
     
-    messagePollingInterval = setInterval(loadRoomMessages, 5000);
-    loadRoomMessages(); // 立即加载一次
+    if (window.ReadableStream && window.AbortController) {
+        connectRoomEvents();
+    } else {
+        messagePollingInterval = setInterval(loadRoomMessages, 5000);
+        loadRoomMessages(); // 立即加载一次
+    }
+}
+
+// 停止房间消息推送
+function stopRoomEvents() {
+    if (roomEventController) {
+        roomEventController.abort();
+        roomEventController = null;
+    }
+}
+
+// 连接房间消息推送，断线后从最后收到的消息之后继续
+async function connectRoomEvents() {
+    stopRoomEvents();
+    const roomId = currentRoomId;
+    const controller = new AbortController();
+    roomEventController = controller;
+    let retryDelay = 1000;
+    
+    while (currentRoomId === roomId && !controller.signal.aborted) {
+        try {
+            const response = await makeAuthenticatedRequest(`${API_BASE_URL}/room_events`, {
+                method: 'POST',
+                body: JSON.stringify({ room_id: roomId, last_id: lastRoomMessageSeq }),
+                signal: controller.signal
+            });
+            
+            if (!response) return; // 认证失败已处理
+            
+            const contentType = response.headers.get('Content-Type') || '';
+            if (!contentType.includes('text/event-stream')) {
+                // 房间不存在或已不在房间中
+                const data = await response.json();
+                console.error('房间推送连接失败:', data.error);
+                return;
+            }
+            
+            retryDelay = 1000;
+            await readRoomEvents(response);
+        } catch (error) {
+            if (controller.signal.aborted) return;
+            console.error('房间推送连接中断:', error);
+        }
+        
+        await new Promise(resolve => setTimeout(resolve, retryDelay));
+        retryDelay = Math.min(retryDelay * 2, 30000);
+    }
+}
+
+// 读取房间推送事件（服务器结束连接时返回）
+async function readRoomEvents(response) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder('utf-8');
+    let buffer = '';
+    
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) >= 0) {
+            const rawEvent = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+            
+            // 以冒号开头的是心跳注释
+            let eventType = 'message';
+            let dataText = null;
+            rawEvent.split('\n').forEach(line => {
+                if (line.startsWith('event: ')) {
+                    eventType = line.slice(7);
+                } else if (line.startsWith('data: ')) {
+                    dataText = line.slice(6);
+                }
+            });
+            if (dataText === null) continue;
+            
+            const payload = JSON.parse(dataText);
+            if (eventType === 'message') {
+                displayRoomMessagesInChat([payload]);
+            } else if (eventType === 'room_info') {
+                updateRoomState(payload);
+            }
+        }
+    }
+}
+
+// 更新房间状态（只在用户列表变化时更新互动目标）
+function updateRoomState(roomInfo) {
+    const currentUsername = localStorage.getItem('currentUser');
+    const newUserList = roomInfo.users.map(u => u.username).sort();
+    const oldUserList = currentRoomUsers ? currentRoomUsers.map(u => u.username).sort() : [];
+    
+    if (JSON.stringify(newUserList) !== JSON.stringify(oldUserList)) {
+        updateInteractionTargets(roomInfo.users, currentUsername);
+        currentRoomUsers = roomInfo.users;
+    }
 }
 
 // 加载房间消息
@@ -1697,12 +1857,12 @@ async function loadRoomMessages() {
     
     console.log('=== 加载房间消息 ===');
     console.log('房间ID:', currentRoomId);
-    console.log('上次消息时间戳:', lastMessageTimestamp);
+    console.log('上次消息序号:', lastRoomMessageSeq);
     
     try {
         const requestBody = {
             room_id: currentRoomId,
-            since_timestamp: lastMessageTimestamp
+            since_id: lastRoomMessageSeq
         };
         
         console.log('请求参数:', requestBody);
@@ -1727,15 +1887,7 @@ async function loadRoomMessages() {
             
             // 更新房间信息（只在用户列表变化时更新）
             if (data.room_info) {
-                const currentUsername = localStorage.getItem('currentUser');
-                const newUserList = data.room_info.users.map(u => u.username).sort();
-                const oldUserList = currentRoomUsers ? currentRoomUsers.map(u => u.username).sort() : [];
-                
-                // 只有当用户列表发生变化时才更新选择框
-                if (JSON.stringify(newUserList) !== JSON.stringify(oldUserList)) {
-                    updateInteractionTargets(data.room_info.users, currentUsername);
-                    currentRoomUsers = data.room_info.users;
-                }
+                updateRoomState(data.room_info);
             }
         }
     } catch (error) {
@@ -1752,7 +1904,8 @@ function displayRoomMessagesInChat(messages) {
     
     messages.forEach(msg => {
         console.log('处理消息:', msg);
-        if (msg.timestamp > lastMessageTimestamp) {
+        // 按序号去重：同一时刻发出的多条消息时间戳可能相同，不能按时间戳过滤
+        if (msg.seq > lastRoomMessageSeq) {
             console.log('显示新消息:', msg.content, '时间戳:', msg.timestamp);
             const messageElement = document.createElement('div');
             messageElement.className = 'message';
@@ -1798,7 +1951,7 @@ function displayRoomMessagesInChat(messages) {
             }
             
             chatDisplay.appendChild(messageElement);
-            lastMessageTimestamp = Math.max(lastMessageTimestamp, msg.timestamp);
+            lastRoomMessageSeq = Math.max(lastRoomMessageSeq, msg.seq);
         }
     });
     
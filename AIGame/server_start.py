@@ -54,16 +54,7 @@ def init_database():
         
         from database_separation import db_separation_manager
         
-        # 删除旧数据库文件以重新创建
-        #game_db = os.path.join(backend_path, 'game_data.db')
-        world_db = os.path.join(backend_path, 'world_data.db')
-        # if os.path.exists(game_db):
-        #     os.remove(game_db)
-        #     print("🗑️ 删除旧的游戏数据库")
-        if os.path.exists(world_db):
-            os.remove(world_db)
-            print("🗑️ 删除旧的世界数据库")
-        
+        # 世界数据库按配置文件哈希增量构建，无需在此删除
         # 初始化分离数据库
         db_separation_manager.init_databases()
         print("✅ 分离数据库系统初始化成功")